@@ -0,0 +1,467 @@
+"""
+Alert rules evaluated on the data itself, as it is ingested.
+
+datafetcher.py passes every new sample (series name: value) to
+`AlertEngine.ingest()`. Each rule keeps a constant amount of state between
+samples, so nothing is re-queried from the database:
+
+- `Threshold`: the value is below or above a limit, e.g. a room colder
+  than 16 °C.
+- `RateOfChange`: the value rises or falls faster than a limit per hour,
+  measured over at least `period` seconds, e.g. an open window.
+- `Staleness`: no new value for `max_age` seconds.
+- `WindowAggregate`: the mean, minimum or maximum over the last `window`
+  seconds is below or above a limit, e.g. PV production at noon. The
+  window is kept as a ring of BUCKETS buckets (sum, count, min and max).
+
+Rules fire after `for_samples` breaching samples in a row and clear only
+when the value is back past the limit by the `clear` margin (hysteresis),
+so a value hovering around a limit doesn't flap. Rules with `hours` are
+only evaluated between those hours and clear outside them. A message is
+sent when a rule fires and when it clears.
+
+Rules are declared in the JSON file given by the ALERT_RULES_FILE
+environment variable (default alert_rules.json), as a list of objects with
+a "type" (threshold, rate, stale or window) and the fields of the rule.
+Without the file `default_rules()` is used.
+
+The module provides the following:
+
+- `Threshold`, `RateOfChange`, `Staleness`, `WindowAggregate`: Rule types.
+- `default_rules()`: The rules used without a rules file.
+- `load_rules(path)`: Reads rules from a JSON file.
+- `AlertEngine`: Evaluates rules on incoming samples and sends alerts.
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from message_sender import notify
+
+
+RULES_FILE = os.getenv("ALERT_RULES_FILE", "alert_rules.json")
+BUCKETS = 12
+
+ROOMS = {
+    "bathroom_upper": "Bathroom upper",
+    "bathroom_lower": "Bathroom lower",
+    "first_bedroom": "First bedroom",
+    "second_bedroom": "Second bedroom",
+    "third_bedroom": "Third bedroom",
+}
+
+
+@dataclass
+class Rule(ABC):
+    """
+    Common fields and the firing logic of all rules.
+
+    Attributes:
+        name (str): Unique name of the rule.
+        series (str): The series, as in latest_sample.SLOTS.
+        message (str): Description sent with the alert.
+        hours (list): Optional [start, end) hours when the rule is active.
+        for_samples (int): Breaching samples in a row needed to fire.
+        active (bool): The alert is active.
+        breaches (int): Breaching samples in a row.
+        observed (float): The value compared with the limits last time.
+        applied (bool): The rule was active at the last sample.
+    """
+
+    name: str
+    series: str
+    message: str = ""
+    hours: list = None
+    for_samples: int = 1
+    active: bool = field(default=False, init=False)
+    breaches: int = field(default=0, init=False)
+    observed: float = field(default=None, init=False)
+    applied: bool = field(default=False, init=False)
+
+    def applies(self, moment):
+        if self.hours is None:
+            return True
+        start, end = self.hours
+        return start <= moment.hour < end
+
+    def reset(self):
+        """
+        Forgets the samples seen, when the rule becomes active again.
+        """
+        self.breaches = 0
+
+    @abstractmethod
+    def evaluate(self, moment, value):
+        """
+        Compares a sample with the rule.
+
+        Parameters:
+            moment (datetime): Time of the sample.
+            value (float): The value, None if the series has no new sample.
+
+        Returns:
+            tuple: (breached, cleared) booleans, or None if the sample
+            doesn't decide anything yet.
+        """
+
+    def update(self, moment, value):
+        """
+        Evaluates a sample and changes the state of the alert.
+
+        Parameters:
+            moment (datetime): Time of the sample.
+            value (float): The value, None if the series has no new sample.
+
+        Returns:
+            str or None: 'fired', 'cleared' or None if nothing changed.
+        """
+        if not self.applies(moment):
+            self.applied = False
+            self.breaches = 0
+            if self.active:
+                self.active = False
+                return "cleared"
+            return None
+        if not self.applied:
+            # Samples from before the rule's hours, e.g. yesterday's window
+            self.applied = True
+            self.reset()
+
+        result = self.evaluate(moment, value)
+        if result is None:
+            return None
+        breached, cleared = result
+
+        if not self.active:
+            self.breaches = self.breaches + 1 if breached else 0
+            if self.breaches >= self.for_samples:
+                self.active = True
+                return "fired"
+        elif cleared:
+            self.active = False
+            self.breaches = 0
+            return "cleared"
+
+        return None
+
+
+def outside(value, below, above, margin=0.0):
+    """
+    Checks a value against optional lower and upper limits moved inwards
+    by a margin.
+
+    Returns:
+        bool: True if the value is below `below + margin` or above
+        `above - margin`.
+    """
+    return (below is not None and value < below + margin) \
+        or (above is not None and value > above - margin)
+
+
+@dataclass
+class Threshold(Rule):
+    """
+    Fires when the value is below `below` or above `above`.
+
+    Attributes:
+        below (float): The lower limit.
+        above (float): The upper limit.
+        clear (float): Hysteresis margin needed to clear the alert.
+    """
+
+    below: float = None
+    above: float = None
+    clear: float = 0.0
+
+    def evaluate(self, moment, value):
+        if value is None:
+            return None
+        self.observed = value
+        return (outside(value, self.below, self.above),
+                not outside(value, self.below, self.above, self.clear))
+
+
+@dataclass
+class RateOfChange(Rule):
+    """
+    Fires when the value rises faster than `rise` or falls faster than
+    `fall` per hour. The rate is measured against a reference sample at
+    least `period` seconds old, so small steps of a sensor between
+    close samples don't count.
+
+    Attributes:
+        rise (float): The largest allowed rise per hour.
+        fall (float): The largest allowed fall per hour (positive).
+        period (float): Seconds the rate is measured over.
+        clear (float): Hysteresis margin per hour needed to clear.
+        reference (tuple): Time (seconds) and value of the reference sample.
+    """
+
+    rise: float = None
+    fall: float = None
+    period: float = 900
+    clear: float = 0.0
+    reference: tuple = field(default=None, init=False)
+
+    def reset(self):
+        super().reset()
+        self.reference = None
+
+    def evaluate(self, moment, value):
+        if value is None:
+            return None
+        now = moment.timestamp()
+        if self.reference is None:
+            self.reference = (now, value)
+            return None
+        start, start_value = self.reference
+        if now - start < self.period:
+            return None
+
+        self.reference = (now, value)
+        rate = (value - start_value) / (now - start) * 3600
+        self.observed = rate
+        below = -self.fall if self.fall is not None else None
+        return (outside(rate, below, self.rise),
+                not outside(rate, below, self.rise, self.clear))
+
+
+@dataclass
+class Staleness(Rule):
+    """
+    Fires when the series has no new value for `max_age` seconds. It is
+    evaluated on every ingestion, also when the series is missing.
+
+    Attributes:
+        max_age (float): Seconds without a new value.
+        last (float): Time (seconds) of the last value, or of the first
+        evaluation if there was none yet.
+    """
+
+    max_age: float = 900
+    last: float = field(default=None, init=False)
+
+    def reset(self):
+        super().reset()
+        self.last = None
+
+    def evaluate(self, moment, value):
+        now = moment.timestamp()
+        if value is not None or self.last is None:
+            self.last = now
+        self.observed = now - self.last
+        return self.observed > self.max_age, self.observed <= self.max_age
+
+
+@dataclass
+class WindowAggregate(Rule):
+    """
+    Fires when the mean, minimum or maximum of the last `window` seconds
+    is below `below` or above `above`. It waits until one whole window
+    has been seen.
+
+    Attributes:
+        window (float): The length of the window in seconds.
+        function (str): 'mean', 'min' or 'max'.
+        below (float): The lower limit.
+        above (float): The upper limit.
+        clear (float): Hysteresis margin needed to clear the alert.
+        buckets (list): Ring of [index, sum, count, min, max] buckets.
+        first (float): Time (seconds) of the first sample.
+    """
+
+    window: float = 3600
+    function: str = "mean"
+    below: float = None
+    above: float = None
+    clear: float = 0.0
+    buckets: list = field(default=None, init=False)
+    first: float = field(default=None, init=False)
+
+    def reset(self):
+        super().reset()
+        self.buckets = None
+        self.first = None
+
+    def add(self, now, value):
+        if self.buckets is None:
+            self.buckets = [[None, 0.0, 0, None, None]
+                            for _ in range(BUCKETS)]
+        index = int(now // (self.window / BUCKETS))
+        bucket = self.buckets[index % BUCKETS]
+        if bucket[0] != index:
+            bucket[:] = [index, 0.0, 0, value, value]
+        bucket[1] += value
+        bucket[2] += 1
+        bucket[3] = min(bucket[3], value)
+        bucket[4] = max(bucket[4], value)
+
+    def aggregate(self, now):
+        """
+        Returns the aggregate of the buckets within the window.
+
+        Parameters:
+            now (float): The current time in seconds.
+
+        Returns:
+            float or None: The aggregate, None without samples.
+        """
+        current = int(now // (self.window / BUCKETS))
+        buckets = [bucket for bucket in self.buckets or []
+                   if bucket[0] is not None
+                   and current - BUCKETS < bucket[0] <= current]
+        count = sum(bucket[2] for bucket in buckets)
+        if not count:
+            return None
+        if self.function == "min":
+            return min(bucket[3] for bucket in buckets)
+        if self.function == "max":
+            return max(bucket[4] for bucket in buckets)
+        return sum(bucket[1] for bucket in buckets) / count
+
+    def evaluate(self, moment, value):
+        if value is None:
+            return None
+        now = moment.timestamp()
+        if self.first is None:
+            self.first = now
+        self.add(now, value)
+        if now - self.first < self.window:
+            return None
+
+        aggregate = self.observed = self.aggregate(now)
+        return (outside(aggregate, self.below, self.above),
+                not outside(aggregate, self.below, self.above, self.clear))
+
+
+RULE_TYPES = {
+    "threshold": Threshold,
+    "rate": RateOfChange,
+    "stale": Staleness,
+    "window": WindowAggregate,
+}
+
+
+def default_rules():
+    """
+    Returns the rules used when there is no rules file.
+
+    Returns:
+        list: Rule objects.
+    """
+    rules = []
+    for series, room in ROOMS.items():
+        rules.append(Threshold(
+            f"{series}_cold", series, f"{room} is below 16 °C",
+            below=16, clear=1, for_samples=3))
+        rules.append(RateOfChange(
+            f"{series}_falling", series,
+            f"{room} is cooling fast, is a window open?",
+            fall=3, period=900, clear=1))
+
+    rules += [
+        Staleness("smart_meter_stale", "forward_energy",
+                  "No smart meter reading for 15 minutes", max_age=900),
+        Staleness("weather_stale", "weather_temperature",
+                  "No weather data for 30 minutes", max_age=1800),
+        # The inverter is offline at night
+        Staleness("pv_stale", "live_production",
+                  "No PV reading for 15 minutes", hours=[9, 17],
+                  max_age=900),
+        WindowAggregate("pv_low_noon", "live_production",
+                        "PV production at noon is far below expectation",
+                        hours=[11, 14], window=3600, function="mean",
+                        below=300, clear=100),
+    ]
+    return rules
+
+
+def load_rules(path=RULES_FILE):
+    """
+    Reads rules from a JSON file.
+
+    Parameters:
+        path (str): The path of the file.
+
+    Returns:
+        list: Rule objects, default_rules() if the file doesn't exist.
+
+    Raises:
+        ValueError: If the file has an unknown rule type or field.
+    """
+    try:
+        with open(path) as file:
+            declarations = json.load(file)
+    except FileNotFoundError:
+        return default_rules()
+
+    rules = []
+    for declaration in declarations:
+        declaration = dict(declaration)
+        kind = declaration.pop("type", None)
+        if kind not in RULE_TYPES:
+            raise ValueError(f"Unknown rule type: {kind}")
+        try:
+            rules.append(RULE_TYPES[kind](**declaration))
+        except TypeError as e:
+            raise ValueError(f"Invalid rule {declaration}: {e}") from e
+
+    return rules
+
+
+class AlertEngine:
+    """
+    Evaluates the rules on every ingested sample.
+
+    Parameters:
+        rules (list): Rule objects, load_rules() if None.
+        notify: Optional function called with the message (str) of every
+        fired or cleared alert.
+    """
+
+    def __init__(self, rules=None, notify=None):
+        self.rules = rules if rules is not None else load_rules()
+        self.notify = notify
+
+    def ingest(self, values, moment=None):
+        """
+        Evaluates a sample of every series and sends messages about
+        alerts which fired or cleared.
+
+        Parameters:
+            values (dict): Series name: value of the new sample. Missing
+            series only advance staleness rules.
+            moment (datetime): Time of the sample, now if None.
+
+        Returns:
+            list: (rule name, 'fired' or 'cleared') tuples.
+        """
+        moment = moment or datetime.now().replace(microsecond=0)
+        events = []
+        for rule in self.rules:
+            value = values.get(rule.series)
+            if value is None and not isinstance(rule, Staleness):
+                continue
+            event = rule.update(moment, value)
+            if event is not None:
+                events.append((rule.name, event))
+                self._message(moment, rule, event)
+
+        return events
+
+    def _message(self, moment, rule, event):
+        observed = f" ({rule.observed:.1f})" if rule.observed is not None \
+            else ""
+        notify(f"{moment} {'Alert' if event == 'fired' else 'Cleared'}: "
+               f"{rule.message or rule.name}{observed}", self.notify)
+
+    def active(self):
+        """
+        Returns the names of active alerts.
+
+        Returns:
+            list: Rule names.
+        """
+        return [rule.name for rule in self.rules if rule.active]
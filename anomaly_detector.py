@@ -0,0 +1,411 @@
+"""
+Online anomaly detection on live production, heater power and room
+temperatures.
+
+datafetcher.py passes every new sample to `AnomalyDetector.ingest()`,
+next to the alert rules. The heater's power is derived from consecutive
+forward_energy readings. Samples of a series are averaged over SLOT
+seconds; when a slot ends, its mean is compared with a seasonal baseline
+of that time of day (SLOTS_PER_DAY slots), an exponentially weighted
+mean and variance updated once a day:
+
+    score = (value - expected) / max(standard deviation, floor)
+
+A slot is anomalous when the score is beyond THRESHOLD in a watched
+direction (PV production only low, the heater and the rooms both ways)
+and the baseline of the slot has seen MIN_OBSERVATIONS days. After
+PERSISTENCE anomalous slots in a row an event is opened, stored in the
+anomaly_events table and sent by Telegram; the first normal slot closes
+it. Anomalous slots update the baseline with a smaller weight, so a
+failed string doesn't become normal within days, while a lasting change
+(a new heating schedule) is eventually learned.
+
+The state of a series is three arrays of SLOTS_PER_DAY doubles, stored in
+the anomaly_state table when a slot ends, so baselines survive restarts.
+
+The module provides the following:
+
+- `create_anomaly_tables()`: Creates the state and event tables.
+- `SeasonalBaseline`: Time of day baseline and slot averaging of a series.
+- `AnomalyDetector`: Evaluates incoming samples and emits events.
+- `recent_events(limit)`: Returns the latest events for the dashboard.
+"""
+
+import math
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from data_access import engine, epoch
+from message_sender import notify
+
+
+SLOT = 900
+SLOTS_PER_DAY = 86400 // SLOT
+ALPHA = 0.1
+# Weight of anomalous slots in the baseline, relative to ALPHA
+ANOMALY_WEIGHT = 0.2
+THRESHOLD = 4.0
+MIN_OBSERVATIONS = 7
+PERSISTENCE = 2
+# Longest gap (s) between two forward_energy readings used for the power
+MAX_ENERGY_GAP = 600
+
+# Series: (label, watched directions, floor of the standard deviation)
+SERIES = {
+    "live_production": ("PV production", ("low",), 150.0),
+    "heater_power": ("Heater power", ("low", "high"), 300.0),
+    "bathroom_upper": ("Bathroom upper", ("low", "high"), 0.7),
+    "bathroom_lower": ("Bathroom lower", ("low", "high"), 0.7),
+    "first_bedroom": ("First bedroom", ("low", "high"), 0.7),
+    "second_bedroom": ("Second bedroom", ("low", "high"), 0.7),
+    "third_bedroom": ("Third bedroom", ("low", "high"), 0.7),
+}
+
+
+def create_anomaly_tables():
+    """
+    Creates the anomaly_state table (baselines of the series) and the
+    anomaly_events table.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS anomaly_state ("
+                "series TEXT PRIMARY KEY, "
+                "streak INTEGER NOT NULL, "
+                "event INTEGER, "
+                "baseline BLOB NOT NULL)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS anomaly_events ("
+                "series TEXT NOT NULL, "
+                "start INTEGER NOT NULL, "
+                "end INTEGER, "
+                "direction TEXT NOT NULL, "
+                "value REAL, "
+                "expected REAL, "
+                "score REAL, "
+                "PRIMARY KEY (series, start)) WITHOUT ROWID"
+            )
+        )
+
+
+@dataclass
+class SeasonalBaseline:
+    """
+    Exponentially weighted mean and variance of every slot of the day,
+    and the average of the current slot.
+
+    Attributes:
+        floor (float): The smallest standard deviation used in scores.
+        mean, variance, count (array): Baseline of every slot of the day.
+        slot (int): Index (seconds since epoch // SLOT) of the current slot.
+        total (float): Sum of the samples in the current slot.
+        samples (int): Number of samples in the current slot.
+    """
+
+    floor: float
+    mean: array = field(
+        default_factory=lambda: array("d", [0.0] * SLOTS_PER_DAY))
+    variance: array = field(
+        default_factory=lambda: array("d", [0.0] * SLOTS_PER_DAY))
+    count: array = field(
+        default_factory=lambda: array("d", [0.0] * SLOTS_PER_DAY))
+    slot: int = None
+    total: float = 0.0
+    samples: int = 0
+
+    def to_bytes(self):
+        return (self.mean + self.variance + self.count).tobytes()
+
+    @classmethod
+    def from_bytes(cls, floor, data):
+        values = array("d")
+        values.frombytes(data)
+        return cls(floor, values[:SLOTS_PER_DAY],
+                   values[SLOTS_PER_DAY:2 * SLOTS_PER_DAY],
+                   values[2 * SLOTS_PER_DAY:])
+
+    def add(self, moment, value):
+        """
+        Adds a sample to the current slot.
+
+        Parameters:
+            moment (datetime): Time of the sample.
+            value (float): The value.
+
+        Returns:
+            tuple or None: (slot, mean) of the slot which ended before
+            this sample, None if the slot continues or had no samples.
+        """
+        slot = epoch(moment) // SLOT
+        ended = None
+        if slot != self.slot:
+            if self.samples:
+                ended = (self.slot, self.total / self.samples)
+            self.slot, self.total, self.samples = slot, 0.0, 0
+        self.total += value
+        self.samples += 1
+        return ended
+
+    def score(self, slot, value):
+        """
+        Compares the mean of a slot with the baseline of its time of day.
+
+        Returns:
+            tuple: (expected value, score), score None while the slot has
+            fewer than MIN_OBSERVATIONS observations.
+        """
+        index = slot % SLOTS_PER_DAY
+        expected = self.mean[index]
+        if self.count[index] < MIN_OBSERVATIONS:
+            return expected, None
+        deviation = max(math.sqrt(self.variance[index]), self.floor)
+        return expected, (value - expected) / deviation
+
+    def update(self, slot, value, weight=1.0):
+        """
+        Updates the baseline of the slot's time of day with its mean.
+        """
+        index = slot % SLOTS_PER_DAY
+        if not self.count[index]:
+            self.mean[index] = value
+        else:
+            alpha = ALPHA * weight
+            difference = value - self.mean[index]
+            increment = alpha * difference
+            self.mean[index] += increment
+            self.variance[index] = (1 - alpha) * (
+                self.variance[index] + difference * increment)
+        self.count[index] += 1
+
+
+class AnomalyDetector:
+    """
+    Evaluates incoming samples against the seasonal baselines and emits
+    anomaly events.
+
+    Parameters:
+        series (dict): Watched series, SERIES by default.
+        notify: Optional function called with the message (str) of every
+        opened or closed event.
+    """
+
+    def __init__(self, series=None, notify=None):
+        self.series = series if series is not None else SERIES
+        self.notify = notify
+        self.baselines = None
+        # Series: anomalous slots in a row and the start of the open event
+        self.streaks = {}
+        self.events = {}
+        self.last_energy = None
+
+    def load(self):
+        """
+        Reads the persisted baselines, or starts empty ones.
+
+        Returns:
+            None
+        """
+        create_anomaly_tables()
+        self.baselines = {name: SeasonalBaseline(floor)
+                          for name, (_, _, floor) in self.series.items()}
+        with engine.connect() as connection:
+            rows = connection.execute(
+                text("SELECT series, streak, event, baseline "
+                     "FROM anomaly_state")
+            ).all()
+        for name, streak, event, data in rows:
+            if name in self.baselines:
+                self.baselines[name] = SeasonalBaseline.from_bytes(
+                    self.series[name][2], data)
+                self.streaks[name] = streak
+                if event is not None:
+                    self.events[name] = event
+
+    def heater_power(self, moment, forward_energy):
+        """
+        Derives the heater's mean power (W) since the previous reading of
+        the forward_energy counter (kWh).
+
+        Returns:
+            float or None: The power, None after a gap or a counter reset.
+        """
+        now = moment.timestamp()
+        previous, self.last_energy = self.last_energy, (now, forward_energy)
+        if previous is None:
+            return None
+        elapsed = now - previous[0]
+        energy = forward_energy - previous[1]
+        if not 0 < elapsed <= MAX_ENERGY_GAP or energy < 0:
+            return None
+        return energy / elapsed * 3600 * 1000
+
+    def ingest(self, values, moment=None):
+        """
+        Adds a sample of every series and evaluates the slots which ended.
+
+        Parameters:
+            values (dict): Series name: value of the new sample, as
+            published by datafetcher.py.
+            moment (datetime): Time of the sample, now if None.
+
+        Returns:
+            list: (series, 'opened' or 'closed') tuples.
+        """
+        if self.baselines is None:
+            self.load()
+        moment = moment or datetime.now().replace(microsecond=0)
+        values = dict(values)
+        if values.get("forward_energy") is not None:
+            values["heater_power"] = self.heater_power(
+                moment, values["forward_energy"])
+
+        changes = []
+        ended = []
+        for name, baseline in self.baselines.items():
+            if values.get(name) is None:
+                continue
+            result = baseline.add(moment, values[name])
+            if result is not None:
+                change = self._evaluate(name, *result)
+                if change is not None:
+                    changes.append((name, change))
+                ended.append(name)
+        if ended:
+            self._save(ended)
+
+        return changes
+
+    def _evaluate(self, name, slot, value):
+        """
+        Scores the mean of an ended slot, updates the baseline and opens
+        or closes the event of the series.
+
+        Returns:
+            str or None: 'opened', 'closed' or None.
+        """
+        label, directions, _ = self.series[name]
+        baseline = self.baselines[name]
+        expected, score = baseline.score(slot, value)
+        direction = None
+        if score is not None:
+            if score < -THRESHOLD and "low" in directions:
+                direction = "low"
+            elif score > THRESHOLD and "high" in directions:
+                direction = "high"
+        baseline.update(slot, value,
+                        ANOMALY_WEIGHT if direction is not None else 1.0)
+
+        start = (slot - PERSISTENCE + 1) * SLOT
+        if direction is not None:
+            self.streaks[name] = self.streaks.get(name, 0) + 1
+            if self.streaks[name] == PERSISTENCE and name not in self.events:
+                self.events[name] = start
+                self._store_event(name, start, direction, value, expected,
+                                  score)
+                self._message(
+                    f"Anomaly: {label} is unusually {direction}, "
+                    f"{value:.1f} instead of about {expected:.1f} "
+                    f"(score {score:.1f})", slot)
+                return "opened"
+            if name in self.events:
+                self._store_event(name, self.events[name], direction, value,
+                                  expected, score)
+            return None
+
+        self.streaks[name] = 0
+        if name in self.events:
+            event = self.events.pop(name)
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        "UPDATE anomaly_events SET end = :end "
+                        "WHERE series = :series AND start = :start"
+                    ),
+                    {"end": slot * SLOT, "series": name, "start": event},
+                )
+            self._message(f"Back to normal: {label}, {value:.1f}", slot)
+            return "closed"
+
+        return None
+
+    def _store_event(self, name, start, direction, value, expected, score):
+        # The strongest slot of an event is kept
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO anomaly_events "
+                    "(series, start, direction, value, expected, score) "
+                    "VALUES (:series, :start, :direction, :value, "
+                    ":expected, :score) "
+                    "ON CONFLICT (series, start) DO UPDATE SET "
+                    "direction = excluded.direction, "
+                    "value = excluded.value, "
+                    "expected = excluded.expected, "
+                    "score = excluded.score "
+                    "WHERE ABS(excluded.score) > ABS(anomaly_events.score)"
+                ),
+                {"series": name, "start": start, "direction": direction,
+                 "value": value, "expected": expected, "score": score},
+            )
+
+    def _save(self, names):
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT OR REPLACE INTO anomaly_state "
+                    "(series, streak, event, baseline) "
+                    "VALUES (:series, :streak, :event, :baseline)"
+                ),
+                [
+                    {"series": name, "streak": self.streaks.get(name, 0),
+                     "event": self.events.get(name),
+                     "baseline": self.baselines[name].to_bytes()}
+                    for name in names
+                ],
+            )
+
+    def _message(self, message, slot):
+        moment = datetime(1970, 1, 1) + timedelta(seconds=(slot + 1) * SLOT)
+        notify(f"{moment} {message}", self.notify)
+
+
+def recent_events(limit=20):
+    """
+    Returns the latest anomaly events.
+
+    Parameters:
+        limit (int): The maximum number of events.
+
+    Returns:
+        list: Dictionaries with 'series' (label), 'start' and 'end'
+        (datetime, end None while open), 'direction', 'value',
+        'expected' and 'score', newest first.
+    """
+    create_anomaly_tables()
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT series, start, end, direction, value, expected, "
+                "score FROM anomaly_events ORDER BY start DESC LIMIT :limit"
+            ),
+            {"limit": limit},
+        ).mappings().all()
+
+    return [
+        {
+            **row,
+            "series": SERIES.get(row["series"], (row["series"],))[0],
+            "start": datetime(1970, 1, 1) + timedelta(seconds=row["start"]),
+            "end": datetime(1970, 1, 1) + timedelta(seconds=row["end"])
+            if row["end"] is not None else None,
+        }
+        for row in rows
+    ]
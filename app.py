@@ -24,6 +24,7 @@ The main features of the dashboard include:
    throughout a selected day.
    - It also displays the total solar energy produced on that day
    in kilowatt-hours (kWh).
+   - The forecast of 'pv_forecast' is drawn over the production.
 
 4. Monthly Production Bar Chart:
    - The bar chart displays the daily solar energy production
@@ -50,42 +51,158 @@ The main features of the dashboard include:
 8. Dropdowns and Date Pickers:
    - Dropdowns and date pickers allow users to select the desired month
    or date for data visualization.
+   - The compare mode overlays a month of several years or shows
+   year-over-year and month-over-month changes, from the small tables
+   built nightly by 'comparison_reports'.
+
+9. Any Range Line Chart:
+   - The line chart displays any series over a preset or custom range,
+   from an hour to several years, in a resolution chosen
+   by the query planner.
+
+10. Energy Balance Chart:
+   - The chart relates PV production, heater consumption and grid import
+   and export per hour, day or month, with self-consumption, heater share
+   and PV coverage, from the tables materialized by 'energy_balance'.
+
+11. Electricity Bills Chart:
+   - Monthly bills of the time-of-use tariff with net-metering credits,
+   cached by 'tariff', over a year or several years.
+
+12. Rooms and Heating Charts:
+   - Heating degree-days, heater consumption and kWh per degree-day
+   per day, and per room heat loss and heat-up rates and estimated
+   heater energy, from the daily tables of 'thermal_model'.
+
+13. Anomalies List:
+   - The latest anomalies of PV production, heater power and room
+   temperatures found by 'anomaly_detector', refreshed every minute.
 
 The dashboard is served on a local server and listens on port 8050.
+The layout is built on every page load by 'serve_layout', so the server
+can run for weeks with warm caches and without a nightly restart.
+Bulk data export routes from 'data_api' are registered on the same server,
+together with the '/health' endpoint checked by 'uptime_prober'.
 It utilizes Dash Bootstrap Components for styling and layout
 and Plotly graph objects for interactive and dynamic visualizations.
 """
 
 
+import startup_profiler
 import dash
 from dash import dcc
 from dash import html
 from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
+from flask import jsonify
 from sqlalchemy import (
-    create_engine,
     Column,
     Integer,
     DateTime,
     Date,
     Float,
-    func,
     String,
     desc,
+    text,
 )
 from sqlalchemy.orm import sessionmaker, declarative_base
-import pandas as pd
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+import anomaly_detector
+import comparison_reports
+import data_access
+import energy_balance
+import energy_counter
+import latest_sample
+import message_sender
+import pv_forecast
+import query_planner
+import rollups
+import tariff
+import telemetry
+import thermal_model
+from data_api import api
+
+# pandas and plotly are loaded on the first callback, not at startup
+pd = startup_profiler.lazy_import("pandas")
+go = startup_profiler.lazy_import("plotly.graph_objects")
+startup_profiler.mark("imports")
 
 
 app = dash.Dash(
     __name__, external_stylesheets=[dbc.themes.BOOTSTRAP, "/assets/styles.css"]
 )
 app.title = "House Energy"
+app.server.register_blueprint(api)
 Base = declarative_base()
-engine = create_engine("sqlite:///electricity.db")
+engine = data_access.engine
 refreshes = 0
+data_access.ensure_indexes()
+rollups.create_rollup_table()
+energy_counter.create_counter_tables()
+energy_balance.create_balance_tables()
+thermal_model.create_thermal_tables()
+anomaly_detector.create_anomaly_tables()
+tariff.create_tariff_tables()
+comparison_reports.create_comparison_tables()
+pv_forecast.create_forecast_tables()
+telemetry.create_telemetry_tables()
+latest_sample_reader = latest_sample.LatestSampleReader()
+# Seconds after which the latest sample means the data fetcher has stalled
+STALE_SAMPLE = 300
+# Daily room values of thermal_model: label and unit
+THERMAL_METRICS = {
+    "loss_rate": ("Heat loss rate", "1/h"),
+    "heat_up_rate": ("Heat-up rate", "°C/h"),
+    "energy": ("Estimated heater energy", "kWh"),
+    "temperature": ("Mean temperature", "°C"),
+}
+ROOM_NAMES = {
+    "bathroom_upper": "Bathroom upper",
+    "bathroom_lower": "Bathroom lower",
+    "first_bedroom": "First bedroom",
+    "second_bedroom": "Second bedroom",
+    "third_bedroom": "Third bedroom",
+}
+
+
+@app.server.route("/health")
+def health():
+    """
+    Health endpoint checked by uptime_prober.py. It runs a trivial query
+    and reads the age of the latest sample from the shared block, so it
+    is cheap enough to be requested every minute.
+
+    Returns:
+        Response: JSON document with 'status' ('ok', or 'stale' if the
+        latest sample is older than STALE_SAMPLE seconds), 'database' and
+        'sample_age' (seconds, None if unknown). Status code 503 if the
+        database can't be queried.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        database = True
+    except Exception:
+        database = False
+
+    sample = latest_sample_reader.read("forward_energy") \
+        or latest_sample_reader.read("weather_temperature")
+    sample_age = round((datetime.now() - sample[0]).total_seconds()) \
+        if sample else None
+
+    if not database:
+        status = "error"
+    elif sample_age is None or sample_age > STALE_SAMPLE:
+        status = "stale"
+    else:
+        status = "ok"
+
+    response = jsonify(
+        {"status": status, "database": database, "sample_age": sample_age})
+    response.status_code = 200 if database else 503
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
 
 class TuyaData(Base):
@@ -189,17 +306,9 @@ def available_months(start_month, start_year):
     dates_to_pick = []
     start_time = datetime(year=start_year, month=start_month, day=1)
     current_month = datetime.now().replace(day=1)
-    count = True
-    while count:
-        # dates_to_pick.append(start_time.strftime("%Y-%m"))
+    while start_time <= current_month:
         dates_to_pick.append(start_time)
         start_time = add_one_month(start_time)
-        # print(start_time)
-        if (
-            start_time.year == current_month.year
-            and start_time.month == current_month.month + 1
-        ):
-            count = False
 
     return dates_to_pick
 
@@ -234,6 +343,25 @@ def generate_dropdown_options(month, year):
         current date and time.
         - The function uses the 'available_months' function to get
         the list of available months.
+        - Options are cached until the current month changes.
+    """
+    return _cached_dropdown_options(
+        month, year, datetime.now().strftime("%Y-%m"))
+
+
+@lru_cache(maxsize=16)
+def _cached_dropdown_options(month, year, current_month):
+    """
+    Build dropdown options once per starting month and current month.
+
+    Parameters:
+        month (int): The starting month.
+        year (int): The starting year.
+        current_month (str): The current month in the format 'YYYY-MM',
+        used only as a part of the cache key.
+
+    Returns:
+        list: A list of dictionary objects with 'label' and 'value' keys.
     """
     options = [
         {
@@ -246,317 +374,773 @@ def generate_dropdown_options(month, year):
     return options
 
 
-app.layout = html.Div(
-    [
-        html.Link(rel="icon", href="/assets/favicon.ico", type="image/x-icon"),
-        dcc.Store(id="refresh-count-storage", data=0),
-        dbc.Row([html.P(" ")]),
-        dbc.Container(
-            className="container",
-            style={
-                "padding": "20px",
-                "max-width": "auto",
-                "margin": "0 auto",
-                "border": "2px solid black",
-            },
-            children=[
-                # First Main Row
-                dbc.Row(
-                    [html.H1("ELECTRICITY PRODUCTION",
-                             style={"text-align": "center"})]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="yield-value",
-                            className="yield-value",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([dcc.Graph(id="gauge-chart")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.H5("PICK A DAY:",
-                                 style={"text-align": "center"})]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.Div(
-                            dcc.DatePickerSingle(
-                                id="production_day_picker",
-                                date=datetime.now().replace(
-                                    hour=0, minute=0, second=0),
-                                min_date_allowed=datetime(2023, 7, 12),
-                                max_date_allowed=datetime.now()
-                                .replace(hour=1),
-                                display_format="DD-MM-YYYY",
-                                first_day_of_week=1,
+def date_bounds():
+    """
+    Get date values used by the date pickers and month dropdowns.
+
+    Returns:
+        dict: A dictionary with keys:
+            - 'today': today's date at midnight (default picker date).
+            - 'max_date_allowed': the latest date allowed in the pickers.
+            - 'month': the current month in the format 'YYYY-MM'.
+
+    Note:
+        - Values are computed once per day and cached.
+    """
+    return _cached_date_bounds(date.today())
+
+
+@lru_cache(maxsize=1)
+def _cached_date_bounds(today):
+    """
+    Compute date bounds for the given day.
+
+    Parameters:
+        today (date): The day the bounds are computed for.
+
+    Returns:
+        dict: See 'date_bounds'.
+    """
+    midnight = datetime(today.year, today.month, today.day)
+
+    return {
+        "today": midnight,
+        "max_date_allowed": midnight.replace(hour=1),
+        "month": midnight.strftime("%Y-%m"),
+    }
+
+
+# Range presets: (value, label) shown in the range dropdown
+RANGE_PRESET_LABELS = [
+    ("hour", "Last hour"),
+    ("day", "Last 24 hours"),
+    ("week", "Last 7 days"),
+    ("month", "Last 30 days"),
+    ("year", "Last year"),
+    ("all", "Last 5 years"),
+    ("custom", "Custom (date picker)"),
+]
+
+RANGE_PRESETS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+    "all": timedelta(days=5 * 365),
+}
+
+
+def generate_series_options():
+    """
+    Generate dropdown options for all series available in 'data_access'.
+
+    Returns:
+        list: A list of dictionary objects with 'label' and 'value' keys,
+        e.g. {'label': 'Live Production', 'value': 'live_production'}.
+    """
+    return [
+        {"label": name.replace("_", " ").title(), "value": name}
+        for name in data_access.SERIES
+    ]
+
+
+def serve_layout():
+    """
+    Build the dashboard layout for a single page load.
+
+    Dash calls this function every time the page is requested, so the date
+    pickers and month dropdowns always end on the current day even when
+    the server has been running for weeks. Date bounds and dropdown options
+    are cached per day in 'date_bounds' and 'generate_dropdown_options',
+    which keeps building the layout cheap.
+
+    Returns:
+        html.Div: The root component of the dashboard.
+    """
+    bounds = date_bounds()
+
+    return html.Div(
+        [
+            html.Link(rel="icon", href="/assets/favicon.ico", type="image/x-icon"),
+            dcc.Store(id="refresh-count-storage", data=0),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    # First Main Row
+                    dbc.Row(
+                        [html.H1("ELECTRICITY PRODUCTION",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="yield-value",
+                                className="yield-value",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="gauge-chart")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A DAY:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.Div(
+                                dcc.DatePickerSingle(
+                                    id="production_day_picker",
+                                    date=bounds["today"],
+                                    min_date_allowed=datetime(2023, 7, 12),
+                                    max_date_allowed=bounds["max_date_allowed"],
+                                    display_format="DD-MM-YYYY",
+                                    first_day_of_week=1,
+                                ),
+                                style={
+                                    "text-align": "center"
+                                },  # Center the date picker within the div
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="yield-that-day",
+                                className="yield-that-day",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="production_by_day_chart")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A MONTH:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="month-dropdown_bar",
+                                options=generate_dropdown_options(4, 2022),
+                                value=bounds["month"],
+                                placeholder="Select a month",
+                                clearable=False,
+                                style={"width": "150px", "margin": "0 auto"},
                             ),
-                            style={
-                                "text-align": "center"
-                            },  # Center the date picker within the div
-                        )
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="yield-that-day",
-                            className="yield-that-day",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([dcc.Graph(id="production_by_day_chart")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.H5("PICK A MONTH:",
-                                 style={"text-align": "center"})]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        dcc.Dropdown(
-                            id="month-dropdown_bar",
-                            options=generate_dropdown_options(4, 2022),
-                            value=datetime.now().strftime("%Y-%m"),
-                            placeholder="Select a month",
-                            clearable=False,
-                            style={"width": "150px", "margin": "0 auto"},
-                        ),
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="months-sum",
-                            className="months-sum",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([dcc.Graph(id="yield-bar-chart")]),
-                dcc.Interval(id="interval-component",
-                             interval=5000, n_intervals=0),
-                html.Div(id="refresh-count", style={"display": "none"}),
-            ],
-        ),
-        dbc.Row([html.P(" ")]),
-        dbc.Container(
-            className="container",
-            style={
-                "padding": "20px",
-                "max-width": "auto",
-                "margin": "0 auto",
-                "border": "2px solid black",
-            },
-            children=[
-                dbc.Row(
-                    [html.H1("ELECTRIC HEATER DATA",
-                             style={"text-align": "center"})]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="forward-energy-todays-value",
-                            className="forward-energy-todays-value",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.H5("PICK A DAY:",
-                                 style={"text-align": "center"})]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.Div(
-                            dcc.DatePickerSingle(
-                                id="heater_day_picker",
-                                date=datetime.now()
-                                .replace(hour=0, minute=0, second=0),
-                                min_date_allowed=datetime(2023, 7, 17),
-                                max_date_allowed=datetime.now()
-                                .replace(hour=1),
-                                display_format="DD-MM-YYYY",
-                                first_day_of_week=1,
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="months-sum",
+                                className="months-sum",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="yield-bar-chart")]),
+                    dcc.Interval(id="interval-component",
+                                 interval=5000, n_intervals=0),
+                    html.Div(id="refresh-count", style={"display": "none"}),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ELECTRIC HEATER DATA",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="forward-energy-todays-value",
+                                className="forward-energy-todays-value",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A DAY:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.Div(
+                                dcc.DatePickerSingle(
+                                    id="heater_day_picker",
+                                    date=bounds["today"],
+                                    min_date_allowed=datetime(2023, 7, 17),
+                                    max_date_allowed=bounds["max_date_allowed"],
+                                    display_format="DD-MM-YYYY",
+                                    first_day_of_week=1,
+                                ),
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="forward-energy-daily-value",
+                                className="forward-energy-daily-value",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="heater-chart")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A MONTH:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="month-dropdown_bar_heater",
+                                options=generate_dropdown_options(8, 2023),
+                                value=bounds["month"],
+                                placeholder="Select a month",
+                                clearable=False,
+                                style={"width": "150px", "margin": "0 auto"},
                             ),
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="forward-energy-daily-value",
-                            className="forward-energy-daily-value",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([dcc.Graph(id="heater-chart")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.H5("PICK A MONTH:",
-                                 style={"text-align": "center"})]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        dcc.Dropdown(
-                            id="month-dropdown_bar_heater",
-                            options=generate_dropdown_options(8, 2023),
-                            value=datetime.now().strftime("%Y-%m"),
-                            placeholder="Select a month",
-                            clearable=False,
-                            style={"width": "150px", "margin": "0 auto"},
-                        ),
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="heater-months-sum",
-                            className="months-sum",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([dcc.Graph(id="heater-bar-chart")]),
-            ],
-        ),
-        dbc.Row([html.P(" ")]),
-        dbc.Container(
-            className="container",
-            style={
-                "padding": "20px",
-                "max-width": "auto",
-                "margin": "0 auto",
-                "border": "2px solid black",
-            },
-            children=[
-                dbc.Row(
-                    [html.H1("ELECTRIC METER DATA",
-                             style={"text-align": "center"})]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.P(
-                            "ELECTRICITY METER READING",
-                            style={"text-align": "center"}
-                        )
-                    ]
-                ),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="power-meter-taken",
-                            className="power-meter-taken",
-                            style={"text-align": "center", "color": "red"},
-                        )
-                    ]
-                ),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="power-meter-given",
-                            className="power-meter-given",
-                            style={"text-align": "center  ", "color": "green"},
-                        )
-                    ]
-                ),
-                dbc.Row(
-                    [
-                        html.P(
-                            id="meter-diff",
-                            className="power-meter-given",
-                            style={"text-align": "center  "},
-                        )
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.H5("PICK A MONTH:",
-                                 style={"text-align": "center"})]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        dcc.Dropdown(
-                            id="meter-month-dropdown",
-                            options=generate_dropdown_options(11, 2022),
-                            value=datetime.now().strftime("%Y-%m"),
-                            placeholder="Select a month",
-                            clearable=False,
-                            style={"width": "150px", "margin": "0 auto"},
-                        ),
-                    ]
-                ),
-                dbc.Row(
-                    [
-                        dcc.Graph(
-                            id="power-meter-line-chart",
-                        )
-                    ]
-                ),
-            ],
-        ),
-        dbc.Row([html.P(" ")]),
-        dbc.Container(
-            className="container",
-            style={
-                "padding": "20px",
-                "max-width": "auto",
-                "margin": "0 auto",
-                "border": "2px solid black",
-            },
-            children=[
-                dbc.Row(
-                    [
-                        html.H1(
-                            "ROOMS AND OUTSIDE TEMPERATURE",
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([html.H5("PICK A DAY:",
-                                 style={"text-align": "center"})]),
-                dbc.Row([html.P(" ")]),
-                dbc.Row(
-                    [
-                        html.Div(
-                            dcc.DatePickerSingle(
-                                id="temperature-date-picker",
-                                date=datetime.now()
-                                .replace(hour=0, minute=0, second=0),
-                                min_date_allowed=datetime(2023, 7, 17),
-                                max_date_allowed=datetime.now()
-                                .replace(hour=1),
-                                display_format="DD-MM-YYYY",
-                                first_day_of_week=1,
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="heater-months-sum",
+                                className="months-sum",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="heater-bar-chart")]),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ELECTRIC METER DATA",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                "ELECTRICITY METER READING",
+                                style={"text-align": "center"}
+                            )
+                        ]
+                    ),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="power-meter-taken",
+                                className="power-meter-taken",
+                                style={"text-align": "center", "color": "red"},
+                            )
+                        ]
+                    ),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="power-meter-given",
+                                className="power-meter-given",
+                                style={"text-align": "center  ", "color": "green"},
+                            )
+                        ]
+                    ),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="meter-diff",
+                                className="power-meter-given",
+                                style={"text-align": "center  "},
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A MONTH:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="meter-month-dropdown",
+                                options=generate_dropdown_options(11, 2022),
+                                value=bounds["month"],
+                                placeholder="Select a month",
+                                clearable=False,
+                                style={"width": "150px", "margin": "0 auto"},
                             ),
-                            style={"text-align": "center"},
-                        )
-                    ]
-                ),
-                dbc.Row([html.P(" ")]),
-                dbc.Row([dcc.Graph(id="rooms_temperatures_chart")]),
-            ],
-        ),
-    ]
-)
+                        ]
+                    ),
+                    dbc.Row(
+                        [
+                            dcc.Graph(
+                                id="power-meter-line-chart",
+                            )
+                        ]
+                    ),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("COMPARE PERIODS",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A SERIES, A MONTH AND A MODE:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="compare-metric-dropdown",
+                                options=[
+                                    {"label": label, "value": metric}
+                                    for metric, (_, label) in
+                                    comparison_reports.METRICS.items()
+                                ],
+                                value="production",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="compare-month-dropdown",
+                                options=generate_dropdown_options(4, 2022),
+                                value=bounds["month"],
+                                placeholder="Select a month",
+                                clearable=False,
+                                style={"width": "150px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.RadioItems(
+                                id="compare-mode",
+                                options=[
+                                    {"label": " Overlay years ",
+                                     "value": "overlay"},
+                                    {"label": " Year over year ",
+                                     "value": "year"},
+                                    {"label": " Month over month ",
+                                     "value": "month"},
+                                ],
+                                value="overlay",
+                                inline=True,
+                                style={"text-align": "center"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="compare-summary",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="compare-chart")]),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [
+                            html.H1(
+                                "ROOMS AND OUTSIDE TEMPERATURE",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A DAY:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.Div(
+                                dcc.DatePickerSingle(
+                                    id="temperature-date-picker",
+                                    date=bounds["today"],
+                                    min_date_allowed=datetime(2023, 7, 17),
+                                    max_date_allowed=bounds["max_date_allowed"],
+                                    display_format="DD-MM-YYYY",
+                                    first_day_of_week=1,
+                                ),
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([dcc.Graph(id="rooms_temperatures_chart")]),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ANY RANGE",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A SERIES AND A RANGE:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="range-series-dropdown",
+                                options=generate_series_options(),
+                                value="live_production",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="range-preset-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, label in RANGE_PRESET_LABELS
+                                ],
+                                value="week",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.Div(
+                                dcc.DatePickerRange(
+                                    id="range-date-picker",
+                                    start_date=bounds["today"]
+                                    - timedelta(days=7),
+                                    end_date=bounds["today"],
+                                    min_date_allowed=datetime(2022, 4, 7),
+                                    max_date_allowed=bounds["max_date_allowed"],
+                                    display_format="DD-MM-YYYY",
+                                    first_day_of_week=1,
+                                ),
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            html.P(
+                                id="range-resolution",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="range-chart")]),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ENERGY BALANCE",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A RESOLUTION AND A RANGE:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="balance-resolution-dropdown",
+                                options=[
+                                    {"label": "Hourly", "value": "hour"},
+                                    {"label": "Daily", "value": "day"},
+                                    {"label": "Monthly", "value": "month"},
+                                ],
+                                value="day",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="balance-range-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, label in RANGE_PRESET_LABELS
+                                    if value in RANGE_PRESETS
+                                    and value != "hour"
+                                ],
+                                value="month",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="balance-chart")]),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ELECTRICITY BILLS",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A RANGE:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="bills-range-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, label in RANGE_PRESET_LABELS
+                                    if value in ("year", "all")
+                                ],
+                                value="year",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="bills-chart")]),
+                    dbc.Row(
+                        [
+                            html.H5(
+                                id="bills-sum",
+                                style={"text-align": "center"},
+                            )
+                        ]
+                    ),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ROOMS AND HEATING",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A RANGE AND A ROOM METRIC:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="thermal-range-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, label in RANGE_PRESET_LABELS
+                                    if value in RANGE_PRESETS
+                                    and value not in ("hour", "day")
+                                ],
+                                value="month",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="thermal-house-chart")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="thermal-metric-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, (label, _) in
+                                    THERMAL_METRICS.items()
+                                ],
+                                value="loss_rate",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="thermal-rooms-chart")]),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("ANOMALIES",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.Div(id="anomaly-list")]),
+                    dcc.Interval(id="anomaly-interval",
+                                 interval=60000, n_intervals=0),
+                ],
+            ),
+            dbc.Row([html.P(" ")]),
+            dbc.Container(
+                className="container",
+                style={
+                    "padding": "20px",
+                    "max-width": "auto",
+                    "margin": "0 auto",
+                    "border": "2px solid black",
+                },
+                children=[
+                    dbc.Row(
+                        [html.H1("SYSTEM TELEMETRY",
+                                 style={"text-align": "center"})]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row([html.H5("PICK A METRIC AND A RANGE:",
+                                     style={"text-align": "center"})]),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="telemetry-metric-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, label
+                                    in telemetry.METRICS.items()
+                                ],
+                                value="cpu_percent",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([html.P(" ")]),
+                    dbc.Row(
+                        [
+                            dcc.Dropdown(
+                                id="telemetry-range-dropdown",
+                                options=[
+                                    {"label": label, "value": value}
+                                    for value, label in RANGE_PRESET_LABELS
+                                    if value in RANGE_PRESETS
+                                ],
+                                value="day",
+                                clearable=False,
+                                style={"width": "300px", "margin": "0 auto"},
+                            ),
+                        ]
+                    ),
+                    dbc.Row([dcc.Graph(id="telemetry-chart")]),
+                ],
+            ),
+        ]
+    )
+
+
+app.layout = serve_layout
 
 
 @app.callback(
@@ -604,8 +1188,10 @@ def update_production_now_gauge(n):
     """
     Update the data for the production gauge chart and yield today value.
 
-    This function is a callback that fetches the latest 'SolaxData' record
-    from the database and calculates the live production value for
+    This function is a callback that reads the latest production values
+    from the shared memory block written by datafetcher.py ('latest_sample')
+    and falls back to the latest 'SolaxData' record from the database when
+    the block isn't available. It calculates the live production value for
     the gauge chart. It also calculates the yield today value and formats
     the data suitable for updating the production gauge chart in a Dash app.
 
@@ -619,24 +1205,35 @@ def update_production_now_gauge(n):
             the production gauge chart.
             - str: A string representing the yield today value.
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    # Read the latest values from shared memory written by datafetcher.py
+    live_production = latest_sample_reader.read("live_production")
+    yield_now = latest_sample_reader.read("yield_today")
+
+    if live_production and yield_now:
+        sample_time, live_production_now = live_production
+        yield_today = yield_now[1]
+    else:
+        # Fall back to the database if the fetcher isn't running
+        Session = sessionmaker(bind=engine)
+        session = Session()
+
+        # Fetch the latest SolaxData value
+        solax_data_now = session.query(SolaxData).order_by(desc(
+            SolaxData.date)).first()
+        session.close()
+
+        if solax_data_now is None:
+            sample_time, live_production_now, yield_today = None, 0, 0
+        else:
+            sample_time = solax_data_now.date
+            live_production_now = solax_data_now.live_production
+            yield_today = solax_data_now.yield_today
 
-    # Fetch the latest SolaxData value
-    solax_data_now = session.query(SolaxData).order_by(desc(
-        SolaxData.date)).first()
-    time_difference = datetime.now() - solax_data_now.date
     threshold = timedelta(minutes=5)
 
     # Check if the time difference is greater than the threshold
-    if time_difference > threshold:
+    if sample_time is None or datetime.now() - sample_time > threshold:
         live_production_now = 0
-    else:
-        # Prepare the data for the gauge chart
-        live_production_now = (
-            solax_data_now.live_production if solax_data_now else 0
-        )  # Default to 0 if no data
-    yield_today = solax_data_now.yield_today if solax_data_now else 0
 
     gauge_data = [
         {
@@ -663,8 +1260,6 @@ def update_production_now_gauge(n):
         }
     ]
 
-    session.close()
-
     return {"data": gauge_data}, f"SUM TODAY: {yield_today} kWh"
 
 
@@ -698,19 +1293,16 @@ def update_production_in_day_chart(selected_date):
     if not selected_date:
         return {}
 
-    selected_date = pd.to_datetime(selected_date)
-    # print(selected_date)
+    selected_date = datetime.strptime(selected_date[:10], "%Y-%m-%d")
 
     # Filter the data based on the selected date
     start_time = selected_date
-    end_time = selected_date + pd.offsets.MonthEnd()
+    end_time = selected_date + timedelta(days=1)
 
-    query = (
-        session.query(SolaxData.date, SolaxData.live_production)
-        .filter(SolaxData.date >= start_time, SolaxData.date < end_time)
-        .order_by(SolaxData.date)
+    # Averages every 5 minutes are calculated in the database
+    data = data_access.bucketed_means(
+        "solax_data", ["live_production"], start_time, end_time, digits=0
     )
-    data = query.all()
 
     yield_data = (
         session.query(SolaxData)
@@ -722,29 +1314,32 @@ def update_production_in_day_chart(selected_date):
 
     session.close()
 
-    df = pd.DataFrame(data, columns=["Date", "Production"])
-    df["Date"] = pd.to_datetime(df["Date"])
-
-    # Set the "Date" column as the index
-    df.set_index("Date", inplace=True)
-
-    # Resample the data to calculate averages every 5 minutes
-    df = df.resample("5T").mean()
-
-    df["Production"] = df["Production"].round(0)
+    forecast = pv_forecast.fetch(selected_date)
 
     fig = go.Figure()
 
     fig.add_trace(
         go.Scatter(
-            x=df.index,
-            y=df["Production"],
+            x=[row[0] for row in data],
+            y=[row[1] for row in data],
             mode="lines",
             name="Production",
             line=dict(color="green", shape="spline", smoothing=1),
         )
     )
 
+    if forecast:
+        # Hourly means are drawn in the middle of their hours
+        fig.add_trace(
+            go.Scatter(
+                x=[hour + timedelta(minutes=30) for hour, _ in forecast],
+                y=[power for _, power in forecast],
+                mode="lines",
+                name="Forecast",
+                line=dict(color="orange", dash="dash", shape="spline"),
+            )
+        )
+
     fig.update_layout(
         title_text="Day's production:",
         title_x=0.5,
@@ -766,7 +1361,12 @@ def update_production_in_day_chart(selected_date):
     fixed_end_time = selected_date.replace(hour=22, minute=0, second=0)
     fig.update_xaxes(range=[fixed_start_time, fixed_end_time])
 
-    return fig, f"SUM {yield_that_day} kWh"
+    summary = f"SUM {yield_that_day} kWh"
+    if forecast:
+        expected = sum(power for _, power in forecast) / 1000
+        summary += f" (FORECAST {expected:.1f} kWh)"
+
+    return fig, summary
 
 
 @app.callback(
@@ -793,38 +1393,29 @@ def update_production_in_month_chart(date):
             - go.Figure: A Plotly figure containing the production bar chart.
             - str: A string representing the total monthly yield in kWh.
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
     if date is None:
         return {}
 
     # Filter the data based on the selected month and year
-    start_date = pd.to_datetime(f"{date}-01")
-    end_date = start_date + pd.offsets.MonthEnd()
+    start_date = datetime.strptime(f"{date}-01", "%Y-%m-%d")
+    end_date = add_one_month(start_date)
 
-    subquery = (
-        session.query(func.max(SolaxData.date).label("max_date"))
-        .filter(SolaxData.date >= start_date, SolaxData.date <= end_date)
-        .group_by(func.strftime("%Y-%m-%d", SolaxData.date))
-    )
-
-    data = session.query(SolaxData).filter(SolaxData.date.in_(subquery)).all()
+    # Last yield of every day is picked in the database
+    data = data_access.last_rows_per_day(
+        "solax_data", ["yield_today"], start_date, end_date)
+    data = [row for row in data if row[1] is not None]
+    days = [day.day for day, _ in data]
+    yields = [yield_value for _, yield_value in data]
 
-    # Create a DataFrame to store the data
-    df = pd.DataFrame(
-        [(item.date.day, item.yield_today) for item in data],
-        columns=["Day", "Yield"]
-    )
-    months_sum = round(df["Yield"].sum(), 2)
+    months_sum = round(sum(yields), 2)
     months_sum = "{:,.2f}".format(months_sum).replace(",", " ")
     # Create the bar chart
-    fig = go.Figure(data=go.Bar(x=df["Day"], y=df["Yield"]))
+    fig = go.Figure(data=go.Bar(x=days, y=yields))
 
     # Add the bar trace
-    for i, yield_value in enumerate(df["Yield"]):
+    for day, yield_value in zip(days, yields):
         fig.add_annotation(
-            x=df["Day"][i],
+            x=day,
             y=yield_value + 2,
             text=str(yield_value),  # Convert the yield value to a string
             showarrow=False,  # Hide the arrow
@@ -840,8 +1431,6 @@ def update_production_in_month_chart(date):
     fig.update_yaxes(range=[0, 80])
     fig.update_traces(marker=dict(color="green"))
 
-    session.close()
-
     return fig, f"SUM: {months_sum} kWh"
 
 
@@ -856,9 +1445,9 @@ def update_heater_chart(selected_date):
     Update the energy consumption line chart for the selected date and display
     heater consumption information.
 
-    This function is a callback that fetches data from the 'TuyaData' table
-    based on the selected date. It then calculates the hourly energy
-    consumption and creates a Plotly line chart to display the energy
+    This function is a callback that fetches the hourly energy consumption
+    for the selected date from the hourly heater energy counter
+    ('energy_counter') and creates a Plotly line chart to display the energy
     consumption throughout the day. The data is formatted appropriately
     for updating the line chart and displaying the heater consumption
     information in a Dash app.
@@ -874,62 +1463,29 @@ def update_heater_chart(selected_date):
             - str: A string representing the total consumption for
             the selected day in kWh.
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
     if not selected_date:
         return {}
 
-    selected_date = pd.to_datetime(selected_date)
+    selected_date = datetime.strptime(selected_date[:10], "%Y-%m-%d")
 
     # Filter the data based on the selected date
     start_time = selected_date
-    end_time = selected_date + pd.offsets.Day()
-
-    query = (
-        session.query(TuyaData.date, TuyaData.forward_energy)
-        .filter(TuyaData.date >= start_time, TuyaData.date < end_time)
-        .order_by(TuyaData.date)
-    )
-    data = query.all()
-    tuya_data_now = session.query(TuyaData).order_by(
-        desc(TuyaData.date)).first()
-    tuya_data_that_day = (
-        session.query(TuyaData)
-        .filter(TuyaData.date >= start_time, TuyaData.date < end_time)
-        .order_by(desc(TuyaData.date))
-        .first()
-    )
-    heater_that_day = (
-        tuya_data_that_day.forward_energy_daily if tuya_data_that_day else 0
-    )
-
-    session.close()
+    end_time = selected_date + timedelta(days=1)
 
-    forward_energy_todays_value = (
-        round(tuya_data_now.forward_energy_daily, 2) if tuya_data_now else None
-    )
-    df = pd.DataFrame(data, columns=["Date", "Energy"])
+    # Energy used in each hour, split exactly at hour boundaries
+    data = energy_counter.hourly_energy(start_time, end_time)
+    heater_that_day = sum(energy for _, energy in data)
 
-    # Calculate energy consumption in each hour
-    df["Hour"] = df["Date"].dt.hour
-    df_grouped = df.groupby("Hour").agg({"Energy": ["min", "max"]})
-    df_grouped["Hourly_Energy"] = (
-        df_grouped["Energy", "max"] - df_grouped["Energy", "min"]
-    )
-
-    # Generate date-time for each hour
-    df_grouped["Date"] = pd.to_datetime(
-        selected_date.strftime("%Y-%m-%d ")
-        + df_grouped.index.astype(str) + ":00:00"
-    )
+    today = datetime.combine(date.today(), datetime.min.time())
+    forward_energy_todays_value = round(
+        energy_counter.total_energy(today, today + timedelta(days=1)), 2)
 
     fig = go.Figure()
 
     fig.add_trace(
         go.Scatter(
-            x=df_grouped["Date"],
-            y=df_grouped["Hourly_Energy"],
+            x=[hour for hour, _ in data],
+            y=[energy for _, energy in data],
             mode="lines",
             name="Energy Consumption",
             line=dict(color="red", shape="spline", smoothing=1),
@@ -968,10 +1524,10 @@ def update_heater_in_month_chart(date):
     Update the heater consumption bar chart for the selected month and display
     the total monthly yield.
 
-    This function is a callback that fetches data from the 'TuyaData' table
-    based on the selected month and year. It then creates a Plotly bar chart
-    to display the daily consumption for the selected month and calculates
-    the total monthly consumption. The data is formatted appropriately for updating
+    This function is a callback that fetches daily sums of the hourly heater
+    energy counter ('energy_counter') for the selected month and year.
+    It then creates a Plotly bar chart to display the daily consumption
+    for the selected month and calculates the total monthly consumption. The data is formatted appropriately for updating
     the bar chart and displaying the total monthly consumption value in a Dash app.
 
     Parameters:
@@ -982,39 +1538,28 @@ def update_heater_in_month_chart(date):
             - go.Figure: A Plotly figure containing the consumption bar chart.
             - str: A string representing the total monthly consumption in kWh.
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
     if date is None:
         return {}
 
     # Filter the data based on the selected month and year
-    start_date = pd.to_datetime(f"{date}-01")
-    end_date = start_date + pd.offsets.MonthEnd()
+    start_date = datetime.strptime(f"{date}-01", "%Y-%m-%d")
+    end_date = add_one_month(start_date)
 
-    subquery = (
-        session.query(func.max(TuyaData.date).label("max_date"))
-        .filter(TuyaData.date >= start_date, TuyaData.date <= end_date)
-        .group_by(func.strftime("%Y-%m-%d", TuyaData.date))
-    )
+    # Daily sums of the hourly energy counter
+    data = energy_counter.daily_energy(start_date, end_date)
+    days = [day.day for day, _ in data]
+    consumptions = [consumption for _, consumption in data]
 
-    data = session.query(TuyaData).filter(TuyaData.date.in_(subquery)).all()
-
-    # Create a DataFrame to store the data
-    df = pd.DataFrame(
-        [(item.date.day, item.forward_energy_daily) for item in data],
-        columns=["Day", "Consumption"]
-    )
-    months_sum = round(df["Consumption"].sum(), 2)
+    months_sum = round(sum(consumptions), 2)
     months_sum = "{:,.2f}".format(months_sum).replace(",", " ")
 
     # Create the bar chart
-    fig = go.Figure(data=go.Bar(x=df["Day"], y=df["Consumption"]))
+    fig = go.Figure(data=go.Bar(x=days, y=consumptions))
 
     # Add the bar trace
-    for i, consumption_value in enumerate(df["Consumption"]):
+    for day, consumption_value in zip(days, consumptions):
         fig.add_annotation(
-            x=df["Day"][i],
+            x=day,
             y=consumption_value + 4,
 
             # Convert the consumption value to a string
@@ -1033,8 +1578,6 @@ def update_heater_in_month_chart(date):
     fig.update_yaxes(range=[0, 160])
     fig.update_traces(marker=dict(color="red"))
 
-    session.close()
-
     return fig, f"SUM: {months_sum} kWh"
 
 
@@ -1164,6 +1707,111 @@ def update_meter_chart(date):
     )
 
 
+@app.callback(
+    Output("compare-chart", "figure"),
+    Output("compare-summary", "children"),
+    Input("compare-metric-dropdown", "value"),
+    Input("compare-month-dropdown", "value"),
+    Input("compare-mode", "value"),
+)
+def update_compare_chart(metric, date, mode):
+    """
+    Update the comparison chart of the selected series and month.
+
+    This function is a callback that reads only the tables precomputed
+    nightly by comparison_reports.py. The modes are:
+        - 'overlay': the month-to-date sum of the selected calendar month,
+        one line per year.
+        - 'year': monthly sums of the selected and the previous year,
+        with the change in percent.
+        - 'month': monthly sums of the 24 months up to the selected one,
+        with the change from the previous month.
+
+    Parameters:
+        metric (str): A key of comparison_reports.METRICS.
+        date (str): The selected month in the format 'YYYY-MM'.
+        mode (str): 'overlay', 'year' or 'month'.
+
+    Returns:
+        tuple: A tuple containing two elements:
+            - go.Figure: A Plotly figure with the comparison.
+            - str: The selected month compared with the previous month
+            and the previous year.
+    """
+    if not metric or not date or not mode:
+        return {}, ""
+
+    selected = datetime.strptime(date, "%Y-%m")
+    label = comparison_reports.METRICS[metric][1]
+    fig = go.Figure()
+
+    if mode == "overlay":
+        days = comparison_reports.fetch_days(metric, selected.month)
+        for year, values in days.groupby("year"):
+            fig.add_trace(go.Scatter(
+                x=values["day"], y=values["cumulative"], name=str(year),
+                mode="lines",
+                line=dict(width=4 if year == selected.year else 2)))
+        fig.update_xaxes(title_text="Day of the month")
+        title = f"{label}, {selected:%m} of every year, cumulative [kWh]:"
+        months = comparison_reports.fetch_months(metric, selected, selected)
+    else:
+        if mode == "year":
+            start = datetime(selected.year - 1, 1, 1)
+            end = datetime(selected.year, 12, 1)
+        else:
+            first = selected.year * 12 + selected.month - 24
+            start = datetime(first // 12, first % 12 + 1, 1)
+            end = selected
+        months = comparison_reports.fetch_months(metric, start, end)
+        change = "year_change" if mode == "year" else "month_change"
+        if mode == "year":
+            for year, values in months.groupby("year"):
+                fig.add_trace(go.Bar(x=values["month"], y=values["value"],
+                                     name=str(year)))
+            fig.update_xaxes(title_text="Month", dtick=1)
+            shown = months[months["year"] == selected.year]
+            x = shown["month"]
+        else:
+            fig.add_trace(go.Bar(x=months["time"], y=months["value"],
+                                 name=label, marker_color="orange"))
+            shown = months
+            x = shown["time"]
+        fig.add_trace(go.Scatter(x=x, y=shown[change], name="Change [%]",
+                                 mode="lines+markers", yaxis="y2",
+                                 line=dict(color="black")))
+        fig.update_layout(
+            barmode="group",
+            yaxis2=dict(title="%", overlaying="y", side="right",
+                        showgrid=False),
+        )
+        title = f"{label} [kWh]:"
+        months = months[(months["year"] == selected.year)
+                        & (months["month"] == selected.month)]
+
+    fig.update_layout(
+        title_text=title,
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+        yaxis=dict(title="kWh"),
+        legend=dict(orientation="h", yanchor="top", y=-0.24),
+    )
+
+    if months.empty:
+        return fig, "No data for the selected month."
+    row = months.iloc[0]
+    summary = f"{date}: {row['value']:.1f} kWh"
+    if not row["complete"]:
+        summary += f" in {row['days']} days"
+    for column, name in (("month_change", "previous month"),
+                         ("year_change", "previous year")):
+        if pd.notna(row[column]):
+            summary += f", {row[column]:+.1f} % vs {name}"
+
+    return fig, summary
+
+
 @app.callback(
     Output("rooms_temperatures_chart", "figure"),
     Input("temperature-date-picker", "date"),
@@ -1182,88 +1830,40 @@ def update_temperatures_chart(selected_date):
     Returns:
         - go.Figure: A Plotly figure containing rooms and outside temperatures.
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
     if not selected_date:
         return {}
 
-    selected_date = pd.to_datetime(selected_date)
+    selected_date = datetime.strptime(selected_date[:10], "%Y-%m-%d")
 
     # Filter the data based on the selected date
     start_time = selected_date
-    end_time = selected_date + pd.offsets.Day()
-
-    # Fetch the data for "bathroom_lower" and "bedrooms" columns
-    query = (
-        session.query(
-            TuyaData.date,
-            TuyaData.bathroom_lower,
-            TuyaData.first_bedroom,
-            TuyaData.second_bedroom,
-            TuyaData.third_bedroom,
-        )
-        .filter(TuyaData.date >= start_time, TuyaData.date < end_time)
-        .order_by(TuyaData.date)
+    end_time = selected_date + timedelta(days=1)
+
+    # Averages every 5 minutes for "bathroom_lower" and "bedrooms" columns
+    # are calculated in the database
+    data = data_access.bucketed_means(
+        "tuya_data",
+        ["bathroom_lower", "first_bedroom", "second_bedroom",
+         "third_bedroom"],
+        start_time,
+        end_time,
+        digits=1,
     )
+    dates = [row[0] for row in data]
 
-    data = query.all()
-
-    weather_query = (
-        session.query(WeatherData.date, WeatherData.weather_temperature_feels)
-        .filter(WeatherData.date >= start_time, WeatherData.date < end_time)
-        .order_by(WeatherData.date)
-    )
-    weather_data = weather_query.all()
-
-    session.close()
-
-    # Create DataFrames to store the fetched data
-    df = pd.DataFrame(
-        data,
-        columns=[
-            "Date",
-            "Bathroom",
-            "First Bedroom",
-            "Second Bedroom",
-            "Third Bedroom",
-        ],
+    weather_data = data_access.bucketed_means(
+        "weather_data", ["weather_temperature_feels"], start_time, end_time,
+        digits=1,
     )
-    df["Date"] = pd.to_datetime(df["Date"])
-
-    # Set the "Date" column as the index
-    df.set_index("Date", inplace=True)
-
-    # Resample the data to calculate averages every 5 minutes
-    df = df.resample("5T").mean()
 
-    temperature_columns = [
-        "Bathroom",
-        "First Bedroom",
-        "Second Bedroom",
-        "Third Bedroom",
-    ]
-    df[temperature_columns] = df[temperature_columns].round(1)
-
-    df_weather = pd.DataFrame(weather_data,
-                              columns=["Date", "Outside temperature"])
-    df_weather["Date"] = pd.to_datetime(df_weather["Date"])
-
-    # Set the "Date" column as the index
-    df_weather.set_index("Date", inplace=True)
-
-    # Resample the data to calculate averages every 5 minutes
-    df_weather = df_weather.resample("5T").mean()
-    df_weather["Outside temperature"] = \
-        df_weather["Outside temperature"].round(1)
     # Create the line chart
     fig = go.Figure()
 
     # Add the "Bathroom Lower" line
     fig.add_trace(
         go.Scatter(
-            x=df.index,
-            y=df["Bathroom"],
+            x=dates,
+            y=[row[1] for row in data],
             mode="lines",
             name="Bathroom",
             line=dict(color="hotpink", shape="spline", smoothing=1),
@@ -1273,8 +1873,8 @@ def update_temperatures_chart(selected_date):
     # Add the "First Bedroom" line
     fig.add_trace(
         go.Scatter(
-            x=df.index,
-            y=df["First Bedroom"],
+            x=dates,
+            y=[row[2] for row in data],
             mode="lines",
             name="First Bedroom",
             line=dict(color="orange", shape="spline", smoothing=1),
@@ -1284,8 +1884,8 @@ def update_temperatures_chart(selected_date):
     # Add the "Second Bedroom" line
     fig.add_trace(
         go.Scatter(
-            x=df.index,
-            y=df["Second Bedroom"],
+            x=dates,
+            y=[row[3] for row in data],
             mode="lines",
             name="Second Bedroom",
             line=dict(color="grey", shape="spline", smoothing=1),
@@ -1295,8 +1895,8 @@ def update_temperatures_chart(selected_date):
     # Add the "Third Bedroom" line
     fig.add_trace(
         go.Scatter(
-            x=df.index,
-            y=df["Third Bedroom"],
+            x=dates,
+            y=[row[4] for row in data],
             mode="lines",
             name="Third Bedroom",
             line=dict(color="cyan", shape="spline", smoothing=1),
@@ -1305,8 +1905,8 @@ def update_temperatures_chart(selected_date):
 
     fig.add_trace(
         go.Scatter(
-            x=df_weather.index,
-            y=df_weather["Outside temperature"],
+            x=[row[0] for row in weather_data],
+            y=[row[1] for row in weather_data],
             mode="lines",
             name="Outside temperature",
             line=dict(color="brown", shape="spline", smoothing=1),
@@ -1330,5 +1930,375 @@ def update_temperatures_chart(selected_date):
     return fig
 
 
+@app.callback(
+    Output("range-chart", "figure"),
+    Output("range-resolution", "children"),
+    Input("range-series-dropdown", "value"),
+    Input("range-preset-dropdown", "value"),
+    Input("range-date-picker", "start_date"),
+    Input("range-date-picker", "end_date"),
+)
+def update_range_chart(series, preset, start_date, end_date):
+    """
+    Update the line chart of any series over any range.
+
+    This function is a callback that resolves the selected preset or custom
+    dates to a range and lets the query planner choose the cheapest
+    resolution that keeps the number of points under the budget. Bucketed
+    resolutions are read from precomputed rollups, so a year of data loads
+    as fast as a single day.
+
+    Parameters:
+        series (str): The name of the series.
+        preset (str): The selected range preset, a key of RANGE_PRESETS
+        or 'custom'.
+        start_date (str): The start date of the custom range 'YYYY-MM-DD'.
+        end_date (str): The end date of the custom range 'YYYY-MM-DD'.
+
+    Returns:
+        tuple: A tuple containing two elements:
+            - go.Figure: A Plotly figure containing the series line chart.
+            - str: A string describing the range and chosen resolution.
+    """
+    if not series:
+        return {}, ""
+
+    if preset == "custom":
+        if not start_date or not end_date:
+            return {}, ""
+        start_time = pd.to_datetime(start_date).to_pydatetime()
+        end_time = pd.to_datetime(end_date).to_pydatetime() + timedelta(days=1)
+    else:
+        end_time = datetime.now().replace(microsecond=0)
+        start_time = end_time - RANGE_PRESETS[preset]
+
+    resolution, rows = query_planner.fetch_series(
+        series, start_time, end_time)
+
+    df = pd.DataFrame(rows, columns=["Date", "Value"])
+    df["Date"] = pd.to_datetime(df["Date"])
+
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=df["Date"],
+            y=df["Value"],
+            mode="lines",
+            name=series.replace("_", " ").title(),
+            line=dict(color="green"),
+        )
+    )
+    fig.update_layout(
+        title_text=f"{series.replace('_', ' ').title()}:",
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+    )
+    fig.update_xaxes(range=[start_time, end_time])
+
+    return (
+        fig,
+        f"{start_time:%d-%m-%Y %H:%M} - {end_time:%d-%m-%Y %H:%M}, "
+        f"resolution: {resolution}, points: {len(df)}",
+    )
+
+
+@app.callback(
+    Output("balance-chart", "figure"),
+    Input("balance-resolution-dropdown", "value"),
+    Input("balance-range-dropdown", "value"),
+)
+def update_balance_chart(resolution, preset):
+    """
+    Update the energy balance chart: PV production, heater consumption
+    and grid import and export as bars, self-consumption, heater share
+    and PV coverage as lines on the right axis.
+
+    This function is a callback that reads the tables materialized by
+    energy_balance.py. Hourly rows have no grid values, the grid meter
+    is read once a day.
+
+    Parameters:
+        resolution (str): 'hour', 'day' or 'month'.
+        preset (str): The selected range, a key of RANGE_PRESETS.
+
+    Returns:
+        go.Figure: A Plotly figure with bars and ratio lines.
+    """
+    if not resolution or not preset:
+        return {}
+
+    end_time = datetime.now().replace(microsecond=0)
+    start_time = end_time - RANGE_PRESETS[preset]
+    if resolution == "month":
+        start_time = start_time.replace(day=1, hour=0, minute=0, second=0)
+    balance = energy_balance.fetch(resolution, start_time, end_time)
+
+    fig = go.Figure()
+    bars = {
+        "pv": ("PV production", "orange"),
+        "heater": ("Heater", "blue"),
+        "imported": ("Imported", "red"),
+        "exported": ("Exported", "green"),
+    }
+    for column, (name, color) in bars.items():
+        if column in balance and balance[column].notna().any():
+            fig.add_trace(go.Bar(x=balance["time"], y=balance[column],
+                                 name=name, marker_color=color))
+    lines = {
+        "self_consumption": "Self-consumption",
+        "heater_share": "Heater share",
+        "pv_coverage": "PV coverage",
+    }
+    for column, name in lines.items():
+        if column in balance and balance[column].notna().any():
+            fig.add_trace(go.Scatter(x=balance["time"],
+                                     y=balance[column] * 100, name=name,
+                                     mode="lines+markers", yaxis="y2"))
+    if resolution == "hour" and balance["heater"].any():
+        fig.add_trace(go.Scatter(
+            x=balance["time"],
+            y=balance["heater_from_pv"] / balance["heater"].where(
+                balance["heater"] > 0) * 100,
+            name="Heater covered by PV", mode="lines", yaxis="y2"))
+
+    fig.update_layout(
+        title_text="Energy balance [kWh]:",
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+        barmode="group",
+        yaxis=dict(title="kWh"),
+        yaxis2=dict(title="%", overlaying="y", side="right",
+                    rangemode="tozero", showgrid=False),
+        legend=dict(orientation="h", yanchor="top", y=-0.24),
+    )
+
+    return fig
+
+
+@app.callback(
+    Output("bills-chart", "figure"),
+    Output("bills-sum", "children"),
+    Input("bills-range-dropdown", "value"),
+)
+def update_bills_chart(preset):
+    """
+    Update the monthly bills chart: cost of imported energy and the fixed
+    fee as bars, the value of used net-metering credits as negative bars
+    and the bill as a line.
+
+    This function is a callback that reads the monthly bills cached by
+    tariff.py, so it doesn't depend on the length of the range.
+
+    Parameters:
+        preset (str): The selected range, a key of RANGE_PRESETS.
+
+    Returns:
+        tuple: A tuple containing two elements:
+            - go.Figure: A Plotly figure with the bills.
+            - str: The sum of the bills in the range.
+    """
+    if not preset:
+        return {}, ""
+
+    end_time = datetime.now().replace(microsecond=0)
+    start_time = (end_time - RANGE_PRESETS[preset]).replace(
+        day=1, hour=0, minute=0, second=0)
+    bills = tariff.fetch_bills(start_time, end_time)
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=bills["time"], y=bills["import_cost"],
+                         name="Imported energy", marker_color="red"))
+    fig.add_trace(go.Bar(x=bills["time"], y=bills["fixed"],
+                         name="Fixed fees", marker_color="gray"))
+    fig.add_trace(go.Bar(x=bills["time"], y=-bills["credit_value"],
+                         name="Net-metering credit", marker_color="green"))
+    fig.add_trace(go.Scatter(x=bills["time"], y=bills["total"], name="Bill",
+                             mode="lines+markers",
+                             line=dict(color="black")))
+    fig.update_layout(
+        title_text="Monthly bills [PLN]:",
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+        barmode="relative",
+        yaxis=dict(title="PLN"),
+        legend=dict(orientation="h", yanchor="top", y=-0.24),
+    )
+
+    total = "{:,.2f}".format(bills["total"].sum()).replace(",", " ")
+    return fig, f"SUM: {total} PLN"
+
+
+@app.callback(
+    Output("thermal-house-chart", "figure"),
+    Output("thermal-rooms-chart", "figure"),
+    Input("thermal-range-dropdown", "value"),
+    Input("thermal-metric-dropdown", "value"),
+)
+def update_thermal_charts(preset, metric):
+    """
+    Update the heating charts: degree-days and heater consumption per day
+    with the heater's energy per degree-day, and one daily metric of every
+    room.
+
+    This function is a callback that reads the daily tables cached by
+    thermal_model.py.
+
+    Parameters:
+        preset (str): The selected range, a key of RANGE_PRESETS.
+        metric (str): The room metric, a key of THERMAL_METRICS.
+
+    Returns:
+        tuple: Two Plotly figures, of the house and of the rooms.
+    """
+    if not preset or not metric:
+        return {}, {}
+
+    end_time = datetime.now().replace(microsecond=0)
+    start_time = end_time - RANGE_PRESETS[preset]
+    house = thermal_model.fetch_house(start_time, end_time)
+    rooms = thermal_model.fetch_rooms(start_time, end_time)
+
+    house_fig = go.Figure()
+    house_fig.add_trace(go.Bar(x=house["time"], y=house["heater"],
+                               name="Heater [kWh]", marker_color="blue"))
+    house_fig.add_trace(go.Bar(x=house["time"], y=house["degree_days"],
+                               name="Degree-days", marker_color="gray"))
+    house_fig.add_trace(go.Scatter(x=house["time"], y=house["intensity"],
+                                   name="kWh per degree-day",
+                                   mode="lines+markers", yaxis="y2",
+                                   line=dict(color="red")))
+    house_fig.update_layout(
+        title_text="Heating degree-days and consumption:",
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+        barmode="group",
+        yaxis=dict(title="kWh, degree-days"),
+        yaxis2=dict(title="kWh / degree-day", overlaying="y", side="right",
+                    rangemode="tozero", showgrid=False),
+        legend=dict(orientation="h", yanchor="top", y=-0.24),
+    )
+
+    label, unit = THERMAL_METRICS[metric]
+    rooms_fig = go.Figure()
+    for room, name in ROOM_NAMES.items():
+        values = rooms[rooms["room"] == room]
+        if metric == "energy":
+            rooms_fig.add_trace(go.Bar(x=values["time"], y=values[metric],
+                                       name=name))
+        else:
+            rooms_fig.add_trace(go.Scatter(x=values["time"],
+                                           y=values[metric], name=name,
+                                           mode="lines+markers"))
+    rooms_fig.update_layout(
+        title_text=f"{label} [{unit}]:",
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+        barmode="stack",
+        yaxis=dict(title=unit),
+        legend=dict(orientation="h", yanchor="top", y=-0.24),
+    )
+
+    return house_fig, rooms_fig
+
+
+@app.callback(
+    Output("anomaly-list", "children"),
+    Input("anomaly-interval", "n_intervals"),
+)
+def update_anomaly_list(n):
+    """
+    Update the table of the latest anomaly events.
+
+    This function is a callback that reads the events stored by
+    anomaly_detector.py in the data fetcher.
+
+    Parameters:
+        n (int): The number of intervals since the page was loaded.
+
+    Returns:
+        dbc.Table or html.P: The events, newest first.
+    """
+    events = anomaly_detector.recent_events()
+    if not events:
+        return html.P("No anomalies.", style={"text-align": "center"})
+
+    header = html.Thead(html.Tr([
+        html.Th(name) for name in
+        ("Series", "Start", "End", "Direction", "Value", "Expected", "Score")
+    ]))
+    rows = [
+        html.Tr([
+            html.Td(event["series"]),
+            html.Td(str(event["start"])),
+            html.Td(str(event["end"]) if event["end"] else "ongoing"),
+            html.Td(event["direction"]),
+            html.Td(f"{event['value']:.1f}"),
+            html.Td(f"{event['expected']:.1f}"),
+            html.Td(f"{event['score']:.1f}"),
+        ])
+        for event in events
+    ]
+
+    return dbc.Table([header, html.Tbody(rows)], bordered=True, hover=True,
+                     size="sm")
+
+
+@app.callback(
+    Output("telemetry-chart", "figure"),
+    Input("telemetry-metric-dropdown", "value"),
+    Input("telemetry-range-dropdown", "value"),
+)
+def update_telemetry_chart(metric, preset):
+    """
+    Update the line chart of a telemetry metric of the host and every
+    service.
+
+    This function is a callback that reads the metric collected by
+    house_energy.py: raw one-minute samples for short ranges and hourly
+    means for longer ones.
+
+    Parameters:
+        metric (str): The name of the metric, a key of telemetry.METRICS.
+        preset (str): The selected range, a key of RANGE_PRESETS.
+
+    Returns:
+        go.Figure: A Plotly figure with one line per source.
+    """
+    if not metric or not preset:
+        return {}
+
+    end_time = datetime.now().replace(microsecond=0)
+    start_time = end_time - RANGE_PRESETS[preset]
+
+    fig = go.Figure()
+    for source, rows in telemetry.fetch(metric, start_time, end_time).items():
+        fig.add_trace(
+            go.Scatter(
+                x=[row[0] for row in rows],
+                y=[row[1] for row in rows],
+                mode="lines",
+                name=source,
+            )
+        )
+    fig.update_layout(
+        title_text=f"{telemetry.METRICS[metric]}:",
+        title_x=0.5,
+        title_y=0.9,
+        plot_bgcolor="#f5f5f5",
+    )
+    fig.update_xaxes(range=[start_time, end_time])
+
+    return fig
+
+
+startup_profiler.mark("init")
+
 if __name__ == "__main__":
-    app.run_server(host="::", port=8050, debug=False)
+    startup_profiler.report("app.py")
+    message_sender.install_sigterm_flush()
+    app.run(host="::", port=8050, debug=False)
@@ -0,0 +1,359 @@
+"""
+Benchmark of the HTTP meter client against the Selenium scraper.
+
+A local stand-in of the meter portal is started in a background thread. It
+serves a login form with a hidden anti-XSRF field, checks the credentials,
+sets a session cookie and serves the meter page with "digit1"/"afterComa"
+elements (or a JSON document at /dp/UserData.json), like the real portal.
+It also serves usage charts from its 'usage' profile, which are used by
+the backfill mode of scraper.py.
+
+Each client logs in and reads the meter several times. The HTTP client is
+also run with a saved session (session_store.py), which must log in only
+once and again after the stand-in portal drops the session. The program checks
+that the reading is parsed correctly and prints the median time and the peak
+memory of each path. The Selenium path runs only if Chromium and
+chromedriver are installed.
+
+Usage:
+    python benchmark_meter_client.py [--runs 5] [--selenium]
+"""
+
+import argparse
+import json
+import os
+import secrets
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+import psutil
+import meter_client
+from session_store import SessionStore, generate_key
+
+
+USER = "user@example.com"
+PASSWORD = "secret"
+TAKEN = 199633550
+GIVEN = 121807640
+METER_POINT = "12345"
+CHROMEDRIVER = "/usr/lib/chromium-browser/chromedriver"
+
+
+def reading_digits(value):
+    """
+    Splits a reading into 8 whole and 4 decimal digits.
+
+    Parameters:
+        value (int): The reading in kWh multiplied by 10000.
+
+    Returns:
+        tuple: Two strings, whole and decimal digits.
+    """
+    digits = f"{value:012d}"
+    return digits[:8], digits[8:]
+
+
+def login_page(token, error=False):
+    message = '<p class="error">Wrong login or password</p>' if error else ""
+    return (
+        "<html><body>"
+        f"{message}"
+        '<form id="loginForm" method="post" action="/dp/UserLogin.do">'
+        '<div><input type="radio" id="loginRadio" name="loginType" '
+        'value="login" checked></div>'
+        f'<div><input type="hidden" name="_antixsrf" value="{token}">'
+        '<input type="text" id="j_username" name="j_username"></div>'
+        '<div><input type="password" id="j_password" name="j_password">'
+        "</div>"
+        '<div><button type="submit">Login</button></div>'
+        "</form></body></html>"
+    )
+
+
+def meter_page():
+    taken, taken_after_comma = reading_digits(TAKEN)
+    given, given_after_comma = reading_digits(GIVEN)
+    spans = "".join(f'<span class="digit1">{digit}</span>'
+                    for digit in taken + given)
+    spans += "".join(f'<span class="afterComa">{digit}</span>'
+                     for digit in taken_after_comma + given_after_comma)
+    return (f'<html><body><div id="meter">{spans}</div>'
+            f'<a href="/dp/resources/chart?meterPoint={METER_POINT}">'
+            f'Chart</a></body></html>')
+
+
+def meter_json():
+    return json.dumps({"response": {"meterPoints": [{"lastMeasurements": [
+        {"zone": "A+ strefa 1", "value": TAKEN / 10000},
+        {"zone": "A- strefa 1", "value": GIVEN / 10000},
+    ]}]}})
+
+
+def chart_json(usage, chart_type, direction, period):
+    """
+    Builds a usage chart of one month (daily values) or one day (hourly
+    values).
+
+    Parameters:
+        usage (dict): Hour start (datetime): (taken, given) in kWh
+        multiplied by 10000.
+        chart_type (str): 'MONTH' or 'DAY'.
+        direction (str): 'A+' (taken) or 'A-' (given).
+        period (datetime): The start of the chart.
+
+    Returns:
+        str: The JSON document.
+    """
+    index = 0 if direction == "A+" else 1
+    if chart_type == "MONTH":
+        step = timedelta(days=1)
+        end = (period + timedelta(days=32)).replace(day=1)
+    else:
+        step = timedelta(hours=1)
+        end = period + timedelta(days=1)
+
+    points = []
+    moment = period
+    while moment < end:
+        values = [value[index] for hour, value in usage.items()
+                  if moment <= hour < moment + step]
+        points.append({
+            "tm": str(int(moment.timestamp() * 1000)),
+            "zones": [sum(values) / 10000 if values else None, None, None],
+        })
+        moment += step
+
+    return json.dumps({"response": {"mainChart": points}})
+
+
+class StandInPortal(ThreadingHTTPServer):
+    """
+    Local HTTP server behaving like the meter portal.
+
+    Parameters:
+        usage (dict): Hourly usage profile served by the charts,
+        hour start (datetime): (taken, given).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, usage=None):
+        super().__init__(("127.0.0.1", 0), PortalHandler)
+        self.usage = usage or {}
+        self.tokens = set()
+        self.sessions = set()
+        self.logins = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_page(self, body, content_type="text/html", cookie=None):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if cookie:
+            self.send_header("Set-Cookie", f"JSESSIONID={cookie}; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session_id(self):
+        for cookie in self.headers.get("Cookie", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == "JSESSIONID":
+                return value
+        return None
+
+    def new_token(self):
+        token = secrets.token_hex(8)
+        self.server.tokens.add(token)
+        return token
+
+    def do_GET(self):
+        logged_in = self.session_id() in self.server.sessions
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values
+                 in parse_qs(url.query).items()}
+        if url.path == "/dp/resources/chart" and logged_in:
+            period = datetime.fromtimestamp(int(query["ts"]) / 1000)
+            self.send_page(chart_json(self.server.usage, query["type"],
+                                      query["mo"], period),
+                           "application/json")
+        elif self.path == "/dp/UserData.do" and logged_in:
+            self.send_page(meter_page())
+        elif self.path == "/dp/UserData.json" and logged_in:
+            self.send_page(meter_json(), "application/json")
+        else:
+            self.send_page(login_page(self.new_token()))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        fields = parse_qs(self.rfile.read(length).decode())
+        field = lambda name: fields.get(name, [""])[0]
+
+        valid = (field("_antixsrf") in self.server.tokens
+                 and field("j_username") == USER
+                 and field("j_password") == PASSWORD)
+        self.server.tokens.discard(field("_antixsrf"))
+        if not valid:
+            self.send_page(login_page(self.new_token(), error=True))
+            return
+
+        session_id = secrets.token_hex(16)
+        self.server.sessions.add(session_id)
+        self.server.logins += 1
+        self.send_page(meter_page(), cookie=session_id)
+
+
+def run_http(portal, data_path=meter_client.DATA_PATH, store=None):
+    client = meter_client.MeterPortalClient(
+        portal.url, USER, PASSWORD, data_path=data_path, store=store)
+    try:
+        return client.read_meter()
+    finally:
+        client.close()
+
+
+def run_selenium(portal):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    import scraper
+
+    options = Options()
+    options.add_argument("--headless=new")
+    driver = webdriver.Chrome(service=Service(CHROMEDRIVER), options=options)
+    # scraper.login() reads the credentials and the portal address
+    os.environ.update(SCRAPER_LOGIN=USER, SCRAPER_PASSWORD=PASSWORD)
+    meter_client.PORTAL_URL = portal.url
+    scraper.driver = driver
+    try:
+        scraper.login()
+        return scraper.download_data()
+    finally:
+        driver.quit()
+
+
+def measure_http(portal, runs, data_path, store=None):
+    times = []
+    tracemalloc.start()
+    for _ in range(runs):
+        start = time.perf_counter()
+        reading = run_http(portal, data_path, store)
+        times.append(time.perf_counter() - start)
+        assert reading == (TAKEN, GIVEN), reading
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, peak
+
+
+def measure_selenium(portal, runs):
+    times = []
+    peak = 0
+    for _ in range(runs):
+        stop = threading.Event()
+        samples = []
+
+        def sample_memory():
+            # Sum RSS of chromedriver and all browser processes
+            while not stop.is_set():
+                children = psutil.Process().children(recursive=True)
+                rss = 0
+                for child in children:
+                    try:
+                        rss += child.memory_info().rss
+                    except psutil.Error:
+                        pass
+                samples.append(rss)
+                time.sleep(0.05)
+
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        reading = run_selenium(portal)
+        times.append(time.perf_counter() - start)
+        stop.set()
+        sampler.join()
+        assert reading == (TAKEN, GIVEN), reading
+        peak = max([peak] + samples)
+    return times, peak
+
+
+def print_result(name, times, peak):
+    print(f"{name:<16} median {statistics.median(times):.3f} s, "
+          f"min {min(times):.3f} s, peak memory {peak / 2**20:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--selenium", action="store_true",
+                        help="benchmark the Selenium path too")
+    args = parser.parse_args()
+
+    portal = StandInPortal().start()
+
+    # A wrong password must be reported, not parsed as a reading
+    client = meter_client.MeterPortalClient(portal.url, USER, "wrong")
+    try:
+        client.login()
+        raise AssertionError("Login with a wrong password succeeded")
+    except meter_client.LoginError:
+        pass
+    finally:
+        client.close()
+
+    times, peak = measure_http(portal, args.runs, meter_client.DATA_PATH)
+    print_result("HTTP (HTML)", times, peak)
+    times, peak = measure_http(portal, args.runs, "/dp/UserData.json")
+    print_result("HTTP (JSON)", times, peak)
+
+    # A saved session is reused by every run until the portal drops it
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(os.path.join(directory, "session.bin"),
+                             key=generate_key().encode())
+        logins = portal.logins
+        times, peak = measure_http(
+            portal, args.runs, meter_client.DATA_PATH, store)
+        assert portal.logins == logins + 1, portal.logins - logins
+        print_result("HTTP (session)", times, peak)
+
+        portal.sessions.clear()
+        assert run_http(portal, store=store) == (TAKEN, GIVEN)
+        assert portal.logins == logins + 2, portal.logins - logins
+        store.max_idle = 0
+        store.save(store.load())
+        assert store.load() is None
+        print("Saved session: one login per session, again after it was "
+              "dropped by the portal or expired.")
+
+    print("HTTP peak memory is Python allocations of the client only.")
+
+    if args.selenium:
+        try:
+            times, peak = measure_selenium(portal, args.runs)
+            print_result("Selenium", times, peak)
+            print("Selenium peak memory is RSS of chromedriver and Chromium.")
+        except Exception as e:
+            print(f"Selenium: not available: {e}")
+
+    portal.shutdown()
+
+
+if __name__ == "__main__":
+    main()
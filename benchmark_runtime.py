@@ -0,0 +1,137 @@
+"""
+Comparison of memory usage of separate services and the unified runtime.
+
+The program starts app.py, datafetcher.py and scraping_scheduler.py as
+separate interpreters, waits until they settle, and measures the resident
+memory (RSS) and unique memory (USS, memory which would be freed if the
+process exited) of them and all their children. Then it does the same with
+unified_runtime.py. The results are printed and appended to
+logs/runtime_memory.csv.
+
+Stop house_energy.py and the services before running the benchmark, both
+modes use the same port and database.
+
+Usage:
+    python benchmark_runtime.py [--settle 60] [--directory .]
+"""
+
+import argparse
+import csv
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import psutil
+
+
+MODES = {
+    "separate": ["app.py", "datafetcher.py", "scraping_scheduler.py"],
+    "unified": ["unified_runtime.py"],
+}
+RESULTS_FILE = "logs/runtime_memory.csv"
+
+
+def memory_of_tree(pid):
+    """
+    Returns memory used by a process and all its children.
+
+    Parameters:
+        pid (int): The process id.
+
+    Returns:
+        tuple: RSS and USS in bytes and the number of processes.
+    """
+    root = psutil.Process(pid)
+    rss = uss = count = 0
+    for process in [root] + root.children(recursive=True):
+        try:
+            info = process.memory_full_info()
+        except psutil.Error:
+            continue
+        rss += info.rss
+        uss += info.uss
+        count += 1
+
+    return rss, uss, count
+
+
+def measure(scripts, settle):
+    """
+    Starts the scripts, waits and measures their memory.
+
+    Parameters:
+        scripts (list): The scripts to start.
+        settle (float): Seconds to wait before measuring.
+
+    Returns:
+        tuple: RSS and USS in bytes and the number of processes.
+    """
+    processes = [
+        subprocess.Popen([sys.executable, script],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for script in scripts
+    ]
+    try:
+        time.sleep(settle)
+        totals = [0, 0, 0]
+        for process in processes:
+            if process.poll() is not None:
+                raise RuntimeError(f"{process.args[1]} exited with code "
+                                   f"{process.returncode}")
+            for index, value in enumerate(memory_of_tree(process.pid)):
+                totals[index] += value
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    return tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--settle", type=float, default=60,
+                        help="seconds to wait before measuring")
+    parser.add_argument("--directory",
+                        default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory with the database to run in")
+    args = parser.parse_args()
+
+    scripts_directory = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(args.directory)
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    now = datetime.now().replace(microsecond=0)
+
+    results = {}
+    for mode, scripts in MODES.items():
+        scripts = [os.path.join(scripts_directory, script)
+                   for script in scripts]
+        try:
+            results[mode] = measure(scripts, args.settle)
+        except RuntimeError as e:
+            print(f"{mode}: failed: {e}")
+            continue
+        rss, uss, count = results[mode]
+        print(f"{mode:<9} {count} processes, RSS {rss / 2**20:.1f} MB, "
+              f"USS {uss / 2**20:.1f} MB")
+
+    if len(results) == len(MODES):
+        saved = results["separate"][1] - results["unified"][1]
+        print(f"unified runtime saves {saved / 2**20:.1f} MB of USS "
+              f"({saved / results['separate'][1]:.0%})")
+
+    with open(RESULTS_FILE, "a", newline="") as file:
+        writer = csv.writer(file)
+        for mode, (rss, uss, count) in results.items():
+            writer.writerow([now, platform.node(), mode, count,
+                             f"{rss / 2**20:.1f}", f"{uss / 2**20:.1f}"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark of cold-start time of every entry point.
+
+Each entry point is imported in a fresh interpreter started with
+`python -X importtime`, several times in a row. The program prints the
+median wall time of each start together with the slowest top-level imports
+and appends the results to logs/startup_benchmark.csv, so the cold-start
+time on the Raspberry Pi can be tracked between changes.
+
+Importing an entry point doesn't start its main loop, so the benchmark
+measures imports and initialization only.
+
+Usage:
+    python benchmark_startup.py [--runs 5] [--top 5] [module ...]
+"""
+
+import argparse
+import csv
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+
+ENTRY_POINTS = [
+    "app",
+    "datafetcher",
+    "scraping_scheduler",
+    "scraper",
+    "house_energy",
+    "raspberry_check",
+]
+RESULTS_FILE = "logs/startup_benchmark.csv"
+
+
+def parse_importtime(stderr):
+    """
+    Reads imports done directly by the imported modules from the output
+    of `python -X importtime`, e.g. pandas imported by app.
+
+    Parameters:
+        stderr (str): The standard error of the interpreter.
+
+    Returns:
+        dict: Module name: cumulative import time in seconds.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Names are indented by two spaces per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth != 1:
+            continue
+        name = name.strip()
+        imports[name] = imports.get(name, 0) + int(cumulative) / 1e6
+
+    return imports
+
+
+def measure(module, runs):
+    """
+    Imports the module in fresh interpreters and measures the time.
+
+    Parameters:
+        module (str): The name of the entry point module.
+        runs (int): The number of interpreter starts.
+
+    Returns:
+        tuple: A list of wall times in seconds and the top-level import
+        times (dict) of the last run.
+    """
+    times = []
+    imports = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.splitlines()[-1])
+        imports = parse_importtime(result.stderr)
+
+    return times, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    now = datetime.now().replace(microsecond=0)
+
+    with open(RESULTS_FILE, "a", newline="") as results:
+        writer = csv.writer(results)
+        for module in args.modules:
+            try:
+                times, imports = measure(module, args.runs)
+            except RuntimeError as e:
+                print(f"{module}: failed to import: {e}")
+                continue
+
+            slowest = sorted(imports.items(), key=lambda item: -item[1])
+            slowest = slowest[: args.top]
+            median = statistics.median(times)
+            print(f"{module}: median {median:.3f} s, "
+                  f"min {min(times):.3f} s, max {max(times):.3f} s")
+            for name, seconds in slowest:
+                print(f"    {name:<30} {seconds:.3f} s")
+
+            writer.writerow([
+                now,
+                platform.node(),
+                module,
+                f"{median:.3f}",
+                f"{min(times):.3f}",
+                ";".join(f"{name}={seconds:.3f}" for name, seconds in slowest),
+            ])
+
+
+if __name__ == "__main__":
+    main()
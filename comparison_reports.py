@@ -0,0 +1,277 @@
+"""
+Precomputed year-over-year and month-over-month comparisons.
+
+`build()` runs nightly (scheduled by house_energy.py) and rebuilds two
+small tables from energy_balance_daily (see energy_balance.py), so the
+dashboard's compare mode never scans the raw tables:
+
+- comparison_days: the value and the month-to-date cumulative value of
+  every metric and day, used to overlay the same month of several years.
+- comparison_months: the value of every metric and month with the
+  previous month and the same month of the previous year, and their
+  changes in percent.
+
+An unfinished month is compared month-to-date: the previous month and
+the previous year are taken up to the same day of the month, so the
+current month isn't shown as a drop.
+
+Usage:
+    python comparison_reports.py [--metric METRIC]
+
+The module provides the following:
+
+- `METRICS`: Compared metrics: column of energy_balance_daily and label.
+- `create_comparison_tables()`: Creates the tables.
+- `build()`: Rebuilds the tables.
+- `fetch_days(metric, month)`: Daily rows of one calendar month in
+every year.
+- `fetch_months(metric, start, end)`: Monthly rows with the comparisons.
+"""
+
+import startup_profiler
+import argparse
+from datetime import datetime
+from sqlalchemy import text
+from data_access import engine, epoch, store_frame
+
+pd = startup_profiler.lazy_import("pandas")
+
+METRICS = {
+    "production": ("pv", "PV production"),
+    "heater": ("heater", "Heater"),
+    "imported": ("imported", "Imported from grid"),
+    "exported": ("exported", "Exported to grid"),
+}
+
+
+def create_comparison_tables():
+    """
+    Creates the comparison_days and comparison_months tables.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS comparison_days ("
+                "metric TEXT NOT NULL, "
+                "year INTEGER NOT NULL, "
+                "month INTEGER NOT NULL, "
+                "day INTEGER NOT NULL, "
+                "value REAL, "
+                "cumulative REAL, "
+                "PRIMARY KEY (metric, month, year, day)) WITHOUT ROWID"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS comparison_months ("
+                "metric TEXT NOT NULL, "
+                "year INTEGER NOT NULL, "
+                "month INTEGER NOT NULL, "
+                "days INTEGER NOT NULL, "
+                "complete INTEGER NOT NULL, "
+                "value REAL, "
+                "previous_month REAL, "
+                "month_change REAL, "
+                "previous_year REAL, "
+                "year_change REAL, "
+                "PRIMARY KEY (metric, year, month)) WITHOUT ROWID"
+            )
+        )
+
+
+def change(value, previous):
+    """
+    Returns the change from 'previous' to 'value' in percent, NaN when
+    'previous' isn't positive.
+    """
+    return (value - previous) / previous.where(previous > 0) * 100
+
+
+def _days(daily):
+    """
+    Turns daily values into the rows of comparison_days.
+
+    Parameters:
+        daily (pd.DataFrame): Columns 'time' and the metric columns.
+
+    Returns:
+        pd.DataFrame: Columns metric, year, month, day, value and
+        cumulative.
+    """
+    frame = daily.melt(
+        id_vars="time", value_vars=[column for column, _ in METRICS.values()],
+        var_name="column", value_name="value")
+    frame["metric"] = frame["column"].map(
+        {column: metric for metric, (column, _) in METRICS.items()})
+    frame["year"] = frame["time"].dt.year.astype(int)
+    frame["month"] = frame["time"].dt.month.astype(int)
+    frame["day"] = frame["time"].dt.day.astype(int)
+    frame = frame.sort_values(["metric", "year", "month", "day"])
+    frame["cumulative"] = frame.groupby(
+        ["metric", "year", "month"])["value"].cumsum()
+
+    return frame[["metric", "year", "month", "day", "value", "cumulative"]]
+
+
+def _to_date(days, metric_months, offset):
+    """
+    Returns the cumulative value of the month 'offset' months before every
+    month, up to the same day of the month.
+
+    Parameters:
+        days (pd.DataFrame): Rows of comparison_days.
+        metric_months (pd.DataFrame): Columns metric, year, month and
+        last_day (the last day with data).
+        offset (int): Number of months back.
+
+    Returns:
+        pd.Series: The values, aligned with metric_months.
+    """
+    index = metric_months["year"] * 12 + metric_months["month"] - 1 - offset
+    target = pd.DataFrame({
+        "metric": metric_months["metric"],
+        "year": index // 12,
+        "month": index % 12 + 1,
+        "day": metric_months["last_day"],
+    })
+    # The cumulative value of the last day with data up to that day
+    lookup = days.dropna(subset=["cumulative"])[
+        ["metric", "year", "month", "day", "cumulative"]]
+    merged = pd.merge_asof(
+        target.reset_index().sort_values("day"),
+        lookup.sort_values("day"),
+        on="day", by=["metric", "year", "month"])
+
+    return merged.set_index("index")["cumulative"].reindex(
+        metric_months.index)
+
+
+def build(now=None):
+    """
+    Rebuilds the comparison tables from energy_balance_daily.
+
+    Parameters:
+        now (datetime): The current time, now if None.
+
+    Returns:
+        int: The number of monthly rows.
+    """
+    create_comparison_tables()
+    now = now or datetime.now()
+    columns = ", ".join(column for column, _ in METRICS.values())
+    with engine.connect() as connection:
+        daily = pd.read_sql(
+            text(f"SELECT day, {columns} FROM energy_balance_daily "
+                 f"WHERE day < :today ORDER BY day"),
+            connection,
+            params={"today": epoch(
+                datetime.combine(now.date(), datetime.min.time()))},
+        )
+    daily.insert(0, "time", pd.to_datetime(daily.pop("day"), unit="s"))
+    # A metric without any data is read as None objects
+    metric_columns = [column for column, _ in METRICS.values()]
+    daily[metric_columns] = daily[metric_columns].astype(float)
+
+    days = _days(daily)
+    months = days.dropna(subset=["value"]).groupby(
+        ["metric", "year", "month"]).agg(
+        days=("value", "count"), value=("value", "sum"),
+        last_day=("day", "max")).reset_index()
+    length = pd.to_datetime(
+        {"year": months["year"], "month": months["month"], "day": 1}
+    ).dt.days_in_month
+    # Days without data (NULL) don't count, so a gap keeps a month open
+    months["complete"] = (months["days"] == length).astype(int)
+    # Complete months are compared whole, others month-to-date
+    months.loc[months["complete"] == 1, "last_day"] = 31
+    months["previous_month"] = _to_date(days, months, 1)
+    months["previous_year"] = _to_date(days, months, 12)
+    months["month_change"] = change(months["value"],
+                                    months["previous_month"])
+    months["year_change"] = change(months["value"], months["previous_year"])
+
+    table_columns = ["metric", "year", "month", "days", "complete", "value",
+                     "previous_month", "month_change", "previous_year",
+                     "year_change"]
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM comparison_days"))
+        connection.execute(text("DELETE FROM comparison_months"))
+        store_frame(connection, "comparison_days", days, list(days.columns))
+        store_frame(connection, "comparison_months", months, table_columns)
+
+    return len(months)
+
+
+def fetch_days(metric, month):
+    """
+    Returns the daily rows of one calendar month in every year.
+
+    Parameters:
+        metric (str): A key of METRICS.
+        month (int): The month, 1 to 12.
+
+    Returns:
+        pd.DataFrame: Columns year, day, value and cumulative.
+    """
+    create_comparison_tables()
+    with engine.connect() as connection:
+        return pd.read_sql(
+            text(
+                "SELECT year, day, value, cumulative FROM comparison_days "
+                "WHERE metric = :metric AND month = :month "
+                "ORDER BY year, day"
+            ),
+            connection,
+            params={"metric": metric, "month": month},
+        )
+
+
+def fetch_months(metric, start=None, end=None):
+    """
+    Returns monthly rows with the comparisons.
+
+    Parameters:
+        metric (str): A key of METRICS.
+        start (datetime): Optional first month.
+        end (datetime): Optional end of the range.
+
+    Returns:
+        pd.DataFrame: Column 'time' (first day of the month) and the
+        columns of comparison_months.
+    """
+    create_comparison_tables()
+    first = start.year * 12 + start.month - 1 if start else 0
+    last = end.year * 12 + end.month - 1 if end else 10 ** 6
+    with engine.connect() as connection:
+        frame = pd.read_sql(
+            text(
+                "SELECT * FROM comparison_months WHERE metric = :metric "
+                "AND year * 12 + month - 1 BETWEEN :first AND :last "
+                "ORDER BY year, month"
+            ),
+            connection,
+            params={"metric": metric, "first": first, "last": last},
+        )
+    frame.insert(0, "time", pd.to_datetime(
+        {"year": frame["year"], "month": frame["month"], "day": 1}))
+
+    return frame
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--metric", choices=METRICS, default="production")
+    args = parser.parse_args()
+
+    print(f"Built {build()} monthly rows")
+    report = fetch_months(args.metric)
+    for row in report.itertuples():
+        print(f"{row.year}-{row.month:02d} {row.value:9.1f} kWh"
+              + ("" if row.complete else f" ({row.days} days)")
+              + (f"  MoM {row.month_change:+6.1f} %"
+                 if pd.notna(row.month_change) else "")
+              + (f"  YoY {row.year_change:+6.1f} %"
+                 if pd.notna(row.year_change) else ""))
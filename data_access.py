@@ -0,0 +1,360 @@
+"""
+Data access layer shared by the dashboard and the data API.
+
+Every stored measurement is available as a named series described in the
+SERIES dictionary. Queries are written in plain SQL so that time bucketing
+and aggregation run inside SQLite and only the resulting rows are returned
+to Python. Results are fetched in chunks, which keeps memory usage constant
+even for exports covering several years.
+
+The module also owns the SQLAlchemy engine used by every other module, so
+one process (e.g. unified_runtime.py) has a single connection pool.
+
+The module provides the following functions:
+
+- `ensure_indexes()`: Creates indexes on the date columns used by range
+queries.
+- `to_db_datetime(value, table)`: Formats a datetime the way it is stored
+in the given table.
+- `iter_series(name, start, end, resolution, chunk_size)`: Yields chunks of
+(date, value) rows for a series.
+- `range_fingerprint(name, start, end)`: Returns row count, last id and last
+date of a series in the given range, used for HTTP caching.
+- `bucketed_means(table, columns, start, end, step, digits)`: Returns
+averages of columns in time buckets, e.g. 5-minute means for day charts.
+- `last_rows_per_day(table, columns, start, end)`: Returns the last row of
+every day, e.g. the final daily yield.
+- `store_frame(connection, table, frame, columns)`: Inserts or replaces
+the rows of a data frame, e.g. in the materialized tables.
+- `epoch(value)`, `from_epoch(seconds)`: Convert naive datetimes to seconds
+since epoch and back, the keys of the materialized tables.
+"""
+
+import calendar
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+
+
+engine = create_engine("sqlite:///electricity.db")
+
+# Storage format of the date column in each table
+TABLES = {
+    "solax_data": "%Y-%m-%d %H:%M:%S.%f",
+    "tuya_data": "%Y-%m-%d %H:%M:%S.%f",
+    "weather_data": "%Y-%m-%d %H:%M:%S.%f",
+    "my_power_meter": "%Y-%m-%d",
+}
+
+# Series name: source table, column and aggregate used for bucketing.
+# Counters use MAX, daily deltas use SUM and instant values use AVG.
+SERIES = {
+    "live_production": ("solax_data", "live_production", "AVG"),
+    "yield_today": ("solax_data", "yield_today", "MAX"),
+    "forward_energy": ("tuya_data", "forward_energy", "MAX"),
+    "forward_energy_daily": ("tuya_data", "forward_energy_daily", "MAX"),
+    "bathroom_upper": ("tuya_data", "bathroom_upper", "AVG"),
+    "bathroom_lower": ("tuya_data", "bathroom_lower", "AVG"),
+    "first_bedroom": ("tuya_data", "first_bedroom", "AVG"),
+    "second_bedroom": ("tuya_data", "second_bedroom", "AVG"),
+    "third_bedroom": ("tuya_data", "third_bedroom", "AVG"),
+    "weather_temperature": ("weather_data", "weather_temperature", "AVG"),
+    "weather_temperature_feels": (
+        "weather_data", "weather_temperature_feels", "AVG"),
+    "weather_humidity": ("weather_data", "weather_humidity", "AVG"),
+    "weather_pressure": ("weather_data", "weather_pressure", "AVG"),
+    "weather_wind": ("weather_data", "weather_wind", "AVG"),
+    "weather_clouds": ("weather_data", "weather_clouds", "AVG"),
+    "taken": ("my_power_meter", "taken", "MAX"),
+    "given": ("my_power_meter", "given", "MAX"),
+    "taken_daily": ("my_power_meter", "taken_daily", "SUM"),
+    "given_daily": ("my_power_meter", "given_daily", "SUM"),
+}
+
+# Resolution name: bucket size in seconds (None means raw rows)
+RESOLUTIONS = {
+    "raw": None,
+    "5min": 300,
+    "hour": 3600,
+    "day": 86400,
+}
+
+
+def ensure_indexes():
+    """
+    Creates indexes on the date column of every table if they are missing.
+    Without them every range query scans the whole table. Tables which
+    don't exist yet (a fresh database) are skipped.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        present = {row[0] for row in connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        for table in TABLES:
+            if table not in present:
+                continue
+            connection.execute(
+                text(f"CREATE INDEX IF NOT EXISTS ix_{table}_date "
+                     f"ON {table} (date)")
+            )
+
+
+def to_db_datetime(value, table):
+    """
+    Formats a datetime object the way dates are stored in the given table,
+    so it can be compared with the date column as a string.
+
+    Parameters:
+        value (datetime): The datetime to format.
+        table (str): The name of the table.
+
+    Returns:
+        str: The formatted datetime.
+    """
+    return value.strftime(TABLES[table])
+
+
+def series_sql(name, resolution="raw"):
+    """
+    Builds the SQL query returning (date, value) rows of a series
+    in the given resolution.
+
+    Parameters:
+        name (str): The name of the series, a key of SERIES.
+        resolution (str): The name of the resolution, a key of RESOLUTIONS.
+
+    Returns:
+        str: SQL query with ':start' and ':end' parameters.
+
+    Raises:
+        KeyError: If the series or resolution is unknown.
+    """
+    table, column, aggregate = SERIES[name]
+    step = RESOLUTIONS[resolution]
+
+    if step is None:
+        return (
+            f"SELECT datetime(date) AS date, {column} AS value "
+            f"FROM {table} "
+            f"WHERE date >= :start AND date < :end "
+            f"ORDER BY date"
+        )
+
+    return (
+        f"SELECT datetime(CAST(strftime('%s', date) AS INTEGER) "
+        f"/ {step} * {step}, 'unixepoch') AS date, "
+        f"{aggregate}({column}) AS value "
+        f"FROM {table} "
+        f"WHERE date >= :start AND date < :end "
+        f"GROUP BY CAST(strftime('%s', date) AS INTEGER) / {step} "
+        f"ORDER BY 1"
+    )
+
+
+def iter_series(name, start, end, resolution="raw", chunk_size=1000):
+    """
+    Yields chunks of (date, value) rows of a series between start
+    (inclusive) and end (exclusive). Rows are read from the cursor
+    chunk by chunk, so memory usage doesn't depend on the range size.
+
+    Parameters:
+        name (str): The name of the series, a key of SERIES.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        resolution (str): The name of the resolution, a key of RESOLUTIONS.
+        chunk_size (int): The maximum number of rows in one chunk.
+
+    Yields:
+        list: A list of (date, value) tuples, date formatted as
+        'YYYY-MM-DD HH:MM:SS'.
+    """
+    table = SERIES[name][0]
+    params = {
+        "start": to_db_datetime(start, table),
+        "end": to_db_datetime(end, table),
+    }
+
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            text(series_sql(name, resolution)), params
+        )
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+
+def range_fingerprint(name, start, end):
+    """
+    Returns a cheap summary of the rows of a series in the given range.
+    It changes whenever rows are added to or removed from the range.
+
+    Parameters:
+        name (str): The name of the series, a key of SERIES.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        tuple: Row count (int), last id (int or None) and last date
+        (datetime or None).
+    """
+    table = SERIES[name][0]
+    params = {
+        "start": to_db_datetime(start, table),
+        "end": to_db_datetime(end, table),
+    }
+
+    with engine.connect() as connection:
+        count, last_id, last_date = connection.execute(
+            text(
+                f"SELECT COUNT(*), MAX(id), datetime(MAX(date)) FROM {table} "
+                f"WHERE date >= :start AND date < :end"
+            ),
+            params,
+        ).one()
+
+    if last_date is not None:
+        last_date = datetime.strptime(last_date, "%Y-%m-%d %H:%M:%S")
+
+    return count, last_id, last_date
+
+
+def bucketed_means(table, columns, start, end, step=300, digits=None):
+    """
+    Returns averages of the given columns in time buckets, computed with
+    an integer time-bucket GROUP BY inside SQLite.
+
+    Parameters:
+        table (str): The name of the table.
+        columns (list): The names of the columns to average.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        step (int): The bucket size in seconds.
+        digits (int): Optional number of decimal digits to round to.
+
+    Returns:
+        list: A list of tuples: bucket start (datetime) followed by
+        the average of each column.
+    """
+    averages = ", ".join(
+        f"AVG({column})" if digits is None
+        else f"ROUND(AVG({column}), {digits})"
+        for column in columns
+    )
+    query = text(
+        f"SELECT CAST(strftime('%s', date) AS INTEGER) / {step} * {step} "
+        f"AS bucket, {averages} "
+        f"FROM {table} "
+        f"WHERE date >= :start AND date < :end "
+        f"GROUP BY bucket ORDER BY bucket"
+    )
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            query,
+            {
+                "start": to_db_datetime(start, table),
+                "end": to_db_datetime(end, table),
+            },
+        ).all()
+
+    return [(from_epoch(row[0]), *row[1:]) for row in rows]
+
+
+def last_rows_per_day(table, columns, start, end):
+    """
+    Returns the last row of every day in the range, picked with
+    a ROW_NUMBER() window function partitioned by day.
+
+    Parameters:
+        table (str): The name of the table.
+        columns (list): The names of the columns to return.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        list: A list of tuples: the day (date) followed by the values
+        of the columns.
+    """
+    selected = ", ".join(columns)
+    query = text(
+        f"SELECT day, {selected} FROM ("
+        f"SELECT date(date) AS day, {selected}, "
+        f"ROW_NUMBER() OVER (PARTITION BY date(date) ORDER BY date DESC) "
+        f"AS position "
+        f"FROM {table} "
+        f"WHERE date >= :start AND date < :end"
+        f") WHERE position = 1 ORDER BY day"
+    )
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            query,
+            {
+                "start": to_db_datetime(start, table),
+                "end": to_db_datetime(end, table),
+            },
+        ).all()
+
+    return [
+        (datetime.strptime(row[0], "%Y-%m-%d").date(), *row[1:])
+        for row in rows
+    ]
+
+
+def store_frame(connection, table, frame, columns):
+    """
+    Inserts or replaces the rows of a data frame in a table. Missing
+    values (NaN) are stored as NULL.
+
+    Parameters:
+        connection: Open database connection.
+        table (str): The table.
+        frame (pd.DataFrame): The rows.
+        columns (list): The columns to store, including the key.
+
+    Returns:
+        int: The number of rows.
+    """
+    rows = frame[columns].astype(object).where(
+        frame[columns].notna(), None).to_dict("records")
+    if rows:
+        connection.execute(
+            text(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join(':' + column for column in columns)})"
+            ),
+            rows,
+        )
+
+    return len(rows)
+
+
+def epoch(value):
+    """
+    Converts a naive datetime to seconds since epoch the same way SQLite
+    strftime('%s', ...) does, treating it as UTC.
+
+    Parameters:
+        value (datetime): The datetime to convert.
+
+    Returns:
+        int: Seconds since epoch.
+    """
+    return calendar.timegm(value.timetuple())
+
+
+def from_epoch(seconds):
+    """
+    Converts seconds since epoch returned by strftime('%s', ...) back
+    to a naive datetime.
+
+    Parameters:
+        seconds (int): Seconds since epoch.
+
+    Returns:
+        datetime: The naive datetime.
+    """
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds)
@@ -0,0 +1,235 @@
+"""
+Flask routes for bulk data export, registered on the Dash server.
+
+Routes:
+- `/api/series`: Lists available series, resolutions and formats.
+- `/api/series/<name>`: Returns one series for an arbitrary range and
+resolution. Query parameters:
+    - start, end: ISO dates or datetimes (default: the last 24 hours).
+    - resolution: raw, 5min, hour, day or auto (default: raw). Auto lets
+    the query planner choose the finest resolution within the point budget.
+    - format: csv, ndjson or arrow (default: csv).
+
+Bucketed resolutions are read from the precomputed rollups where they are
+available. Responses are streamed in chunks straight from the database
+cursor, so exports of any size run in constant memory. Ranges that ended before
+today are closed and don't change anymore, so they are sent with ETag and
+Last-Modified headers and answered with 304 when the client already has
+them. Arrow IPC output requires the optional pyarrow package.
+"""
+
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, abort, jsonify, request
+import data_access
+import query_planner
+
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+CHUNK_SIZE = 5000
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def parse_range(args):
+    """
+    Reads the requested range from the query parameters.
+
+    Parameters:
+        args (MultiDict): The request query parameters.
+
+    Returns:
+        tuple: start (datetime) and end (datetime).
+
+    Raises:
+        ValueError: If a date can't be parsed or end isn't after start.
+    """
+    end = args.get("end")
+    end = datetime.fromisoformat(end) if end else datetime.now()
+    start = args.get("start")
+    start = datetime.fromisoformat(start) if start \
+        else end - timedelta(days=1)
+
+    if end <= start:
+        raise ValueError("end must be after start")
+
+    return start, end
+
+
+def csv_chunks(chunks):
+    """
+    Converts chunks of (date, value) rows to CSV text.
+
+    Parameters:
+        chunks (iterable): Chunks of rows from data_access.iter_series.
+
+    Yields:
+        str: CSV text, the header first.
+    """
+    yield "date,value\n"
+    for rows in chunks:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(chunks):
+    """
+    Converts chunks of (date, value) rows to newline delimited JSON.
+
+    Parameters:
+        chunks (iterable): Chunks of rows from data_access.iter_series.
+
+    Yields:
+        str: One JSON object per line.
+    """
+    for rows in chunks:
+        yield "".join(
+            json.dumps({"date": row[0], "value": row[1]}) + "\n"
+            for row in rows
+        )
+
+
+def arrow_chunks(chunks):
+    """
+    Converts chunks of (date, value) rows to an Arrow IPC stream,
+    one record batch per chunk.
+
+    Parameters:
+        chunks (iterable): Chunks of rows from data_access.iter_series.
+
+    Yields:
+        bytes: Parts of the Arrow IPC stream.
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([("date", pa.timestamp("s")), ("value", pa.float64())])
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def take():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield take()
+    for rows in chunks:
+        dates, values = zip(*rows)
+        batch = pa.record_batch(
+            [
+                pa.array(dates, pa.string()).cast(pa.timestamp("s")),
+                pa.array(values, pa.float64()),
+            ],
+            schema=schema,
+        )
+        writer.write_batch(batch)
+        yield take()
+    writer.close()
+    yield take()
+
+
+FORMATTERS = {
+    "csv": csv_chunks,
+    "ndjson": ndjson_chunks,
+    "arrow": arrow_chunks,
+}
+
+
+@api.route("/series")
+def list_series():
+    """
+    Lists available series, resolutions and output formats.
+
+    Returns:
+        Response: JSON document.
+    """
+    return jsonify(
+        {
+            "series": sorted(data_access.SERIES),
+            "resolutions": list(data_access.RESOLUTIONS) + ["auto"],
+            "formats": list(FORMATTERS),
+        }
+    )
+
+
+@api.route("/series/<name>")
+def export_series(name):
+    """
+    Streams one series for the requested range, resolution and format.
+
+    Parameters:
+        name (str): The name of the series.
+
+    Returns:
+        Response: Streamed response, or 304 if the client's cached copy
+        of a closed range is still valid.
+    """
+    if name not in data_access.SERIES:
+        abort(404, f"Unknown series: {name}")
+
+    resolution = request.args.get("resolution", "raw")
+    output_format = request.args.get("format", "csv")
+    if resolution not in data_access.RESOLUTIONS and resolution != "auto":
+        abort(400, f"Unknown resolution: {resolution}")
+    if output_format not in FORMATTERS:
+        abort(400, f"Unknown format: {output_format}")
+    if output_format == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            abort(406, "Arrow output requires pyarrow")
+
+    try:
+        start, end = parse_range(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    if resolution == "auto":
+        resolution = query_planner.choose_resolution(name, start, end)
+
+    headers = {
+        "Content-Disposition":
+            f"attachment; filename={name}_{resolution}.{output_format}",
+    }
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    closed = end <= today
+    if closed:
+        count, last_id, last_date = data_access.range_fingerprint(
+            name, start, end)
+        etag = hashlib.sha1(
+            f"{name}|{start}|{end}|{resolution}|{output_format}|"
+            f"{count}|{last_id}".encode()
+        ).hexdigest()
+        headers["ETag"] = f'"{etag}"'
+        headers["Cache-Control"] = "public, max-age=86400"
+        response_last_modified = last_date or start
+        # Answers If-None-Match, or If-Modified-Since without it, with 304
+        cached = Response(headers=headers)
+        cached.last_modified = response_last_modified
+        if cached.make_conditional(request).status_code == 304:
+            return cached
+    else:
+        headers["Cache-Control"] = "no-cache"
+        response_last_modified = None
+
+    chunks = query_planner.iter_series(
+        name, start, end, resolution, chunk_size=CHUNK_SIZE)
+    response = Response(
+        FORMATTERS[output_format](chunks),
+        mimetype=MIMETYPES[output_format],
+        headers=headers,
+    )
+    if response_last_modified is not None:
+        response.last_modified = response_last_modified
+
+    return response
@@ -12,7 +12,13 @@ The program performs the following tasks:
 - Defines functions for downloading data from external APIs
 - Defines functions for saving data to the database
 - Defines a function to calculate daily energy consumption
+- Evaluates the data alert rules (alert_rules.py) on every sample
+- Detects anomalies against time of day baselines (anomaly_detector.py)
+- Skips downloads from sources which network_health reports unreachable
+- Adds every smart meter reading to the hourly heater energy counter
 - Sets up a scheduler to periodically save data to the database
+  and refresh the series rollups, the energy balance and bills, the
+  rooms' thermal model and the PV forecast used by the dashboard
 - Runs the scheduler in an infinite loop
 
 Note: The program relies on environment variables for API keys
@@ -20,6 +26,7 @@ and other sensitive information.
 """
 
 # import logging
+import startup_profiler
 import os
 import time
 from datetime import datetime, date
@@ -33,16 +40,23 @@ from sqlalchemy import (
     Float,
     String,
     DateTime,
-    create_engine,
 )
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, declarative_base
 import schedule
 import message_sender as telegram
-from tuya_connector import (
-    TuyaOpenAPI,
-    # TUYA_LOGGER,
-)
+import rollups
+import energy_counter
+import energy_balance
+import pv_forecast
+import tariff
+import thermal_model
+from data_access import engine
+import latest_sample
+import alert_rules
+import anomaly_detector
+import network_health
+
+startup_profiler.mark("imports")
 
 load_dotenv()
 
@@ -69,7 +83,6 @@ SMART_METER_ID = "bfa7eff5705ba20638xbng"
 SOLAX_URL = os.getenv("SOLAX_URL")
 
 Base = declarative_base()
-engine = create_engine("sqlite:///electricity.db")
 
 
 class TuyaData(Base):
@@ -110,6 +123,10 @@ class WeatherData(Base):
 Base.metadata.create_all(engine)
 
 Session = sessionmaker(bind=engine)
+latest_sample_writer = latest_sample.LatestSampleWriter()
+network_monitor = network_health.monitor()
+alert_engine = alert_rules.AlertEngine(notify=telegram.send_message)
+anomalies = anomaly_detector.AnomalyDetector(notify=telegram.send_message)
 
 
 @contextmanager
@@ -132,7 +149,7 @@ def session_scope():
     try:
         yield session
         session.commit()
-    except:
+    except Exception:
         session.rollback()
         print("Error: Session scope failed")
         telegram.send_message("Error: Session scope failed")
@@ -176,6 +193,12 @@ def download_tuya_data():
     - heaters_responses (dict): Dictionary containing temperatures
       in each room.
     """
+    # Imported here, tuya_connector is slow to import and only used here
+    from tuya_connector import (
+        TuyaOpenAPI,
+        # TUYA_LOGGER,
+    )
+
     try:
         # Enable debug log
         # TUYA_LOGGER.setLevel(logging.DEBUG)
@@ -200,7 +223,7 @@ def download_tuya_data():
 
         return total_energy, heaters_responses
 
-    except:
+    except Exception:
         print("Error: Could not retrive data from TUYA")
         telegram.send_message("Error: Could not retrive data from TUYA")
 
@@ -270,9 +293,43 @@ def calculate_forward_energy_daily(row):
     return row
 
 
+def publish_latest_sample(solax_data, tuya_data, weather_data):
+    """
+    Writes the newest downloaded values to the shared memory block,
+    so the dashboard can show them without querying the database.
+
+    Parameters:
+    - solax_data (tuple): Result of download_solax_data or None.
+    - tuya_data (tuple): Result of download_tuya_data or None.
+    - weather_data (tuple): Result of download_weather_data or None.
+
+    Returns:
+        dict: The published values, series name: value.
+    """
+    values = {}
+    if solax_data:
+        values["yield_today"] = solax_data[0]
+        values["live_production"] = solax_data[1]
+    if tuya_data:
+        values["forward_energy"] = tuya_data[0]
+        values["bathroom_upper"] = tuya_data[1]["Bathroom upper"]
+        values["bathroom_lower"] = tuya_data[1]["Bathroom lower"]
+        values["first_bedroom"] = tuya_data[1]["First bedroom"]
+        values["second_bedroom"] = tuya_data[1]["Second bedroom"]
+        values["third_bedroom"] = tuya_data[1]["Third bedroom"]
+    if weather_data:
+        values["weather_temperature"] = weather_data[0]
+        values["weather_temperature_feels"] = weather_data[1]
+
+    latest_sample_writer.write(values)
+    return values
+
+
 def save_all_data_to_db():
     """
-    Downloads data from various sources and saves it to the database.
+    Downloads data from various sources, publishes the newest values
+    in the shared memory block read by the dashboard and saves them
+    to the database.
 
     Returns:
         None
@@ -282,21 +339,31 @@ def save_all_data_to_db():
         downloading or saving the data.
 
     """
+    solax_data = tuya_data = weather_data = None
+    solax_to_db = tuya_to_db = weather_to_db = None
+    if not network_monitor.is_online():
+        print(f"{datetime.now().replace(microsecond=0)} "
+              "Network offline, skipping downloads")
+        alert_engine.ingest({})
+        return
+
     try:
-        solax_data = download_solax_data()
+        if network_monitor.is_reachable("solax"):
+            solax_data = download_solax_data()
         if solax_data:
             solax_to_db = SolaxData(
                 date=datetime.now().replace(microsecond=0),
                 yield_today=solax_data[0],
                 live_production=solax_data[1],
             )
-    except:
+    except Exception:
         print("Error: Could not download Solax data to database")
         telegram.send_message(
             "Error: Could not download Solax data to database")
 
     try:
-        tuya_data = download_tuya_data()
+        if network_monitor.is_reachable("tuya"):
+            tuya_data = download_tuya_data()
         if tuya_data:
             tuya_to_db = TuyaData(
                 date=datetime.now().replace(microsecond=0),
@@ -308,13 +375,14 @@ def save_all_data_to_db():
                 third_bedroom=tuya_data[1]["Third bedroom"],
             )
             tuya_to_db = calculate_forward_energy_daily(tuya_to_db)
-    except:
+    except Exception:
         print("Error: Could not download Tuya data to database")
         telegram.send_message(
             "Error: Could not download Tuya data to database")
 
     try:
-        weather_data = download_weather_data()
+        if network_monitor.is_reachable("weather"):
+            weather_data = download_weather_data()
         if weather_data:
             weather_to_db = WeatherData(
                 date=datetime.now().replace(microsecond=0),
@@ -327,40 +395,118 @@ def save_all_data_to_db():
                 weather_clouds=weather_data[6],
                 weather_description=weather_data[7],
             )
-    except:
+    except Exception:
         print("Error: Could not download Weather data to database")
         telegram.send_message(
             "Error: Could not download Weather data to database")
 
+    values = {}
     try:
-        with session_scope() as session:
-            session.add(solax_to_db)
+        values = publish_latest_sample(solax_data, tuya_data, weather_data)
+    except Exception as e:
+        print(f"Error: Could not publish latest sample: {e}")
 
-    except:
+    try:
+        alert_engine.ingest(values)
+    except Exception as e:
+        print(f"Error: Could not evaluate alert rules: {e}")
+
+    try:
+        anomalies.ingest(values)
+    except Exception as e:
+        print(f"Error: Could not evaluate anomalies: {e}")
+
+    try:
+        if solax_to_db is not None:
+            with session_scope() as session:
+                session.add(solax_to_db)
+
+    except Exception:
         print("Error: Could not save Solax data to database")
         telegram.send_message("Error: Could not save Solax data to database")
 
     try:
-        with session_scope() as session:
-            session.add(tuya_to_db)
+        if tuya_to_db is not None:
+            with session_scope() as session:
+                session.add(tuya_to_db)
+                tuya_sample = (tuya_to_db.date, tuya_to_db.forward_energy)
+            energy_counter.add_sample(*tuya_sample)
 
-    except:
+    except Exception:
         print("Error: Could not save Tuya data to database")
         telegram.send_message("Error: Could not save Tuya data to database")
 
     try:
-        with session_scope() as session:
-            session.add(weather_to_db)
+        if weather_to_db is not None:
+            with session_scope() as session:
+                session.add(weather_to_db)
 
-    except:
+    except Exception:
         print("Error: Could not save Weather data to database")
         telegram.send_message("Error: Could not save Weather data to database")
 
 
+def refresh_energy_balance():
+    """
+    Recomputes the energy balance tables incrementally and the bills
+    of days which got a meter reading.
+
+    Returns:
+        None
+    """
+    try:
+        energy_balance.refresh()
+        tariff.refresh()
+    except Exception as e:
+        print(f"{datetime.now().replace(microsecond=0)} "
+              f"Error refreshing energy balance: {e}")
+
+
+def refresh_thermal_model():
+    """
+    Recomputes the daily thermal model of the rooms incrementally.
+
+    Returns:
+        None
+    """
+    try:
+        thermal_model.refresh()
+    except Exception as e:
+        print(f"{datetime.now().replace(microsecond=0)} "
+              f"Error refreshing thermal model: {e}")
+
+
+def refresh_pv_forecast():
+    """
+    Adds new hours to the PV forecast model and refreshes the forecast
+    when the weather API is reachable.
+
+    Returns:
+        None
+    """
+    try:
+        if network_monitor.is_reachable("weather"):
+            pv_forecast.update()
+        else:
+            pv_forecast.train()
+    except Exception as e:
+        print(f"{datetime.now().replace(microsecond=0)} "
+              f"Error refreshing PV forecast: {e}")
+
+
 schedule.every(10).seconds.do(save_all_data_to_db)
-schedule.run_all()
+schedule.every(15).minutes.do(refresh_energy_balance)
+schedule.every(1).hours.do(refresh_pv_forecast)
+schedule.every(1).hours.do(refresh_thermal_model)
+schedule.every(1).minutes.do(rollups.refresh_rollups)
+startup_profiler.mark("init")
 
 if __name__ == "__main__":
+    startup_profiler.report("datafetcher.py")
+    telegram.install_sigterm_flush()
+    if not energy_counter.is_built():
+        energy_counter.rebuild()
+    schedule.run_all()
     while True:
         schedule.run_pending()
         time.sleep(1)
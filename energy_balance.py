@@ -0,0 +1,414 @@
+"""
+Energy balance of the house: PV production, heater consumption and
+grid import and export related to each other.
+
+The sources are sampled differently: the inverter's yield_today counter
+every few seconds (solax_data), the heater's smart meter every few seconds
+(already counted per hour in heater_energy_hourly, see energy_counter.py)
+and the grid meter once a day (my_power_meter). The PV counter is aligned
+to clock hours with a sorted as-of join (pandas merge_asof): each hour
+boundary takes the last reading of the hour before it, and the hourly
+production is the difference of consecutive boundaries (the counter
+resets every day). Hours without readings, and without heater counter
+data, stay NULL instead of 0. Days are then joined with the daily grid
+meter readings.
+
+Materialized tables (keys are seconds since epoch of the naive local time,
+as in rollups.py):
+
+- energy_balance_hourly: pv, heater and heater_from_pv (the part of the
+  heater's consumption which PV could cover in that hour). The grid meter
+  is read daily, so grid metrics aren't available per hour.
+- energy_balance_daily and energy_balance_monthly: the above plus imported,
+  exported, self_consumed (PV used in the house), consumption, net_import
+  and the ratios self_consumption (self-consumed share of PV), heater_share
+  (heater's share of consumption) and pv_coverage (share of consumption
+  covered by PV). Grid-based values are NULL for days without a meter
+  reading; monthly ratios only count days with one.
+
+All energies are in kWh. `refresh()` recomputes only the last day and the
+days which got a grid meter reading since the previous refresh.
+
+The module provides the following:
+
+- `create_balance_tables()`: Creates the tables.
+- `hourly_pv(start, end)`: PV production per hour, from the as-of join.
+- `refresh(since)`: Recomputes the tables from 'since' (incrementally by
+default).
+- `fetch(resolution, start, end)`: Returns materialized rows.
+"""
+
+import startup_profiler
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from data_access import engine, epoch, store_frame, to_db_datetime
+
+pd = startup_profiler.lazy_import("pandas")
+np = startup_profiler.lazy_import("numpy")
+
+DAY = 86400
+# Days computed in one pass, which bounds memory of a full rebuild
+CHUNK_DAYS = 31
+METER_SCALE = 10000
+SOLAX_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# The oldest reading used for an hour boundary
+TOLERANCE = timedelta(hours=1)
+
+TABLES = {
+    "hour": "energy_balance_hourly",
+    "day": "energy_balance_daily",
+    "month": "energy_balance_monthly",
+}
+HOURLY_COLUMNS = ["pv", "heater", "heater_from_pv"]
+DAILY_COLUMNS = HOURLY_COLUMNS + [
+    "imported", "exported", "self_consumed", "consumption", "net_import",
+    "self_consumption", "heater_share", "pv_coverage",
+]
+
+
+def create_balance_tables():
+    """
+    Creates the hourly, daily and monthly tables and the state table
+    holding the last grid meter day included.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS energy_balance_hourly ("
+                "hour INTEGER PRIMARY KEY, "
+                + ", ".join(f"{column} REAL" for column in HOURLY_COLUMNS)
+                + ")"
+            )
+        )
+        for table, key in (("energy_balance_daily", "day"),
+                           ("energy_balance_monthly", "month")):
+            connection.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    f"{key} INTEGER PRIMARY KEY, "
+                    + ", ".join(f"{column} REAL" for column in DAILY_COLUMNS)
+                    + ")"
+                )
+            )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS energy_balance_state ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "meter_date TEXT)"
+            )
+        )
+
+
+def to_epoch(times):
+    """
+    Converts a pandas datetime column (or index) to seconds since epoch.
+    """
+    return (times - pd.Timestamp(1970, 1, 1)) // pd.Timedelta(seconds=1)
+
+
+def hourly_pv(start, end, connection=None):
+    """
+    Returns PV production in each hour of the range. The yield_today
+    counter is read at every hour boundary with an as-of join, the
+    production of an hour is the increase between its boundaries, or
+    the value at its end when the counter was reset. A boundary without
+    a reading in the preceding TOLERANCE has no value, so hours of an
+    outage are NaN and the production of the outage isn't booked into
+    the hour when readings resume.
+
+    The oldest rows hold the yield of a whole day, stamped at midnight
+    of that day. Their yield is booked into the last hour of the day.
+
+    Parameters:
+        start (datetime): The first hour.
+        end (datetime): The end of the last hour.
+        connection: Optional open database connection.
+
+    Returns:
+        pd.DataFrame: Columns 'hour' (seconds since epoch) and 'pv' (kWh,
+        NaN without readings).
+    """
+    boundaries = pd.DataFrame({"time": pd.date_range(start, end, freq="h")})
+    query = text(
+        "SELECT date, yield_today, live_production FROM solax_data "
+        "WHERE date >= :first AND date <= :end AND yield_today IS NOT NULL "
+        "ORDER BY date"
+    )
+    params = {
+        # The reading before the range starts the first hour
+        "first": to_db_datetime(start - TOLERANCE, "solax_data"),
+        "end": to_db_datetime(end, "solax_data"),
+    }
+    if connection is None:
+        with engine.connect() as connection:
+            readings = pd.read_sql(query, connection, params=params)
+    else:
+        readings = pd.read_sql(query, connection, params=params)
+
+    readings["time"] = pd.to_datetime(readings["date"], format=SOLAX_FORMAT)
+    daily = readings["live_production"].isna() \
+        & (readings["time"] == readings["time"].dt.normalize())
+    counter = pd.merge_asof(
+        boundaries, readings.loc[~daily, ["time", "yield_today"]],
+        on="time", direction="backward", tolerance=TOLERANCE)
+
+    value = counter["yield_today"].to_numpy(dtype=float)
+    increase = value[1:] - value[:-1]
+    # The counter drops to 0 once a day, after midnight
+    pv = np.where(increase < 0, value[1:], increase)
+
+    hourly = pd.DataFrame({
+        "hour": to_epoch(boundaries["time"].iloc[:-1]).to_numpy(),
+        "pv": np.clip(pv, 0, None),
+    })
+    last_hours = readings[daily].set_index(
+        to_epoch(readings.loc[daily, "time"] + pd.Timedelta(hours=23))
+    )["yield_today"]
+    hourly["pv"] = hourly["hour"].map(last_hours).combine_first(hourly["pv"])
+
+    return hourly
+
+
+def _compute(connection, start, end):
+    """
+    Computes hourly and daily rows of whole days in a range.
+
+    Parameters:
+        connection: Open database connection.
+        start (datetime): Midnight of the first day.
+        end (datetime): Midnight after the last day.
+
+    Returns:
+        tuple: The hourly and daily pd.DataFrame.
+    """
+    hourly = hourly_pv(start, end, connection)
+    heater = pd.read_sql(
+        text(
+            "SELECT hour, energy AS heater FROM heater_energy_hourly "
+            "WHERE hour >= :start AND hour < :end"
+        ),
+        connection,
+        params={"start": epoch(start), "end": epoch(end)},
+    )
+    # Hours without heater counter data stay NULL
+    hourly = hourly.merge(heater, on="hour", how="left")
+    both = hourly[["pv", "heater"]]
+    hourly["heater_from_pv"] = both.min(axis=1).where(both.notna().all(axis=1))
+
+    hourly["day"] = hourly["hour"] // DAY * DAY
+    daily = hourly.groupby("day", as_index=False)[HOURLY_COLUMNS].sum(
+        min_count=1)
+
+    meter = pd.read_sql(
+        text(
+            "SELECT date, taken_daily, given_daily FROM my_power_meter "
+            "WHERE date >= :start AND date < :end"
+        ),
+        connection,
+        params={"start": to_db_datetime(start, "my_power_meter"),
+                "end": to_db_datetime(end, "my_power_meter")},
+    )
+    meter["day"] = to_epoch(pd.to_datetime(meter["date"]))
+    meter["imported"] = meter["taken_daily"] / METER_SCALE
+    meter["exported"] = meter["given_daily"] / METER_SCALE
+    daily = daily.merge(meter[["day", "imported", "exported"]], on="day",
+                        how="left")
+    daily["self_consumed"] = (daily["pv"].fillna(0.0)
+                              - daily["exported"]).clip(lower=0)
+    daily["consumption"] = daily["self_consumed"] + daily["imported"]
+    daily["pv_metered"] = daily["pv"].where(daily["imported"].notna())
+    daily = add_ratios(daily)
+
+    # Hours and days without any data (e.g. after the last reading)
+    # aren't stored
+    hourly = hourly.dropna(subset=HOURLY_COLUMNS, how="all")
+    daily = daily.dropna(subset=["pv", "heater", "imported", "exported"],
+                         how="all")
+    return hourly[["hour"] + HOURLY_COLUMNS], daily
+
+
+def add_ratios(frame):
+    """
+    Adds net import and ratio columns to daily or monthly sums.
+
+    Parameters:
+        frame (pd.DataFrame): Sums with the energy columns and
+        'pv_metered' (PV production of days with a grid meter reading).
+
+    Returns:
+        pd.DataFrame: The frame with the derived columns.
+    """
+    consumption = frame["consumption"].where(frame["consumption"] > 0)
+    frame["net_import"] = frame["imported"] - frame["exported"]
+    frame["self_consumption"] = frame["self_consumed"] \
+        / frame["pv_metered"].where(frame["pv_metered"] > 0)
+    frame["heater_share"] = frame["heater"].where(
+        frame["imported"].notna()) / consumption
+    frame["pv_coverage"] = frame["self_consumed"] / consumption
+    return frame
+
+
+def _since(connection):
+    """
+    Returns the start of an incremental refresh: the day before the last
+    materialized hour, or the first day with a new grid meter reading if
+    that is earlier.
+
+    Returns:
+        datetime or None: The start, None if nothing was computed yet.
+    """
+    last_hour = connection.execute(
+        text("SELECT MAX(hour) FROM energy_balance_hourly")).scalar()
+    if last_hour is None:
+        return None
+    since = datetime(1970, 1, 1) + timedelta(seconds=last_hour - DAY)
+
+    meter_date = connection.execute(
+        text("SELECT meter_date FROM energy_balance_state WHERE id = 1")
+    ).scalar()
+    if meter_date is not None:
+        newer = connection.execute(
+            text(
+                "SELECT MIN(date) FROM my_power_meter "
+                "WHERE date > :date AND taken_daily IS NOT NULL"
+            ),
+            {"date": meter_date},
+        ).scalar()
+        if newer is not None:
+            since = min(since, datetime.fromisoformat(newer))
+
+    return since
+
+
+def refresh(since=None, now=None):
+    """
+    Recomputes the tables from the day of 'since' to now, in chunks of
+    CHUNK_DAYS days, and the monthly rows of the affected months.
+
+    Parameters:
+        since (datetime): Start of the recomputed range. If None, the
+        refresh is incremental (see _since) or, on the first run, covers
+        the whole history.
+        now (datetime): The current time, now if None.
+
+    Returns:
+        None
+    """
+    create_balance_tables()
+    now = now or datetime.now()
+
+    with engine.connect() as connection:
+        since = since or _since(connection) or datetime.fromisoformat(
+            connection.execute(
+                text("SELECT MIN(date) FROM solax_data")).scalar()
+            or now.isoformat())
+        meter_date = connection.execute(
+            text(
+                "SELECT MAX(date) FROM my_power_meter "
+                "WHERE taken_daily IS NOT NULL"
+            )
+        ).scalar()
+
+    start = datetime.combine(since.date(), datetime.min.time())
+    end = datetime.combine(now.date(), datetime.min.time()) \
+        + timedelta(days=1)
+
+    while start < end:
+        chunk_end = min(start + timedelta(days=CHUNK_DAYS), end)
+        with engine.begin() as connection:
+            hourly, daily = _compute(connection, start, chunk_end)
+            for table, key in (("energy_balance_hourly", "hour"),
+                               ("energy_balance_daily", "day")):
+                connection.execute(
+                    text(f"DELETE FROM {table} "
+                         f"WHERE {key} >= :start AND {key} < :end"),
+                    {"start": epoch(start), "end": epoch(chunk_end)},
+                )
+            store_frame(connection, "energy_balance_hourly", hourly,
+                        ["hour"] + HOURLY_COLUMNS)
+            store_frame(connection, "energy_balance_daily", daily,
+                        ["day"] + DAILY_COLUMNS)
+        start = chunk_end
+
+    with engine.begin() as connection:
+        _refresh_months(connection, since)
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO energy_balance_state (id, meter_date) "
+                "VALUES (1, :date)"
+            ),
+            {"date": meter_date},
+        )
+
+
+def _refresh_months(connection, since):
+    """
+    Sums daily rows into the months from the month of 'since'.
+
+    Parameters:
+        connection: Open database connection.
+        since (datetime): A day in the first recomputed month.
+
+    Returns:
+        None
+    """
+    first = epoch(datetime(since.year, since.month, 1))
+    month = "strftime('%s', day, 'unixepoch', 'start of month')"
+    metered = "CASE WHEN imported IS NOT NULL THEN {} END"
+    daily = pd.read_sql(
+        text(
+            f"SELECT {month} + 0 AS month, SUM(pv) AS pv, "
+            f"SUM(heater) AS heater, SUM(heater_from_pv) AS heater_from_pv, "
+            f"SUM(imported) AS imported, SUM(exported) AS exported, "
+            f"SUM(self_consumed) AS self_consumed, "
+            f"SUM(consumption) AS consumption, "
+            f"SUM({metered.format('pv')}) AS pv_metered, "
+            f"SUM({metered.format('heater')}) AS heater_metered "
+            f"FROM energy_balance_daily WHERE day >= :first GROUP BY 1"
+        ),
+        connection,
+        params={"first": first},
+    )
+    monthly = add_ratios(daily)
+    # The heater share only counts days with a grid meter reading
+    monthly["heater_share"] = monthly["heater_metered"] \
+        / monthly["consumption"].where(monthly["consumption"] > 0)
+
+    connection.execute(
+        text("DELETE FROM energy_balance_monthly WHERE month >= :first"),
+        {"first": first},
+    )
+    store_frame(connection, "energy_balance_monthly", monthly,
+                ["month"] + DAILY_COLUMNS)
+
+
+def fetch(resolution, start, end):
+    """
+    Returns materialized rows in a range.
+
+    Parameters:
+        resolution (str): 'hour', 'day' or 'month'.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        pd.DataFrame: Column 'time' (datetime) and the energy and ratio
+        columns of the resolution.
+    """
+    key = resolution
+    create_balance_tables()
+    with engine.connect() as connection:
+        frame = pd.read_sql(
+            text(
+                f"SELECT * FROM {TABLES[resolution]} "
+                f"WHERE {key} >= :start AND {key} < :end ORDER BY {key}"
+            ),
+            connection,
+            params={"start": epoch(start), "end": epoch(end)},
+        )
+    frame.insert(0, "time", pd.to_datetime(frame.pop(key), unit="s"))
+
+    return frame
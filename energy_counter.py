@@ -0,0 +1,320 @@
+"""
+Hourly energy counter of the electric heater.
+
+Every new reading of the smart meter's forward_energy counter is turned into
+an energy delta of the interval since the previous reading. The delta is
+split proportionally at clock hour boundaries (also across gaps in the
+data) and added to the heater_energy_hourly table, one row per hour.
+Hourly, daily and monthly heater consumption are then exact sums of a few
+rows instead of calculations over raw readings.
+
+Hours are stored as seconds since epoch of the naive local time, the same
+way SQLite strftime('%s', ...) converts stored dates.
+
+The module provides the following functions:
+
+- `create_counter_tables()`: Creates the counter and state tables.
+- `split_interval(start, end, energy)`: Splits energy of an interval
+into clock hours.
+- `add_sample(date, forward_energy)`: Adds the interval since the previous
+reading to the counter.
+- `rebuild(since)`: Recomputes the counter from raw tuya_data rows.
+- `hourly_energy(start, end)`: Returns consumption in each hour.
+- `daily_energy(start, end)`: Returns consumption in each day.
+- `total_energy(start, end)`: Returns consumption in the range.
+"""
+
+from datetime import datetime
+from sqlalchemy import text
+from data_access import engine, epoch, from_epoch, to_db_datetime
+
+
+HOUR = 3600
+
+
+def create_counter_tables():
+    """
+    Creates the heater_energy_hourly table and the heater_energy_state
+    table holding the last counted reading.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS heater_energy_hourly ("
+                "hour INTEGER PRIMARY KEY, "
+                "energy REAL NOT NULL)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS heater_energy_state ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "last_time REAL NOT NULL, "
+                "last_energy REAL NOT NULL)"
+            )
+        )
+
+
+def split_interval(start, end, energy):
+    """
+    Splits energy used between two readings into clock hours,
+    proportionally to the part of the interval in each hour.
+
+    Parameters:
+        start (float): Time of the previous reading, seconds since epoch.
+        end (float): Time of the current reading, seconds since epoch.
+        energy (float): Energy used in the interval in kWh.
+
+    Returns:
+        list: A list of (hour (int), energy (float)) tuples.
+
+    Example:
+        >>> split_interval(3000, 4200, 1.2)
+        [(0, 0.6), (3600, 0.6)]
+    """
+    if end <= start:
+        return [(int(end // HOUR * HOUR), energy)]
+
+    parts = []
+    hour = int(start // HOUR * HOUR)
+    while hour < end:
+        overlap = min(end, hour + HOUR) - max(start, hour)
+        parts.append((hour, energy * overlap / (end - start)))
+        hour += HOUR
+
+    return parts
+
+
+def _add_parts(connection, parts):
+    """
+    Adds energy parts to the hourly counter.
+
+    Parameters:
+        connection (Connection): An open connection in a transaction.
+        parts (list): A list of (hour, energy) tuples.
+
+    Returns:
+        None
+    """
+    if not parts:
+        return
+    connection.execute(
+        text(
+            "INSERT INTO heater_energy_hourly (hour, energy) "
+            "VALUES (:hour, :energy) "
+            "ON CONFLICT (hour) DO UPDATE SET energy = energy + excluded.energy"
+        ),
+        [{"hour": hour, "energy": energy} for hour, energy in parts],
+    )
+
+
+def add_sample(date, forward_energy):
+    """
+    Adds energy used since the previous reading to the hourly counter
+    and remembers the reading. A decreasing counter (e.g. after
+    the meter was reset) counts as no usage.
+
+    Parameters:
+        date (datetime): The time of the reading.
+        forward_energy (float): The forward_energy counter value in kWh.
+
+    Returns:
+        None
+    """
+    now = epoch(date)
+
+    with engine.begin() as connection:
+        previous = connection.execute(
+            text("SELECT last_time, last_energy FROM heater_energy_state")
+        ).first()
+
+        if previous is not None and now > previous[0]:
+            energy = max(forward_energy - previous[1], 0.0)
+            _add_parts(connection, split_interval(previous[0], now, energy))
+        elif previous is not None:
+            # Older than the last counted reading, already counted
+            return
+
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO heater_energy_state "
+                "(id, last_time, last_energy) VALUES (1, :time, :energy)"
+            ),
+            {"time": now, "energy": forward_energy},
+        )
+
+
+def rebuild(since=None):
+    """
+    Recomputes the hourly counter from raw tuya_data rows, starting with
+    the hour of 'since'. Intervals inside one hour are
+    summed in SQLite, only intervals crossing an hour boundary are split
+    in Python.
+
+    Parameters:
+        since (datetime): Optional start of the recomputed range,
+        the whole history is recomputed if it is None.
+
+    Returns:
+        None
+    """
+    create_counter_tables()
+    since = since or datetime(1970, 1, 1)
+
+    with engine.begin() as connection:
+        # The whole first hour is recomputed, including the reading
+        # before it, which starts its first interval
+        start = epoch(since) // HOUR * HOUR
+        hour_start = since.replace(minute=0, second=0, microsecond=0)
+        first = connection.execute(
+            text("SELECT MAX(date) FROM tuya_data WHERE date < :start "
+                 "AND forward_energy IS NOT NULL"),
+            {"start": to_db_datetime(hour_start, "tuya_data")},
+        ).scalar() or to_db_datetime(hour_start, "tuya_data")
+        connection.execute(
+            text("DELETE FROM heater_energy_hourly WHERE hour >= :start"),
+            {"start": start},
+        )
+
+        intervals = (
+            "SELECT strftime('%s', date) + 0 AS end_time, "
+            "LAG(strftime('%s', date) + 0) OVER (ORDER BY date) "
+            "AS start_time, "
+            "MAX(forward_energy - LAG(forward_energy) "
+            "OVER (ORDER BY date), 0) AS energy "
+            "FROM tuya_data WHERE date >= :first "
+            "AND forward_energy IS NOT NULL"
+        )
+        params = {"first": first}
+
+        inside = connection.execute(
+            text(
+                f"SELECT CAST(end_time AS INTEGER) / {HOUR} * {HOUR}, "
+                f"SUM(energy) FROM ({intervals}) "
+                f"WHERE CAST(start_time AS INTEGER) / {HOUR} "
+                f"= CAST(end_time AS INTEGER) / {HOUR} "
+                f"GROUP BY 1"
+            ),
+            params,
+        ).all()
+        _add_parts(connection, [(hour, energy) for hour, energy in inside
+                                if hour >= start])
+
+        crossing = connection.execute(
+            text(
+                f"SELECT start_time, end_time, energy FROM ({intervals}) "
+                f"WHERE CAST(start_time AS INTEGER) / {HOUR} "
+                f"!= CAST(end_time AS INTEGER) / {HOUR}"
+            ),
+            params,
+        )
+        for start_time, end_time, energy in crossing:
+            _add_parts(
+                connection,
+                [(hour, part) for hour, part
+                 in split_interval(start_time, end_time, energy)
+                 if hour >= start],
+            )
+
+        last = connection.execute(
+            text(
+                "SELECT strftime('%s', date) + 0, forward_energy "
+                "FROM tuya_data WHERE forward_energy IS NOT NULL "
+                "ORDER BY date DESC LIMIT 1"
+            )
+        ).first()
+        if last is not None:
+            connection.execute(
+                text(
+                    "INSERT OR REPLACE INTO heater_energy_state "
+                    "(id, last_time, last_energy) VALUES (1, :time, :energy)"
+                ),
+                {"time": last[0], "energy": last[1]},
+            )
+
+
+def is_built():
+    """
+    Checks if the counter has been built, i.e. if it knows the last
+    counted reading.
+
+    Returns:
+        bool: True if the counter state exists, False otherwise.
+    """
+    create_counter_tables()
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT COUNT(*) FROM heater_energy_state")
+        ).scalar() > 0
+
+
+def hourly_energy(start, end):
+    """
+    Returns heater consumption in each hour of the range.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        list: A list of (hour start (datetime), energy (float)) tuples.
+    """
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT hour, energy FROM heater_energy_hourly "
+                "WHERE hour >= :start AND hour < :end ORDER BY hour"
+            ),
+            {"start": epoch(start), "end": epoch(end)},
+        ).all()
+
+    return [(from_epoch(hour), energy) for hour, energy in rows]
+
+
+def daily_energy(start, end):
+    """
+    Returns heater consumption in each day of the range.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        list: A list of (day (date), energy (float)) tuples.
+    """
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT hour / 86400 * 86400 AS day, SUM(energy) "
+                "FROM heater_energy_hourly "
+                "WHERE hour >= :start AND hour < :end "
+                "GROUP BY day ORDER BY day"
+            ),
+            {"start": epoch(start), "end": epoch(end)},
+        ).all()
+
+    return [(from_epoch(day).date(), energy) for day, energy in rows]
+
+
+def total_energy(start, end):
+    """
+    Returns heater consumption in the range.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        float: Energy in kWh.
+    """
+    with engine.connect() as connection:
+        return connection.execute(
+            text(
+                "SELECT COALESCE(SUM(energy), 0) FROM heater_energy_hourly "
+                "WHERE hour >= :start AND hour < :end"
+            ),
+            {"start": epoch(start), "end": epoch(end)},
+        ).scalar()
@@ -1,34 +1,58 @@
-"""This program checks if required processes are running, starts them
-and sends a message via Telegram if not. It also can stop running Python
-process with the given name. The program uses the following functions:
+"""This program runs the required processes as children of
+a `supervisor.Supervisor`, restarts them with backoff when they exit and
+sends a message via Telegram when they start or exit. It also can stop
+running Python process with the given name. The program uses the following
+functions:
 
 - `ngrok_running()`: Checks if the ngrok process is running. Returns True
 if the ngrok process is running, False otherwise.
+- `check_ngrok()`: Sends a message via Telegram if ngrok isn't running.
+- `is_connected()`: Returns the connectivity state kept by
+`network_health.NetworkMonitor`, which probes the internet and the data
+sources in a background thread and records outages.
+- `check_wifi_connection()`: Reconnects to the wifi network when offline.
+- `collect_telemetry()`: Stores CPU, memory, disk write, database size and
+temperature metrics of the host and the services (see `telemetry.py`).
 - `check_running_python_processes()`: Returns a list of the names of all
 running Python processes.
-- `check_and_run_processes()`: Checks if required processes are running.
-Starts them and sends a message via Telegram if not.
 - `stop_process(process)`: Stops a running Python process with the given name.
-
-The program uses the `schedule` library to schedule the
-`check_and_run_processes()` function to run every 5 seconds,
-the `stop_process("app.py")` function to run every day at 00:05,
-and the `backup.make_database_backup()` function to run every Monday at 00:00.
-The program runs continuously using a `while` loop and
-the `schedule.run_pending()` function to execute the scheduled tasks."""
-
-
+It is used on start to stop services left running by a previous instance,
+so that all services are owned by the supervisor.
+
+With UNIFIED_RUNTIME=1 in the environment only `unified_runtime.py`, which
+runs all services in one process, is supervised.
+
+The program uses the `schedule` library to schedule the `check_ngrok()`
+and `check_wifi_connection()` functions to run every 5 minutes,
+`collect_telemetry()` every minute with
+hourly aggregation, `build_comparison_reports()` every night at 01:30
+and the `backup.make_database_backup()` function to run every Monday
+at 00:00.
+The Dash app serves its layout dynamically, so it is no longer restarted
+every night.
+The program runs continuously using a `while` loop, which calls
+`supervisor.poll()` and `schedule.run_pending()` every second, until
+it receives SIGTERM and stops the services gracefully."""
+
+
+import startup_profiler
 import schedule
 import psutil
 import message_sender as telegram
 import backup
+import comparison_reports
+import telemetry
+import network_health
 from datetime import datetime
 import time
 import subprocess
 import os
 import signal
+import sys
 from dotenv import load_dotenv
+from supervisor import Supervisor
 
+startup_profiler.mark("imports")
 
 load_dotenv()
 
@@ -39,14 +63,22 @@ HOTSPOT_PSWRD = os.getenv("HOTSPOT_PSWRD")
 
 network = (NETWORK_NAME, NETWORK_PSWRD)
 
+# All services can run in one process, see unified_runtime.py
+if os.getenv("UNIFIED_RUNTIME") == "1":
+    REQUIRED_PROCESSES = ["unified_runtime.py"]
+else:
+    REQUIRED_PROCESSES = ["app.py", "datafetcher.py", "scraping_scheduler.py"]
+
 
 def is_connected():
-    try:
-        subprocess.run(["ping", "-c", "1", "8.8.8.8"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        pass
-    return False
+    """
+    Returns the cached connectivity state of the network monitor,
+    without probing.
+
+    Returns:
+    bool: False if no source responded to the last check.
+    """
+    return network_monitor.is_online()
 
 # version for Ubuntu
 def connect_to_wifi(network):
@@ -62,6 +94,12 @@ def connect_to_wifi(network):
 
 
 def check_wifi_connection():
+    """
+    Reconnects to the wifi network if the host is offline.
+
+    Returns:
+        None
+    """
     if not is_connected():
         connect_to_wifi(network)
 
@@ -115,34 +153,62 @@ def check_running_python_processes():
     return python_processes
 
 
-def check_and_run_processes():
+def check_ngrok():
     """
-    Checks if required processes are running. Starts them and send message
-    via Telegram if not.
+    Sends a message via Telegram if ngrok isn't running.
 
     Returns:
         None
     """
-    required_processes = ["app.py", "datafetcher.py", "scraping_scheduler.py"]
-    running_processes = check_running_python_processes()
-    now = datetime.now().replace(microsecond=0)
-
-    for process in required_processes:
-        if not process in running_processes:
-            try:
-                subprocess.Popen(["python", process])
-                print(f"{now} {process} has been started.")
-                telegram.send_message(f"{now} {process} has been started.")
-            except Exception as e:
-                print(f"{now} Error starting {process}: {str(e)}")
-                telegram.send_message(
-                    f"{now} Error starting {process}: {str(e)}")
-
     if not ngrok_running():
+        now = datetime.now().replace(microsecond=0)
         print(f"{now} Error, Ngrok isn't running")
         telegram.send_message(f"{now} Error, Ngrok isn't running")
 
 
+def collect_telemetry():
+    """
+    Stores a telemetry sample of the host and the supervised services.
+
+    Returns:
+        None
+    """
+    try:
+        telemetry_collector.collect()
+    except Exception as e:
+        print(f"{datetime.now().replace(microsecond=0)} "
+              f"Error collecting telemetry: {e}")
+
+
+def refresh_telemetry():
+    """
+    Aggregates telemetry samples into hourly rows and removes old rows.
+
+    Returns:
+        None
+    """
+    try:
+        telemetry.refresh_hourly()
+    except Exception as e:
+        print(f"{datetime.now().replace(microsecond=0)} "
+              f"Error refreshing telemetry: {e}")
+
+
+def build_comparison_reports():
+    """
+    Rebuilds the year-over-year and month-over-month comparison tables
+    read by the dashboard's compare mode.
+
+    Returns:
+        None
+    """
+    try:
+        comparison_reports.build()
+    except Exception as e:
+        print(f"{datetime.now().replace(microsecond=0)} "
+              f"Error building comparison reports: {e}")
+
+
 def stop_process(process):
     """
     Stop a running Python process with the given name.
@@ -174,13 +240,33 @@ def stop_process(process):
         print(f"{process} is not running.")
 
 
-schedule.every(5).seconds.do(check_and_run_processes)
-schedule.every(5).minutes.do(check_wifi_connection())
-schedule.every().day.at("00:05").do(stop_process, "app.py")
+supervisor = Supervisor(
+    {process: [sys.executable, process] for process in REQUIRED_PROCESSES},
+    notify=telegram.send_message,
+)
+telemetry.create_telemetry_tables()
+telemetry_collector = telemetry.TelemetryCollector(
+    lambda: {**supervisor.pids(), "house_energy.py": os.getpid()})
+network_monitor = network_health.monitor(
+    record=True, notify=telegram.send_message)
+
+schedule.every(5).minutes.do(check_ngrok)
+schedule.every(1).minutes.do(collect_telemetry)
+schedule.every(1).hours.do(refresh_telemetry)
+schedule.every(5).minutes.do(check_wifi_connection)
 schedule.every().monday.at("00:00").do(backup.make_database_backup)
-schedule.run_all()
+schedule.every().day.at("01:30").do(build_comparison_reports)
+startup_profiler.mark("init")
 
 if __name__ == "__main__":
-    while True:
+    startup_profiler.report("house_energy.py")
+    # Services started by a previous instance can't be supervised
+    for process in REQUIRED_PROCESSES:
+        stop_process(process)
+    supervisor.install_signal_handlers()
+    schedule.run_all()
+    while not supervisor.stopping:
+        supervisor.poll()
         schedule.run_pending()
         time.sleep(1)
+    supervisor.shutdown()
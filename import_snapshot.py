@@ -0,0 +1,354 @@
+"""
+Import and merge of database snapshots.
+
+A snapshot (e.g. backup/electricity20230719.db made by backup.py, or the
+database of a second house) is ATTACHed to the live database and every
+raw table is merged by its date column in set-based SQL, in chunks of
+CHUNK_ROWS snapshot rows, each chunk in its own short transaction so the
+data fetcher can keep writing:
+
+- rows with a date missing in the live table are inserted (a date
+  repeated in the snapshot is inserted once),
+- rows with a date already in the live table follow the conflict rule:
+  'skip' keeps the live row, 'replace' overwrites its values with the
+  snapshot's, 'fill' only fills the live row's NULL values.
+
+Columns are matched by name, so snapshots of older versions with fewer
+columns can be merged. Tables missing in the live database (e.g. a fresh
+one) are created from the snapshot's columns. Derived columns (the daily deltas of
+my_power_meter) aren't copied, they are recomputed.
+
+After the merge, derived data is recomputed only from the first changed
+day of every table: the daily meter deltas (scraper.recompute_daily), the
+heater's hourly counter (energy_counter), the rollups of the table's
+series (rollups), the energy balance and bills (energy_balance, tariff),
+the rooms' thermal model (thermal_model), the PV forecast model
+(pv_forecast) and the comparison reports (comparison_reports).
+
+With --prefix the snapshot is merged into separate tables named with the
+prefix (e.g. house2_solax_data), which are created when missing; derived
+data isn't recomputed then, because it is only kept for this house.
+
+Usage:
+    python import_snapshot.py SNAPSHOT [--rule skip|replace|fill]
+        [--tables TABLE ...] [--since DATE] [--until DATE] [--prefix PREFIX]
+
+The module provides the following:
+
+- `merge_table(connection, table, rule, ...)`: Merges one table.
+- `recompute(affected)`: Recomputes derived data of the changed ranges.
+- `import_snapshot(path, rule, ...)`: Merges a snapshot and recomputes.
+"""
+
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from data_access import TABLES, SERIES, engine, ensure_indexes
+
+CHUNK_ROWS = 100000
+RULES = ("skip", "replace", "fill")
+# Columns computed from other rows, recomputed instead of merged
+DERIVED = {"my_power_meter": ["taken_daily", "given_daily"]}
+
+
+def _columns(connection, schema, table):
+    return [row[1] for row in connection.execute(
+        text(f"PRAGMA {schema}.table_info({table})")).all()]
+
+
+def _prepare(connection, table, target):
+    """
+    Creates the target table from the snapshot's columns, with an index on
+    the date, if it is missing (a prefixed import or a fresh database) and
+    returns the merged columns.
+    """
+    if target not in {row[0] for row in connection.execute(text(
+            "SELECT name FROM main.sqlite_master WHERE type = 'table'"))}:
+        # The snapshot's own statement keeps the id primary key
+        schema = connection.execute(text(
+            "SELECT sql FROM snapshot.sqlite_master "
+            "WHERE type = 'table' AND name = :table"), {"table": table}
+        ).scalar()
+        connection.exec_driver_sql(re.sub(
+            r"^CREATE TABLE\s+\S+", f"CREATE TABLE main.{target}", schema))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS main.ix_{target}_date "
+            f"ON {target} (date)"))
+    live = _columns(connection, "main", target)
+    columns = [column for column in _columns(connection, "snapshot", table)
+               if column in live and column not in ("id", "date")
+               and column not in DERIVED.get(table, [])]
+
+    return columns
+
+
+def merge_table(connection, table, rule="skip", since=None, until=None,
+                target=None, progress=print):
+    """
+    Merges one table of the attached snapshot into the live table.
+
+    Parameters:
+        connection: Connection with the snapshot attached as 'snapshot'.
+        table (str): The name of the table, a key of data_access.TABLES.
+        rule (str): 'skip', 'replace' or 'fill' for dates in both tables.
+        since (str): Optional first date merged, as stored in the table.
+        until (str): Optional date after the last one merged.
+        target (str): The live table, the same as 'table' by default.
+        progress: Function called with a progress line (str).
+
+    Returns:
+        dict: 'scanned', 'inserted' and 'updated' row counts and 'first'
+        and 'last' dates of the changed rows (None without changes).
+    """
+    target = target or table
+    columns = _prepare(connection, table, target)
+    connection.commit()
+    names = ", ".join(["date"] + columns)
+    selected = ", ".join(f"s.{column}" for column in ["date"] + columns)
+    bounds = ""
+    if since is not None:
+        bounds += " AND s.date >= :since"
+    if until is not None:
+        bounds += " AND s.date < :until"
+    if rule == "replace":
+        differs = " OR ".join(f"m.{c} IS NOT s.{c}" for c in columns)
+        assignments = ", ".join(f"{c} = s.{c}" for c in columns)
+    else:
+        differs = " OR ".join(
+            f"(m.{c} IS NULL AND s.{c} IS NOT NULL)" for c in columns)
+        assignments = ", ".join(f"{c} = COALESCE(m.{c}, s.{c})"
+                                for c in columns)
+
+    connection.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS import_rows ("
+        "source INTEGER PRIMARY KEY, date TEXT)"))
+    connection.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS import_updates ("
+        "target INTEGER PRIMARY KEY, source INTEGER, date TEXT)"))
+    low, high, total = connection.execute(text(
+        f"SELECT MIN(rowid), MAX(rowid), COUNT(*) FROM snapshot.{table}"
+    )).one()
+    result = {"scanned": 0, "inserted": 0, "updated": 0,
+              "first": None, "last": None}
+    started = time.perf_counter()
+
+    for start in range(low or 0, (high or -1) + 1, CHUNK_ROWS):
+        params = {"start": start, "end": start + CHUNK_ROWS,
+                  "since": since, "until": until}
+        chunk = f"s.rowid >= :start AND s.rowid < :end{bounds}"
+        connection.execute(text("DELETE FROM temp.import_rows"))
+        connection.execute(text("DELETE FROM temp.import_updates"))
+        # Dates missing in the live table, the last snapshot row of each
+        connection.execute(text(
+            f"INSERT INTO temp.import_rows (source, date) "
+            f"SELECT MAX(s.rowid), s.date FROM snapshot.{table} s "
+            f"WHERE {chunk} AND s.date IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM main.{target} m WHERE m.date = s.date) "
+            f"GROUP BY s.date"), params)
+        inserted = connection.execute(text(
+            f"INSERT INTO main.{target} ({names}) "
+            f"SELECT {selected} FROM temp.import_rows r "
+            f"JOIN snapshot.{table} s ON s.rowid = r.source"
+        )).rowcount
+        updated = 0
+        if rule != "skip" and columns:
+            connection.execute(text(
+                f"INSERT OR REPLACE INTO temp.import_updates "
+                f"(target, source, date) "
+                f"SELECT m.rowid, MAX(s.rowid), s.date "
+                f"FROM snapshot.{table} s "
+                f"JOIN main.{target} m ON m.date = s.date "
+                f"WHERE {chunk} AND ({differs}) GROUP BY m.rowid"), params)
+            updated = connection.execute(text(
+                f"UPDATE main.{target} AS m SET {assignments} "
+                f"FROM temp.import_updates u "
+                f"JOIN snapshot.{table} s ON s.rowid = u.source "
+                f"WHERE m.rowid = u.target")).rowcount
+        first, last = connection.execute(text(
+            "SELECT MIN(date), MAX(date) FROM (SELECT date FROM "
+            "temp.import_rows UNION ALL SELECT date FROM temp.import_updates)"
+        )).one()
+        connection.commit()
+
+        scanned = connection.execute(text(
+            f"SELECT COUNT(*) FROM snapshot.{table} s WHERE "
+            f"s.rowid >= :start AND s.rowid < :end"), params).scalar()
+        result["scanned"] += scanned
+        result["inserted"] += inserted
+        result["updated"] += updated
+        if first is not None:
+            result["first"] = min(filter(None, (result["first"], first)))
+            result["last"] = max(filter(None, (result["last"], last)))
+        elapsed = time.perf_counter() - started
+        progress(
+            f"{table}: {result['scanned']}/{total} rows "
+            f"({result['scanned'] / total:.0%}), "
+            f"{result['inserted']} inserted, {result['updated']} updated, "
+            f"{result['scanned'] / elapsed:,.0f} rows/s")
+
+    return result
+
+
+def _day(value):
+    return datetime.strptime(value[:10], "%Y-%m-%d")
+
+
+def recompute(affected, progress=print):
+    """
+    Recomputes derived data from the first changed day of every table.
+
+    Parameters:
+        affected (dict): Table: first changed date (str, as stored).
+        progress: Function called with a progress line (str).
+
+    Returns:
+        None
+    """
+    # Imported here, the merge itself doesn't need pandas
+    import comparison_reports
+    import energy_balance
+    import energy_counter
+    import pv_forecast
+    import rollups
+    import scraper
+    import tariff
+    import thermal_model
+
+    if not affected:
+        return
+    steps = []
+    if "my_power_meter" in affected:
+        # The reading before the first new one gets a new daily delta
+        with engine.connect() as connection:
+            anchor = connection.execute(
+                text("SELECT MAX(date) FROM my_power_meter "
+                     "WHERE date < :first"),
+                {"first": affected["my_power_meter"]},
+            ).scalar()
+        meter_first = _day(anchor or affected["my_power_meter"])
+        affected["my_power_meter"] = meter_first.strftime("%Y-%m-%d")
+        steps.append(("daily meter deltas",
+                      lambda: scraper.recompute_daily(meter_first.date())))
+    if "tuya_data" in affected:
+        steps.append(("heater counter", lambda: energy_counter.rebuild(
+            _day(affected["tuya_data"]))))
+    for table, first in affected.items():
+        names = [name for name, (source, _, _) in SERIES.items()
+                 if source == table]
+        steps.append((f"rollups of {table}",
+                      lambda first=first, names=names:
+                      rollups.refresh_rollups(_day(first), names)))
+
+    since = min(_day(first) for first in affected.values())
+    if affected.keys() & {"solax_data", "tuya_data", "my_power_meter"}:
+        steps.append(("energy balance", lambda: energy_balance.refresh(since)))
+        steps.append(("bills", lambda: tariff.refresh(since)))
+        steps.append(("comparison reports", comparison_reports.build))
+    if affected.keys() & {"tuya_data", "weather_data"}:
+        rooms_first = min(_day(affected[table]) for table in
+                          affected.keys() & {"tuya_data", "weather_data"})
+        steps.append(("thermal model",
+                      lambda: thermal_model.refresh(rooms_first)))
+    if affected.keys() & {"solax_data", "weather_data"}:
+        steps.append(("PV forecast model",
+                      lambda: pv_forecast.train(full=True)))
+
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        progress(f"Recomputed {name} in "
+                 f"{time.perf_counter() - started:.1f} s")
+
+
+def import_snapshot(path, rule="skip", tables=None, since=None, until=None,
+                    prefix="", progress=print):
+    """
+    Merges the tables of a snapshot into the live database and recomputes
+    derived data of the changed ranges.
+
+    Parameters:
+        path (str): The path of the snapshot database.
+        rule (str): 'skip', 'replace' or 'fill' for dates in both tables.
+        tables (list): Tables to merge, all raw tables by default.
+        since (datetime): Optional first merged time.
+        until (datetime): Optional end of the merged range.
+        prefix (str): Merge into tables with this prefix, without
+        recomputing derived data.
+        progress: Function called with a progress line (str).
+
+    Returns:
+        dict: Table: the result of merge_table.
+
+    Raises:
+        FileNotFoundError: If the snapshot doesn't exist.
+        ValueError: If the rule or a table is unknown.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if rule not in RULES:
+        raise ValueError(f"Unknown rule: {rule}")
+    tables = tables or list(TABLES)
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+
+    ensure_indexes()
+    results = {}
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ? AS snapshot", (path,))
+        try:
+            present = {row[0] for row in connection.execute(text(
+                "SELECT name FROM snapshot.sqlite_master "
+                "WHERE type = 'table'"))}
+            for table in tables:
+                if table not in present:
+                    progress(f"{table}: not in the snapshot, skipped")
+                    continue
+                results[table] = merge_table(
+                    connection, table, rule,
+                    since.strftime(TABLES[table]) if since else None,
+                    until.strftime(TABLES[table]) if until else None,
+                    prefix + table, progress)
+        finally:
+            connection.rollback()
+            connection.exec_driver_sql("DETACH DATABASE snapshot")
+
+    scanned = sum(result["scanned"] for result in results.values())
+    elapsed = time.perf_counter() - started
+    progress(
+        f"Merged {scanned} rows in {elapsed:.1f} s "
+        f"({scanned / max(elapsed, 1e-9):,.0f} rows/s): "
+        f"{sum(result['inserted'] for result in results.values())} "
+        f"inserted, "
+        f"{sum(result['updated'] for result in results.values())} updated")
+
+    affected = {table: result["first"] for table, result in results.items()
+                if result["first"] is not None}
+    if affected and not prefix:
+        recompute(affected, progress)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("snapshot", help="path of the snapshot database")
+    parser.add_argument("--rule", choices=RULES, default="skip",
+                        help="rows with a date already stored: keep them, "
+                             "replace their values or fill their NULLs")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES))
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="first merged date, YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("--until", type=datetime.fromisoformat,
+                        help="last merged day, YYYY-MM-DD")
+    parser.add_argument("--prefix", default="",
+                        help="merge into separate tables, e.g. house2_")
+    args = parser.parse_args()
+
+    import_snapshot(
+        args.snapshot, args.rule, args.tables, args.since,
+        args.until + timedelta(days=1) if args.until else None, args.prefix)
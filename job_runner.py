@@ -0,0 +1,259 @@
+"""
+Asynchronous runner of scheduled jobs.
+
+Jobs are plain functions given as 'module:function' strings. They run in one
+reusable worker process, so a module (e.g. scraper.py with SQLAlchemy and
+requests) is imported once per worker instead of once per run, and the event
+loop stays responsive while a job is running. A job which exceeds its
+timeout is cancelled and the worker is replaced with a fresh one.
+
+In-process mode (used by unified_runtime.py) runs jobs in a worker thread
+instead, sharing modules and the database engine with the rest of the
+process. A timed out job can't be killed there: the runner stops waiting
+for it and continues with a new thread. Printed output isn't captured in
+this mode, because sys.stdout is shared by all threads.
+
+Every run returns a JobResult with the status, returned value, printed
+output and error, so callers don't have to parse the output. Next run
+times and last results are persisted in a JSON file by JobState, so
+a restarted scheduler continues where it stopped.
+
+The module provides the following:
+
+- `JobResult`: Result of one job run.
+- `JobRunner`: Runs jobs in a reusable worker process (or thread) with
+timeouts.
+- `JobState`: Persisted next run times and last results of jobs.
+"""
+
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+
+@dataclass
+class JobResult:
+    """
+    Result of one job run.
+
+    Attributes:
+        name (str): The name of the job.
+        status (str): 'success', 'failed' or 'timeout'.
+        started (datetime): Start of the run.
+        finished (datetime): End of the run.
+        value: The value returned by the job function.
+        output (str): Text printed by the job.
+        error (str): Traceback or description of the failure.
+    """
+
+    name: str
+    status: str
+    started: datetime
+    finished: datetime = field(default_factory=datetime.now)
+    value: object = None
+    output: str = ""
+    error: str = ""
+
+    @property
+    def ok(self):
+        return self.status == "success"
+
+    @property
+    def duration(self):
+        return (self.finished - self.started).total_seconds()
+
+    def to_dict(self):
+        result = asdict(self)
+        result["started"] = self.started.isoformat()
+        result["finished"] = self.finished.isoformat()
+        return result
+
+
+def call(target, args, kwargs, capture=True):
+    """
+    Imports and calls a job function in the worker. Printed text
+    and exceptions are captured, so they can be returned to the runner.
+
+    Parameters:
+        target (str): The function as 'module:function'.
+        args (tuple): Positional arguments of the function.
+        kwargs (dict): Keyword arguments of the function.
+        capture (bool): Capture printed text.
+
+    Returns:
+        tuple: Status ('success' or 'failed'), returned value, printed
+        output and the traceback.
+    """
+    module, function = target.split(":")
+    output = io.StringIO()
+    redirect = contextlib.redirect_stdout(output) if capture \
+        else contextlib.nullcontext()
+    try:
+        with redirect:
+            value = getattr(importlib.import_module(module), function)(
+                *args, **kwargs)
+        return "success", value, output.getvalue(), ""
+    except Exception:
+        return "failed", None, output.getvalue(), traceback.format_exc()
+
+
+class JobRunner:
+    """
+    Runs jobs one at a time in a reusable worker process (or thread).
+
+    Parameters:
+        workers (int): The number of workers.
+        in_process (bool): Run jobs in threads of this process.
+    """
+
+    def __init__(self, workers=1, in_process=False):
+        self.workers = workers
+        self.in_process = in_process
+        self.executor = None
+
+    def _executor(self):
+        if self.executor is None and self.in_process:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        elif self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def recycle(self):
+        """
+        Replaces the workers, e.g. after a job timed out: worker processes
+        are killed, worker threads are abandoned. A new worker is started
+        with the next job.
+
+        Returns:
+            None
+        """
+        if self.executor is None:
+            return
+        if self.in_process:
+            # Threads can't be killed, the timed out job is abandoned
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            return
+        # Running jobs can't be cancelled, so their workers are killed
+        processes = list((self.executor._processes or {}).values())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+        for process in processes:
+            process.join()
+        self.executor = None
+
+    async def run(self, name, target, *args, timeout=None, **kwargs):
+        """
+        Runs a job and waits for its result.
+
+        Parameters:
+            name (str): The name of the job, used in the result.
+            target (str): The job function as 'module:function'.
+            *args: Positional arguments of the function.
+            timeout (float): Optional time limit in seconds.
+            **kwargs: Keyword arguments of the function.
+
+        Returns:
+            JobResult: The result of the run.
+        """
+        loop = asyncio.get_running_loop()
+        started = datetime.now()
+        future = loop.run_in_executor(
+            self._executor(), call, target, args, kwargs, not self.in_process)
+
+        try:
+            status, value, output, error = await asyncio.wait_for(
+                future, timeout)
+        except asyncio.TimeoutError:
+            self.recycle()
+            return JobResult(name, "timeout", started,
+                             error=f"Timed out after {timeout} s")
+        except BrokenProcessPool as e:
+            self.recycle()
+            return JobResult(name, "failed", started,
+                             error=f"Worker died: {e}")
+
+        return JobResult(name, status, started, value=value, output=output,
+                         error=error)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class JobState:
+    """
+    Next run times and last results of jobs, persisted in a JSON file.
+
+    Parameters:
+        path (str): The path of the JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as file:
+                self.jobs = json.load(file)
+        except (OSError, ValueError):
+            self.jobs = {}
+
+    def next_run(self, name, default=None):
+        """
+        Returns the next run time of a job.
+
+        Parameters:
+            name (str): The name of the job.
+            default (datetime): Returned if the job has never run.
+
+        Returns:
+            datetime: The next run time.
+        """
+        next_run = self.jobs.get(name, {}).get("next_run")
+        return datetime.fromisoformat(next_run) if next_run else default
+
+    def last_result(self, name):
+        """
+        Returns the last result of a job as a dictionary.
+
+        Parameters:
+            name (str): The name of the job.
+
+        Returns:
+            dict or None: The last result, None if the job has never run.
+        """
+        return self.jobs.get(name, {}).get("last_result")
+
+    def update(self, name, next_run, result=None):
+        """
+        Stores the next run time and the last result of a job and writes
+        the file atomically.
+
+        Parameters:
+            name (str): The name of the job.
+            next_run (datetime): The next run time.
+            result (JobResult): Optional result of the last run.
+
+        Returns:
+            None
+        """
+        job = self.jobs.setdefault(name, {})
+        job["next_run"] = next_run.isoformat()
+        if result is not None:
+            job["last_result"] = result.to_dict()
+            job["failures"] = 0 if result.ok else job.get("failures", 0) + 1
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.jobs, file, indent=2, default=str)
+        os.replace(temporary, self.path)
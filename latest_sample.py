@@ -0,0 +1,197 @@
+"""
+Shared-memory channel with the latest reading of every series.
+
+datafetcher.py writes the newest values into a small memory-mapped file on
+every cycle and the dashboard reads them directly from the mapping, without
+a database query. The block has a fixed layout:
+
+- header: magic b"HELS", layout version (uint32), sequence counter (uint64)
+- one record per series in SLOTS: timestamp (float64, seconds since epoch)
+  and value (float64)
+
+Writes are guarded by the sequence counter (a seqlock): the writer makes it
+odd before changing records and even afterwards, and readers retry when the
+counter was odd or changed while they were reading. There is a single
+writer, so no locks are needed.
+
+The file is placed in /dev/shm when it exists, so it never touches the SD
+card. The path can be changed with the LATEST_SAMPLE_PATH environment
+variable.
+"""
+
+import math
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+
+
+SLOTS = [
+    "live_production",
+    "yield_today",
+    "forward_energy",
+    "bathroom_upper",
+    "bathroom_lower",
+    "first_bedroom",
+    "second_bedroom",
+    "third_bedroom",
+    "weather_temperature",
+    "weather_temperature_feels",
+]
+
+MAGIC = b"HELS"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+RECORD = struct.Struct("<dd")
+SIZE = HEADER.size + RECORD.size * len(SLOTS)
+OFFSETS = {
+    name: HEADER.size + RECORD.size * index for index, name in enumerate(SLOTS)
+}
+
+DEFAULT_PATH = "/dev/shm/house_energy_latest" if os.path.isdir("/dev/shm") \
+    else "latest_sample.bin"
+
+
+def get_path():
+    """
+    Returns the path of the shared file.
+
+    Returns:
+        str: LATEST_SAMPLE_PATH environment variable or the default path.
+    """
+    return os.getenv("LATEST_SAMPLE_PATH", DEFAULT_PATH)
+
+
+class LatestSampleWriter:
+    """
+    Writes the latest values of series to the shared block.
+    Only one writer (datafetcher.py) should exist at a time.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_path()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+                self.map = mmap.mmap(fd, SIZE)
+                self._initialize()
+            else:
+                self.map = mmap.mmap(fd, SIZE)
+                if HEADER.unpack_from(self.map)[:2] != (MAGIC, VERSION):
+                    self._initialize()
+        finally:
+            os.close(fd)
+        self.sequence = HEADER.unpack_from(self.map)[2] & ~1
+
+    def _initialize(self):
+        """
+        Writes the header and marks every record as empty.
+        """
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, 0)
+        for offset in OFFSETS.values():
+            RECORD.pack_into(self.map, offset, 0.0, math.nan)
+
+    def write(self, values, timestamp=None):
+        """
+        Updates the records of the given series. Records of other series
+        keep their previous values.
+
+        Parameters:
+            values (dict): Series name: value. Unknown names are ignored.
+            timestamp (datetime): Time of the reading, now if None.
+
+        Returns:
+            None
+        """
+        timestamp = (timestamp or datetime.now()).timestamp()
+
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        for name, value in values.items():
+            if name in OFFSETS and value is not None:
+                RECORD.pack_into(
+                    self.map, OFFSETS[name], timestamp, float(value))
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        self.map.close()
+
+
+class LatestSampleReader:
+    """
+    Reads the latest values from the shared block. The file is opened
+    on the first read, so the reader can be created before the writer.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_path()
+        self.map = None
+
+    def _open(self):
+        """
+        Maps the shared file read-only if it exists and is complete.
+
+        Returns:
+            bool: True if the file is mapped, False otherwise.
+        """
+        if self.map is not None:
+            return True
+        try:
+            with open(self.path, "rb") as file:
+                if os.fstat(file.fileno()).st_size != SIZE:
+                    return False
+                self.map = mmap.mmap(
+                    file.fileno(), SIZE, access=mmap.ACCESS_READ)
+        except OSError:
+            return False
+        if HEADER.unpack_from(self.map)[:2] != (MAGIC, VERSION):
+            self.map.close()
+            self.map = None
+            return False
+
+        return True
+
+    def read(self, name, retries=100):
+        """
+        Reads the latest value of one series.
+
+        Parameters:
+            name (str): The name of the series, one of SLOTS.
+            retries (int): How many times to retry a read which overlapped
+            with a write.
+
+        Returns:
+            tuple or None: Time of the reading (datetime) and the value
+            (float), None if the channel or the value isn't available.
+        """
+        if name not in OFFSETS or not self._open():
+            return None
+
+        for _ in range(retries):
+            before = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            timestamp, value = RECORD.unpack_from(self.map, OFFSETS[name])
+            if SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] == before:
+                if timestamp == 0.0 or math.isnan(value):
+                    return None
+                return datetime.fromtimestamp(timestamp), value
+
+        return None
+
+    def sequence(self):
+        """
+        Returns the sequence counter, which grows with every write.
+
+        Returns:
+            int or None: The counter, None if the channel isn't available.
+        """
+        if not self._open():
+            return None
+        return SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
@@ -1,23 +1,284 @@
 """
 Program for sending messages via Telegram.
+
+`send_message()` doesn't wait for Telegram: it puts the message in
+a bounded queue and returns. A background thread sends queued messages
+with one bot (and one HTTP connection pool) kept for the whole process:
+
+- Messages which arrive while the sender waits are batched into one
+  Telegram message (up to MAX_LENGTH characters).
+- At most one message is sent every MIN_INTERVAL seconds, which keeps
+  the bot under Telegram's limits. Telegram's RetryAfter is respected.
+- The same alert repeated within DEDUP_WINDOW seconds is sent once;
+  timestamps are ignored when messages are compared. The next copy
+  sent after the window says how many were suppressed.
+- When the queue is full (QUEUE_SIZE messages) new messages are dropped
+  and counted.
+
+Queued messages are flushed when the interpreter exits. The services
+are stopped by the supervisor with SIGTERM, so their entry points call
+`install_sigterm_flush()`: SIGTERM then raises SystemExit and the process
+exits normally instead of being killed. Importing the module doesn't
+change signal handling.
+
+The module provides the following:
+
+- `send_message(text)`: Queues a message without blocking.
+- `send_message_async(text)`: The same for coroutines.
+- `flush(timeout)`: Waits until queued messages are sent.
+- `notify(text, callback)`: Prints a message and passes it to a callback.
+- `install_sigterm_flush()`: Makes SIGTERM exit the process normally,
+so queued messages are flushed.
+- `NotificationQueue`: The queue and its sender thread.
 """
 
-import telegram
 import asyncio
+import atexit
 import os
+import queue
+import re
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from datetime import datetime
 
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+QUEUE_SIZE = 100
+MIN_INTERVAL = 3
+DEDUP_WINDOW = 600
+MAX_LENGTH = 4096
+RETRIES = 3
+FLUSH_TIMEOUT = 10
+
+TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?")
+
+
+def message_key(text):
+    """
+    Returns the text of a message without timestamps and extra whitespace,
+    used to recognize repeated alerts.
+
+    Parameters:
+    text (str): The message.
+
+    Returns:
+    str: The key of the message.
+    """
+    return " ".join(TIMESTAMP.sub("", text).split())
+
+
+class NotificationQueue:
+    """
+    Bounded queue of messages sent by a background thread.
+
+    Parameters:
+    send: Coroutine function sending one text, None for the Telegram bot.
+    size (int): The maximum number of queued messages.
+    min_interval (float): Seconds between two sent messages.
+    dedup_window (float): Seconds in which repeated messages are dropped.
+    """
+
+    def __init__(self, send=None, size=QUEUE_SIZE, min_interval=MIN_INTERVAL,
+                 dedup_window=DEDUP_WINDOW):
+        self.send = send
+        self.queue = queue.Queue(maxsize=size)
+        self.min_interval = min_interval
+        self.dedup_window = dedup_window
+        # Message key: [time the message was queued, suppressed copies]
+        self.recent = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.bot = None
+        # A message taken from the queue which didn't fit in a batch
+        self.carry = None
+
+    def put(self, text):
+        """
+        Queues a message unless the same alert was queued within
+        the dedup window.
+
+        Parameters:
+        text (str): The message.
+
+        Returns:
+        bool: True if the message was queued.
+        """
+        key = message_key(text)
+        now = time.monotonic()
+        with self.lock:
+            for old in [old for old, (queued, _) in self.recent.items()
+                        if now - queued >= self.dedup_window]:
+                suppressed = self.recent[old][1]
+                del self.recent[old]
+                if old == key and suppressed:
+                    text = f"{text} (repeated {suppressed} more times " \
+                           f"in {timedelta(seconds=self.dedup_window)})"
+            if key in self.recent:
+                self.recent[key][1] += 1
+                return False
+            try:
+                self.queue.put_nowait(text)
+            except queue.Full:
+                # Not remembered, so a later copy isn't suppressed
+                self.dropped += 1
+                dropped = self.dropped
+            else:
+                self.recent[key] = [now, 0]
+                dropped = None
+
+        if dropped is not None:
+            print(f"{datetime.now().replace(microsecond=0)} Telegram queue "
+                  f"is full, {dropped} messages dropped")
+            return False
+
+        self._start()
+        return True
+
+    def _start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self._run, name="telegram-sender", daemon=True)
+            self.thread.start()
+
+    def _batch(self, first):
+        """
+        Joins the first message with the other queued messages, as long as
+        they fit in one Telegram message.
+
+        Parameters:
+        first (str): The first message.
+
+        Returns:
+        tuple: The text of the batch and the number of messages in it.
+        """
+        texts = [first]
+        length = len(first)
+        while True:
+            try:
+                text = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if length + 1 + len(text) > MAX_LENGTH:
+                # Starts the next batch
+                self.carry = text
+                break
+            texts.append(text)
+            length += 1 + len(text)
+
+        return "\n".join(texts)[:MAX_LENGTH], len(texts)
+
+    async def _send(self, text):
+        if self.send is not None:
+            await self.send(text)
+            return
+        if self.bot is None:
+            # Imported here, python-telegram-bot is slow to import
+            import telegram
+
+            bot = telegram.Bot(token=TOKEN)
+            await bot.initialize()
+            self.bot = bot
+        await self.bot.send_message(chat_id=CHAT_ID, text=text)
+
+    def _deliver(self, loop, text):
+        """
+        Sends one batch, retrying after network errors and waiting
+        as long as Telegram asks after RetryAfter.
+
+        Parameters:
+        loop (asyncio.AbstractEventLoop): The loop of the sender thread.
+        text (str): The text to send.
+
+        Returns:
+        None
+        """
+        for attempt in range(RETRIES):
+            try:
+                loop.run_until_complete(self._send(text))
+                return
+            except Exception as e:
+                delay = getattr(e, "retry_after", None)
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                if attempt + 1 == RETRIES:
+                    print(f"{datetime.now().replace(microsecond=0)} "
+                          f"Error while sending telegram message: {e}")
+                    return
+                time.sleep(delay or self.min_interval * 2 ** attempt)
+
+    def _run(self):
+        # One loop for the whole thread, so the bot keeps its connections
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                if self.carry is not None:
+                    first, self.carry = self.carry, None
+                else:
+                    try:
+                        first = self.queue.get(timeout=60)
+                    except queue.Empty:
+                        continue
+                text, count = self._batch(first)
+                self._deliver(loop, text)
+                for _ in range(count):
+                    self.queue.task_done()
+                time.sleep(self.min_interval)
+        finally:
+            loop.close()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Waits until all queued messages are sent.
+
+        Parameters:
+        timeout (float): The longest wait in seconds.
+
+        Returns:
+        bool: True if the queue is empty.
+        """
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            if self.thread is None or not self.thread.is_alive():
+                break
+            time.sleep(0.1)
+
+        return not self.queue.unfinished_tasks
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def install_sigterm_flush():
+    """
+    Makes SIGTERM raise SystemExit, so atexit handlers (the flush of
+    queued messages) run. A handler already installed by the process
+    is kept, and handlers can only be installed in the main thread.
+
+    Returns:
+    bool: True if the handler was installed.
+    """
+    if threading.current_thread() is not threading.main_thread() \
+            or signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+        return False
+    signal.signal(signal.SIGTERM, _raise_exit)
+    return True
+
+
+notifications = NotificationQueue()
+atexit.register(lambda: notifications.flush())
+
 
 async def send_message_async(text):
     """
-    Sends a message asynchronously to the specified chat ID
-    using the Telegram bot API.
+    Queues a message from a coroutine. Queuing never blocks,
+    so the event loop isn't held up by Telegram.
 
     Parameters:
     text (str): The message to be sent.
@@ -25,14 +286,12 @@ async def send_message_async(text):
     Returns:
     None
     """
-    bot = telegram.Bot(token=TOKEN)
-    await bot.send_message(chat_id=CHAT_ID, text=text)
+    notifications.put(text)
 
 
 def send_message(text):
     """
-    Sends a message until complete to the specified chat ID
-    using send_message_async function.
+    Queues a message for the background sender and returns immediately.
 
     Parameters:
     text (str): The message to be sent.
@@ -41,11 +300,44 @@ def send_message(text):
     None
     """
     try:
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(send_message_async(text))
+        notifications.put(text)
 
-    except:
+    except Exception as e:
         print(
-            f"{datetime.now().replace(microsecond=0)} \
-                Error while sending telegram message"
+            f"{datetime.now().replace(microsecond=0)} "
+            f"Error while queuing telegram message: {e}"
         )
+
+
+def notify(text, callback=None):
+    """
+    Prints a message and passes it to a callback, e.g. send_message.
+    Errors of the callback are printed, so they never stop the caller.
+
+    Parameters:
+    text (str): The message.
+    callback: Optional function called with the message.
+
+    Returns:
+    None
+    """
+    print(text)
+    if callback is not None:
+        try:
+            callback(text)
+        except Exception as e:
+            print(f"{datetime.now().replace(microsecond=0)} "
+                  f"Error while notifying: {e}")
+
+
+def flush(timeout=FLUSH_TIMEOUT):
+    """
+    Waits until queued messages are sent, e.g. before a process exits.
+
+    Parameters:
+    timeout (float): The longest wait in seconds.
+
+    Returns:
+    bool: True if all messages were sent.
+    """
+    return notifications.flush(timeout)
@@ -0,0 +1,510 @@
+"""
+Lightweight HTTP client of the energy operator's meter portal.
+
+It replaces the Selenium browser used by scraper.py: the login form is
+submitted with a plain requests session and the meter reading is parsed
+from the returned HTML (the same "digit1"/"afterComa" elements the browser
+read) or from a JSON document. A run needs a few HTTP requests and a few
+MB of memory instead of a full Chromium.
+
+Readings are returned in the same integer format scraper.py stores in the
+database: kWh multiplied by 10000.
+
+The module provides the following:
+
+- `MeterPortalClient`: Session based client with `login()` and
+`read_meter()` methods.
+- `parse_reading_html(html)`: Reads taken and given values from the
+portal page.
+- `parse_reading_json(data)`: Reads taken and given values from the
+portal's JSON document.
+- `parse_chart(data)`: Reads the usage profile from the portal's chart
+JSON document.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import requests
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+PORTAL_URL = os.getenv(
+    "SCRAPER_PORTAL_URL", "https://mojlicznik.energa-operator.pl")
+LOGIN_PATH = "/dp/UserLogin.do"
+DATA_PATH = "/dp/UserData.do"
+CHART_PATH = "/dp/resources/chart"
+# Profile resolution: chart type covering one chart period
+CHART_TYPES = {"day": "MONTH", "hour": "DAY"}
+# Directions of energy flow: taken from and given to the grid
+DIRECTIONS = ("A+", "A-")
+USER_AGENT = ("Mozilla/5.0 (X11; Linux aarch64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/114.0 Safari/537.36")
+
+
+class PortalError(Exception):
+    """Raised when the portal returns something that can't be parsed."""
+
+
+class LoginError(PortalError):
+    """Raised when the portal rejects the login or the session expired."""
+
+
+class LoginFormParser(HTMLParser):
+    """
+    Collects the action and input fields of the login form
+    (the form containing the j_username field).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self._form = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form":
+            self._form = {"action": attrs.get("action"), "fields": {}}
+        elif tag == "input" and self._form is not None and attrs.get("name"):
+            if attrs.get("type") in ("radio", "checkbox") \
+                    and "checked" not in attrs:
+                return
+            self._form["fields"][attrs["name"]] = attrs.get("value") or ""
+
+    def handle_endtag(self, tag):
+        if tag == "form" and self._form is not None:
+            self.forms.append(self._form)
+            self._form = None
+
+    def login_form(self):
+        """
+        Returns the login form.
+
+        Returns:
+            dict or None: 'action' and 'fields' of the form, None if
+            the page has no login form.
+        """
+        for form in self.forms:
+            if "j_username" in form["fields"]:
+                return form
+        return None
+
+
+class MeterReadingParser(HTMLParser):
+    """
+    Collects the text of elements with class "digit1" (whole kWh digits)
+    and "afterComa" (decimal digits) in document order.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.digits = []
+        self.after_comma = []
+        self._target = None
+        self._depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._target is not None:
+            self._depth += 1
+            return
+        classes = (dict(attrs).get("class") or "").split()
+        if "digit1" in classes:
+            self._target = self.digits
+        elif "afterComa" in classes:
+            self._target = self.after_comma
+        if self._target is not None:
+            self._target.append("")
+            self._depth = 0
+
+    def handle_endtag(self, tag):
+        if self._target is None:
+            return
+        if self._depth:
+            self._depth -= 1
+        else:
+            self._target = None
+
+    def handle_data(self, data):
+        if self._target is not None:
+            self._target[-1] += data.strip()
+
+
+def parse_reading_html(html):
+    """
+    Reads the meter reading from the portal page. The page shows 8 whole
+    and 4 decimal digits of the taken counter followed by the same for
+    the given counter.
+
+    Parameters:
+        html (str): The portal page.
+
+    Returns:
+        tuple: electricity_taken (int) and electricity_given (int),
+        in kWh multiplied by 10000.
+
+    Raises:
+        PortalError: If the page doesn't contain the reading.
+    """
+    parser = MeterReadingParser()
+    parser.feed(html)
+
+    digits, after_comma = parser.digits, parser.after_comma
+    if len(digits) < 16 or len(after_comma) < 8:
+        raise PortalError("Meter reading not found on the page")
+
+    try:
+        electricity_taken = int("".join(digits[0:8] + after_comma[0:4]))
+        electricity_given = int("".join(digits[8:16] + after_comma[4:8]))
+    except ValueError:
+        raise PortalError("Meter reading digits are not numbers")
+
+    return electricity_taken, electricity_given
+
+
+def parse_reading_json(data):
+    """
+    Reads the meter reading from the portal's JSON document, which lists
+    the last measurements of every zone, e.g.
+    {"response": {"meterPoints": [{"lastMeasurements": [
+        {"zone": "A+ strefa 1", "value": 19963.355},
+        {"zone": "A- strefa 1", "value": 12180.764}]}]}}
+
+    Parameters:
+        data (dict): The decoded JSON document.
+
+    Returns:
+        tuple: electricity_taken (int) and electricity_given (int),
+        in kWh multiplied by 10000.
+
+    Raises:
+        PortalError: If the document doesn't contain the reading.
+    """
+    try:
+        meter_point = data["response"]["meterPoints"][0]
+        measurements = meter_point["lastMeasurements"]
+    except (KeyError, IndexError, TypeError):
+        raise PortalError("Meter reading not found in the JSON document")
+
+    taken = sum(m["value"] for m in measurements
+                if m.get("zone", "").startswith("A+"))
+    given = sum(m["value"] for m in measurements
+                if m.get("zone", "").startswith("A-"))
+    if not any(m.get("zone", "").startswith("A+") for m in measurements):
+        raise PortalError("Taken counter not found in the JSON document")
+
+    return round(taken * 10000), round(given * 10000)
+
+
+def parse_chart(data):
+    """
+    Reads the usage profile from the portal's chart JSON document, which
+    lists the usage of every period (day or hour) split into tariff zones,
+    e.g. {"response": {"mainChart": [
+        {"tm": "1689112800000", "zones": [12.1, null, null]}]}}
+
+    Parameters:
+        data (dict): The decoded JSON document.
+
+    Returns:
+        list: A list of (period start (datetime), usage (int)) tuples,
+        usage in kWh multiplied by 10000. Periods without data are skipped.
+
+    Raises:
+        PortalError: If the document doesn't contain the chart.
+    """
+    try:
+        points = data["response"]["mainChart"]
+    except (KeyError, TypeError):
+        raise PortalError("Chart not found in the JSON document")
+
+    profile = []
+    for point in points:
+        zones = [zone for zone in point.get("zones") or [] if zone is not None]
+        if not zones:
+            continue
+        moment = datetime.fromtimestamp(int(point["tm"]) / 1000)
+        profile.append((moment, round(sum(zones) * 10000)))
+
+    return profile
+
+
+def chart_periods(start, end, resolution):
+    """
+    Returns the starts of charts covering the range: months for the daily
+    profile and days for the hourly profile.
+
+    Parameters:
+        start (date): The first day of the range.
+        end (date): The day after the range.
+        resolution (str): 'day' or 'hour'.
+
+    Returns:
+        list: A list of datetimes.
+    """
+    periods = []
+    if resolution == "day":
+        period = datetime(start.year, start.month, 1)
+        while period.date() < end:
+            periods.append(period)
+            period = (period + timedelta(days=32)).replace(day=1)
+    else:
+        period = datetime(start.year, start.month, start.day)
+        while period.date() < end:
+            periods.append(period)
+            period += timedelta(days=1)
+
+    return periods
+
+
+class MeterPortalClient:
+    """
+    HTTP session with the meter portal.
+
+    Parameters:
+        base_url (str): The portal address, PORTAL_URL by default.
+        login (str): The user name, SCRAPER_LOGIN by default.
+        password (str): The password, SCRAPER_PASSWORD by default.
+        timeout (float): Timeout of every request in seconds.
+        data_path (str): Path of the page (or JSON document) with
+        the reading.
+        meter_point (str): The meter point id used by the charts,
+        SCRAPER_METER_POINT or read from the meter page by default.
+        store (SessionStore): Optional store of the session cookies.
+        A saved session is reused and the client logs in only when
+        there is no valid session or the portal rejects it.
+    """
+
+    def __init__(self, base_url=None, login=None, password=None, timeout=30,
+                 data_path=DATA_PATH, meter_point=None, store=None):
+        self.base_url = base_url or PORTAL_URL
+        self.data_path = data_path
+        self.meter_point = meter_point or os.getenv("SCRAPER_METER_POINT")
+        self.user = login or os.getenv("SCRAPER_LOGIN")
+        self.password = password or os.getenv("SCRAPER_PASSWORD")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.store = store
+        self.authenticated = False
+        self.logins = 0
+
+    def _url(self, path):
+        return urljoin(self.base_url, path)
+
+    def login(self):
+        """
+        Opens the login page and submits the login form with all its
+        hidden fields (e.g. the anti-XSRF token) and the credentials.
+
+        Returns:
+            None
+
+        Raises:
+            LoginError: If the portal shows the login form again.
+            requests.RequestException: If the portal can't be reached.
+        """
+        response = self.session.get(
+            self._url(LOGIN_PATH), timeout=self.timeout)
+        response.raise_for_status()
+
+        parser = LoginFormParser()
+        parser.feed(response.text)
+        form = parser.login_form()
+        if form is None:
+            raise PortalError("Login form not found")
+
+        fields = dict(form["fields"])
+        fields["j_username"] = self.user
+        fields["j_password"] = self.password
+        action = urljoin(response.url, form["action"] or LOGIN_PATH)
+
+        response = self.session.post(action, data=fields, timeout=self.timeout)
+        response.raise_for_status()
+        self.logins += 1
+
+        if self.is_login_page(response):
+            raise LoginError("Portal rejected the login")
+
+        self.authenticated = True
+        if self.store is not None:
+            self.store.save(self.session.cookies)
+
+    def _restore(self):
+        """
+        Loads the cookies of a saved session into the HTTP session.
+
+        Returns:
+            bool: True if a valid saved session was found.
+        """
+        if self.store is None:
+            return False
+        cookies = self.store.load()
+        if cookies is None:
+            return False
+
+        self.session.cookies.update(cookies)
+        self.authenticated = True
+        return True
+
+    def _authenticated(self, function, *args):
+        """
+        Calls a method which needs a logged in session. The saved session
+        is used if it is valid, otherwise the client logs in. If the portal
+        rejects a reused session, the client logs in and tries once more.
+
+        Parameters:
+            function: The method to call.
+            *args: Arguments of the method.
+
+        Returns:
+            The value returned by the method.
+        """
+        fresh = False
+        if not self.authenticated and not self._restore():
+            self.login()
+            fresh = True
+
+        try:
+            result = function(*args)
+        except LoginError:
+            if fresh:
+                raise
+            # The session expired on the portal's side
+            if self.store is not None:
+                self.store.clear()
+            self.authenticated = False
+            self.login()
+            result = function(*args)
+
+        # Every successful request extends the session's idle limit
+        if self.store is not None:
+            self.store.save(self.session.cookies)
+
+        return result
+
+    @staticmethod
+    def is_login_page(response):
+        """
+        Checks if the response is the login page, e.g. after the session
+        expired.
+
+        Parameters:
+            response (requests.Response): The response to check.
+
+        Returns:
+            bool: True if the response contains the login form.
+        """
+        if "json" in response.headers.get("Content-Type", ""):
+            return False
+        parser = LoginFormParser()
+        parser.feed(response.text)
+        return parser.login_form() is not None
+
+    def read_meter(self):
+        """
+        Downloads the current meter reading, logging in if needed.
+
+        Returns:
+            tuple: electricity_taken (int) and electricity_given (int),
+            in kWh multiplied by 10000.
+
+        Raises:
+            LoginError: If the portal rejects the login.
+            PortalError: If the reading can't be parsed.
+            requests.RequestException: If the portal can't be reached.
+        """
+        return self._authenticated(self._read_meter)
+
+    def _read_meter(self):
+        response = self.session.get(
+            self._url(self.data_path), timeout=self.timeout)
+        response.raise_for_status()
+
+        if "json" in response.headers.get("Content-Type", ""):
+            return parse_reading_json(response.json())
+        if self.is_login_page(response):
+            raise LoginError("Session is not logged in")
+
+        return parse_reading_html(response.text)
+
+    def find_meter_point(self):
+        """
+        Reads the meter point id from the meter page, where the charts
+        are linked with a 'meterPoint' parameter.
+
+        Returns:
+            str: The meter point id.
+
+        Raises:
+            LoginError: If the session isn't logged in.
+            PortalError: If the page doesn't contain the id.
+        """
+        response = self.session.get(self._url(DATA_PATH), timeout=self.timeout)
+        response.raise_for_status()
+        if self.is_login_page(response):
+            raise LoginError("Session is not logged in")
+
+        match = re.search(r"meterPoint\W{1,3}(\d+)", response.text)
+        if match is None:
+            raise PortalError("Meter point not found on the page")
+        self.meter_point = match.group(1)
+
+        return self.meter_point
+
+    def read_usage(self, start, end, resolution="day"):
+        """
+        Downloads the usage profile of taken and given energy in the range,
+        logging in if needed. Every chart is requested in the same session,
+        one month (daily profile) or one day (hourly profile) per request
+        and direction.
+
+        Parameters:
+            start (date): The first day of the range.
+            end (date): The day after the range.
+            resolution (str): 'day' or 'hour'.
+
+        Returns:
+            list: A list of (period start (datetime), taken (int),
+            given (int)) tuples ordered by time, usage in kWh multiplied
+            by 10000. Missing values are None.
+
+        Raises:
+            LoginError: If the portal rejects the login.
+            PortalError: If a chart can't be parsed.
+            requests.RequestException: If the portal can't be reached.
+        """
+        return self._authenticated(self._read_usage, start, end, resolution)
+
+    def _read_usage(self, start, end, resolution):
+        meter_point = self.meter_point or self.find_meter_point()
+        usage = {}
+
+        for period in chart_periods(start, end, resolution):
+            for index, direction in enumerate(DIRECTIONS):
+                response = self.session.get(
+                    self._url(CHART_PATH),
+                    params={
+                        "mainChart": "main",
+                        "type": CHART_TYPES[resolution],
+                        "meterPoint": meter_point,
+                        "mo": direction,
+                        "ts": int(period.timestamp() * 1000),
+                    },
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                if "json" not in response.headers.get("Content-Type", ""):
+                    raise LoginError("Session is not logged in")
+
+                for moment, value in parse_chart(response.json()):
+                    if start <= moment.date() < end:
+                        usage.setdefault(moment, [None, None])[index] = value
+
+        return [(moment, *values) for moment, values in sorted(usage.items())]
+
+    def close(self):
+        self.session.close()
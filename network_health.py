@@ -0,0 +1,429 @@
+"""
+Network health of the host and the data sources.
+
+Checking the connection used to start a `ping` subprocess on every check.
+`NetworkMonitor` keeps the connectivity state in memory instead and updates
+it from a background thread with cheap in-process probes:
+
+- tcp: opens a TCP connection (socket.create_connection),
+- dns: resolves a host name (socket.getaddrinfo),
+- head: sends an HTTP HEAD request, any status below 500 counts as up.
+
+Sources are probed every INTERVAL seconds, and every OFFLINE_INTERVAL
+seconds while the host is offline, so a recovered connection is noticed
+quickly. The latest result, latency (with a rolling mean of the last
+LATENCY_SAMPLES probes) and consecutive failures of every source are kept,
+so other components can check them instantly before they try to download
+anything.
+
+The host is online when at least one source responds. Periods when it is
+offline are kept as outage intervals and, in house_energy.py, also stored
+in the network_outages table (seconds since epoch of the naive local time,
+as in rollups.py).
+
+The module provides the following:
+
+- `create_outage_table()`: Creates the network_outages table.
+- `probe_tcp(host, port, timeout)`: Measures a TCP connection.
+- `probe_dns(host)`: Measures a DNS lookup.
+- `probe_head(url, timeout)`: Measures an HTTP HEAD request.
+- `NetworkMonitor`: Probes the sources and keeps their state.
+- `monitor()`: Returns the shared, running monitor of the process.
+"""
+
+import http.client
+import os
+import socket
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from sqlalchemy import text
+from message_sender import notify
+
+
+load_dotenv()
+
+INTERVAL = 30
+OFFLINE_INTERVAL = 10
+TIMEOUT = 3
+LATENCY_SAMPLES = 20
+# Outage intervals kept in memory
+OUTAGE_HISTORY = 100
+
+
+def default_sources():
+    """
+    Returns the probes of the internet connection and of the data sources
+    used by datafetcher.py.
+
+    Returns:
+        dict: Source name: (kind, target), where the target is
+        (host, port) for 'tcp', a host name for 'dns' and a URL for 'head'.
+    """
+    sources = {
+        "internet": ("tcp", ("8.8.8.8", 53)),
+        "dns": ("dns", "api.openweathermap.org"),
+        "weather": ("head", "http://api.openweathermap.org/"),
+        "tuya": ("tcp", ("openapi.tuyaeu.com", 443)),
+    }
+    solax_url = os.getenv("SOLAX_URL")
+    if solax_url:
+        # Only the server is checked, the URL itself is an API call
+        parts = urlsplit(solax_url)
+        sources["solax"] = ("head", f"{parts.scheme}://{parts.netloc}/")
+
+    return sources
+
+
+def create_outage_table():
+    """
+    Creates the network_outages table.
+
+    Returns:
+        None
+    """
+    # The database is only opened when outages are recorded, so
+    # raspberry_check.py can use the monitor on a computer without it
+    from data_access import engine
+
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS network_outages ("
+                "start INTEGER PRIMARY KEY, "
+                "end INTEGER NOT NULL)"
+            )
+        )
+
+
+def probe_tcp(host, port, timeout=TIMEOUT):
+    """
+    Opens and closes a TCP connection.
+
+    Parameters:
+        host (str): The host name or address.
+        port (int): The port.
+        timeout (float): Seconds to wait.
+
+    Returns:
+        float: The latency in seconds.
+
+    Raises:
+        OSError: If the connection fails.
+    """
+    start = time.perf_counter()
+    with socket.create_connection((host, port), timeout=timeout):
+        return time.perf_counter() - start
+
+
+def probe_dns(host, timeout=TIMEOUT):
+    """
+    Resolves a host name. The resolver of the system has its own timeout,
+    so the argument is only accepted for a common signature.
+
+    Parameters:
+        host (str): The host name.
+        timeout (float): Unused.
+
+    Returns:
+        float: The latency in seconds.
+
+    Raises:
+        OSError: If the name can't be resolved.
+    """
+    start = time.perf_counter()
+    socket.getaddrinfo(host, None)
+    return time.perf_counter() - start
+
+
+def probe_head(url, timeout=TIMEOUT):
+    """
+    Sends an HTTP HEAD request. Any response below 500 means the server
+    is up, even if the path requires authentication.
+
+    Parameters:
+        url (str): The URL.
+        timeout (float): Seconds to wait.
+
+    Returns:
+        float: The latency in seconds.
+
+    Raises:
+        OSError: If the request fails or the server responds with 5xx.
+    """
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection \
+        if parts.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        connection.request("HEAD", parts.path or "/")
+        status = connection.getresponse().status
+    except http.client.HTTPException as e:
+        raise OSError(str(e)) from e
+    finally:
+        connection.close()
+
+    if status >= 500:
+        raise OSError(f"HTTP {status}")
+    return time.perf_counter() - start
+
+
+PROBES = {"tcp": probe_tcp, "dns": probe_dns, "head": probe_head}
+
+
+@dataclass
+class SourceState:
+    """
+    State of one probed source.
+
+    Attributes:
+        ok (bool): Result of the last probe, None before the first one.
+        latency (float): Latency of the last successful probe in seconds.
+        checked (datetime): Time of the last probe.
+        failures (int): Failed probes in a row.
+        error (str): The error of the last failed probe.
+        latencies (deque): Latencies of the last successful probes.
+    """
+
+    ok: bool = None
+    latency: float = None
+    checked: datetime = None
+    failures: int = 0
+    error: str = ""
+    latencies: deque = field(
+        default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    @property
+    def mean_latency(self):
+        if not self.latencies:
+            return None
+        return sum(self.latencies) / len(self.latencies)
+
+
+class NetworkMonitor:
+    """
+    Probes the sources in a background thread and keeps their state.
+
+    Parameters:
+        sources (dict): Source name: (kind, target), default_sources()
+        if None.
+        interval (float): Seconds between checks while online.
+        offline_interval (float): Seconds between checks while offline.
+        timeout (float): Time limit of one probe in seconds.
+        record (bool): Store outages in the network_outages table.
+        notify: Optional function called with a message (str) when
+        the host goes offline or back online.
+    """
+
+    def __init__(self, sources=None, interval=INTERVAL,
+                 offline_interval=OFFLINE_INTERVAL, timeout=TIMEOUT,
+                 record=False, notify=None):
+        self.sources = sources if sources is not None else default_sources()
+        self.interval = interval
+        self.offline_interval = offline_interval
+        self.timeout = timeout
+        self.record = record
+        self.notify = notify
+        self.states = {name: SourceState() for name in self.sources}
+        self.online = None
+        self.offline_since = None
+        self.outages = deque(maxlen=OUTAGE_HISTORY)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if record:
+            create_outage_table()
+
+    def probe(self, name):
+        """
+        Probes one source and updates its state.
+
+        Parameters:
+            name (str): The name of the source.
+
+        Returns:
+            bool: True if the source responded.
+        """
+        kind, target = self.sources[name]
+        arguments = target if isinstance(target, tuple) else (target,)
+        try:
+            latency = PROBES[kind](*arguments, timeout=self.timeout)
+            error = ""
+        except OSError as e:
+            latency = None
+            error = str(e) or type(e).__name__
+
+        with self.lock:
+            state = self.states[name]
+            state.checked = datetime.now().replace(microsecond=0)
+            state.ok = latency is not None
+            state.error = error
+            if state.ok:
+                state.latency = latency
+                state.latencies.append(latency)
+                state.failures = 0
+            else:
+                state.failures += 1
+
+        return latency is not None
+
+    def check(self):
+        """
+        Probes all sources once and updates the online state and outages.
+
+        Returns:
+            bool: True if the host is online.
+        """
+        results = [self.probe(name) for name in self.sources]
+        online = any(results)
+        now = datetime.now().replace(microsecond=0)
+
+        with self.lock:
+            was_online, self.online = self.online, online
+            if not online and self.offline_since is None:
+                self.offline_since = now
+            outage = None
+            if online and self.offline_since is not None:
+                outage = (self.offline_since, now)
+                self.outages.append(outage)
+                self.offline_since = None
+
+        if outage is not None:
+            self._record(*outage)
+        if was_online is not None and was_online != online:
+            notify(
+                f"{now} Network back online after "
+                f"{outage[1] - outage[0]}." if online
+                else f"{now} Network offline.", self.notify)
+
+        return online
+
+    def _record(self, start, end):
+        if not self.record:
+            return
+        from data_access import engine
+        from data_access import epoch
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        "INSERT OR REPLACE INTO network_outages (start, end) "
+                        "VALUES (:start, :end)"
+                    ),
+                    {"start": int(epoch(start)), "end": int(epoch(end))},
+                )
+        except Exception as e:
+            print(f"{datetime.now().replace(microsecond=0)} "
+                  f"Error recording network outage: {e}")
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                online = self.check()
+            except Exception as e:
+                print(f"{datetime.now().replace(microsecond=0)} "
+                      f"Error checking network: {e}")
+                online = False
+            self.stopped.wait(
+                self.interval if online else self.offline_interval)
+
+    def start(self):
+        """
+        Starts probing in a daemon thread.
+
+        Returns:
+            NetworkMonitor: The monitor itself.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self._run, name="network-health", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(self.timeout * len(self.sources) + 1)
+            self.thread = None
+
+    def is_online(self):
+        """
+        Returns the cached online state without probing. Before the first
+        check completes the host is assumed to be online.
+
+        Returns:
+            bool: False only if the last check found no source responding.
+        """
+        return self.online is not False
+
+    def is_reachable(self, name):
+        """
+        Returns the cached state of a source without probing. Unknown
+        sources and sources which haven't been probed yet count as
+        reachable, so callers try them.
+
+        Parameters:
+            name (str): The name of the source.
+
+        Returns:
+            bool: False only if the last probe of the source failed.
+        """
+        state = self.states.get(name)
+        return state is None or state.ok is not False
+
+    def status(self):
+        """
+        Returns the state of every source and the outages.
+
+        Returns:
+            dict: 'online', 'offline_since', 'outages' (list of
+            (start, end) tuples) and 'sources' (source name: dictionary
+            with 'ok', 'latency_ms', 'mean_latency_ms', 'checked',
+            'failures' and 'error').
+        """
+        with self.lock:
+            return {
+                "online": self.online,
+                "offline_since": self.offline_since,
+                "outages": list(self.outages),
+                "sources": {
+                    name: {
+                        "ok": state.ok,
+                        "latency_ms": round(state.latency * 1000, 1)
+                        if state.latency is not None else None,
+                        "mean_latency_ms": round(state.mean_latency * 1000, 1)
+                        if state.mean_latency is not None else None,
+                        "checked": state.checked,
+                        "failures": state.failures,
+                        "error": state.error,
+                    }
+                    for name, state in self.states.items()
+                },
+            }
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def monitor(**kwargs):
+    """
+    Returns the monitor shared by the whole process and starts it with
+    the first call. Keyword arguments of NetworkMonitor are only used by
+    the first call.
+
+    Returns:
+        NetworkMonitor: The running monitor.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = NetworkMonitor(**kwargs).start()
+    return _monitor
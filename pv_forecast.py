@@ -0,0 +1,400 @@
+"""
+PV production forecast from the weather.
+
+The model predicts the mean production of a clock hour from the position
+of the sun and the cloudiness:
+
+    power = w1 * s + w2 * s * clouds / 100
+
+where s is the sine of the sun's elevation in the middle of the hour
+(0 below the horizon). A separate pair of weights is fitted for every
+hour of the day, which also absorbs the orientation and shading of the
+panels. The least squares fit only needs the sums X'X and X'y of every
+hour of the day, so training is incremental: `train()` adds the hours
+stored since the last run (hourly means of live_production and
+weather_clouds computed in SQLite) to the sums kept in the
+pv_forecast_model table and solves the 2x2 systems again. Hours with
+too few samples use the fit of all hours.
+
+`update()` trains and, every FORECAST_TTL seconds, downloads the
+OpenWeatherMap 5 day / 3 hour forecast, interpolates the cloudiness
+to hours and stores the forecast of the rest of today and of tomorrow in
+the pv_forecast table. Hours which have already started keep the last
+forecast made before them, so the dashboard's day chart compares the
+production with what was expected (intraday and day-ahead).
+
+Hours are stored as seconds since epoch of the naive local time, as in
+rollups.py. The sun's position is computed from the real (UTC) time.
+
+Usage:
+    python pv_forecast.py [--retrain]
+
+The module provides the following:
+
+- `create_forecast_tables()`: Creates the model, forecast and state tables.
+- `solar_elevation_sine(times)`: Sine of the sun's elevation (vectorized).
+- `train(full)`: Adds new hours to the model.
+- `update()`: Trains and refreshes the cached forecast.
+- `fetch(day)`: Returns the cached forecast of one day.
+"""
+
+import startup_profiler
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+import requests
+from dotenv import load_dotenv
+from sqlalchemy import text
+from data_access import bucketed_means, engine, epoch
+
+pd = startup_profiler.lazy_import("pandas")
+np = startup_profiler.lazy_import("numpy")
+
+load_dotenv()
+
+LATITUDE = float(os.getenv("PV_LATITUDE", "54.35"))
+LONGITUDE = float(os.getenv("PV_LONGITUDE", "18.65"))
+TIMEZONE = "Europe/Warsaw"
+FORECAST_URL = (
+    "http://api.openweathermap.org/data/2.5/forecast?q=Gdansk"
+    f"&appid={os.getenv('WEATHER_API_KEY')}"
+)
+FORECAST_TTL = 3 * 3600
+# Hours of one day fitted separately need this many samples
+MIN_SAMPLES = 20
+RIDGE = 1e-6
+RETENTION = 90
+HOUR = 3600
+STATISTICS = ["xx00", "xx01", "xx11", "xy0", "xy1", "n"]
+
+
+def create_forecast_tables():
+    """
+    Creates the pv_forecast_model table (sums of every hour of the day),
+    the pv_forecast table (forecast power of every hour) and the
+    pv_forecast_state table.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS pv_forecast_model ("
+                "hour_of_day INTEGER PRIMARY KEY, "
+                + ", ".join(f"{name} REAL NOT NULL" for name in STATISTICS)
+                + ")"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS pv_forecast ("
+                "hour INTEGER PRIMARY KEY, "
+                "clouds REAL, "
+                "power REAL NOT NULL)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS pv_forecast_state ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "trained_until INTEGER, "
+                "issued REAL)"
+            )
+        )
+        connection.execute(
+            text("INSERT OR IGNORE INTO pv_forecast_state (id) VALUES (1)"))
+
+
+def solar_elevation_sine(times):
+    """
+    Returns the sine of the sun's elevation at the given local times,
+    0 when the sun is below the horizon.
+
+    Parameters:
+        times: Naive local times (pandas DatetimeIndex or array-like).
+
+    Returns:
+        np.ndarray: Values from 0 to 1.
+    """
+    times = pd.DatetimeIndex(times)
+    utc = times.tz_localize(
+        TIMEZONE, ambiguous=np.zeros(len(times), dtype=bool),
+        nonexistent="shift_forward").tz_convert("UTC")
+    day = utc.dayofyear.to_numpy()
+    hours = (utc.hour + utc.minute / 60).to_numpy()
+
+    declination = np.radians(23.45) * np.sin(
+        np.radians(360 / 365 * (284 + day)))
+    b = np.radians(360 / 365 * (day - 81))
+    equation_of_time = 9.87 * np.sin(2 * b) - 7.53 * np.cos(b) \
+        - 1.5 * np.sin(b)
+    solar_time = hours + LONGITUDE / 15 + equation_of_time / 60
+    hour_angle = np.radians(15 * (solar_time - 12))
+    latitude = np.radians(LATITUDE)
+    sine = np.sin(latitude) * np.sin(declination) \
+        + np.cos(latitude) * np.cos(declination) * np.cos(hour_angle)
+
+    return np.clip(sine, 0, None)
+
+
+def features(hours, clouds):
+    """
+    Returns the model inputs of hours.
+
+    Parameters:
+        hours: Naive local starts of the hours.
+        clouds: Cloudiness of the hours in percent.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2).
+    """
+    sun = solar_elevation_sine(
+        pd.DatetimeIndex(hours) + pd.Timedelta(minutes=30))
+    return np.column_stack([sun, sun * np.asarray(clouds, dtype=float) / 100])
+
+
+def observations(start, end):
+    """
+    Returns hourly means of production and cloudiness.
+
+    Parameters:
+        start (datetime): The first hour.
+        end (datetime): The end of the last hour.
+
+    Returns:
+        pd.DataFrame: Columns 'time', 'power' and 'clouds' of hours
+        with both values.
+    """
+    production = pd.DataFrame(
+        bucketed_means("solax_data", ["live_production"], start, end, HOUR),
+        columns=["time", "power"])
+    clouds = pd.DataFrame(
+        bucketed_means("weather_data", ["weather_clouds"], start, end, HOUR),
+        columns=["time", "clouds"])
+
+    return production.merge(clouds, on="time").dropna()
+
+
+def _weights(connection):
+    """
+    Solves the least squares fit of every hour of the day.
+
+    Returns:
+        np.ndarray: Weights of shape (24, 2), zeros without data.
+    """
+    rows = connection.execute(
+        text(f"SELECT hour_of_day, {', '.join(STATISTICS)} "
+             f"FROM pv_forecast_model")
+    ).all()
+    sums = np.zeros((24, len(STATISTICS)))
+    for row in rows:
+        sums[row[0]] = row[1:]
+
+    weights = np.zeros((24, 2))
+    overall = sums.sum(axis=0)
+    for hour_of_day in range(24):
+        xx00, xx01, xx11, xy0, xy1, n = sums[hour_of_day] \
+            if sums[hour_of_day, 5] >= MIN_SAMPLES else overall
+        if xx00 <= 0:
+            continue
+        matrix = np.array([[xx00, xx01], [xx01, xx11]])
+        matrix += np.eye(2) * RIDGE * max(xx00, 1.0)
+        weights[hour_of_day] = np.linalg.solve(matrix, [xy0, xy1])
+
+    return weights
+
+
+def train(full=False, now=None):
+    """
+    Adds the complete hours stored since the last training to the sums
+    of the model. Full training starts again from the first stored hour.
+
+    Parameters:
+        full (bool): Forget the sums and train on the whole history.
+        now (datetime): The current time, now if None.
+
+    Returns:
+        int: The number of hours added.
+    """
+    create_forecast_tables()
+    now = now or datetime.now()
+    end = now.replace(minute=0, second=0, microsecond=0)
+
+    with engine.begin() as connection:
+        if full:
+            connection.execute(text("DELETE FROM pv_forecast_model"))
+            trained_until = None
+        else:
+            trained_until = connection.execute(
+                text("SELECT trained_until FROM pv_forecast_state")
+            ).scalar()
+        if trained_until is None:
+            first = connection.execute(
+                text("SELECT MIN(date) FROM solax_data")).scalar()
+            start = datetime.fromisoformat(first).replace(
+                minute=0, second=0, microsecond=0) if first else end
+        else:
+            start = datetime(1970, 1, 1) + timedelta(seconds=trained_until)
+
+    data = observations(start, end) if start < end else pd.DataFrame()
+
+    with engine.begin() as connection:
+        if len(data):
+            x = features(data["time"], data["clouds"])
+            y = data["power"].to_numpy(dtype=float)
+            hour_of_day = pd.DatetimeIndex(data["time"]).hour.to_numpy()
+            sums = np.zeros((24, len(STATISTICS)))
+            np.add.at(sums[:, 0], hour_of_day, x[:, 0] * x[:, 0])
+            np.add.at(sums[:, 1], hour_of_day, x[:, 0] * x[:, 1])
+            np.add.at(sums[:, 2], hour_of_day, x[:, 1] * x[:, 1])
+            np.add.at(sums[:, 3], hour_of_day, x[:, 0] * y)
+            np.add.at(sums[:, 4], hour_of_day, x[:, 1] * y)
+            np.add.at(sums[:, 5], hour_of_day, 1)
+            connection.execute(
+                text(
+                    f"INSERT INTO pv_forecast_model "
+                    f"(hour_of_day, {', '.join(STATISTICS)}) "
+                    f"VALUES (:hour_of_day, "
+                    f"{', '.join(':' + name for name in STATISTICS)}) "
+                    f"ON CONFLICT (hour_of_day) DO UPDATE SET "
+                    + ", ".join(f"{name} = {name} + excluded.{name}"
+                                for name in STATISTICS)
+                ),
+                [
+                    {"hour_of_day": index,
+                     **dict(zip(STATISTICS, map(float, sums[index])))}
+                    for index in range(24) if sums[index, 5]
+                ],
+            )
+        connection.execute(
+            text("UPDATE pv_forecast_state SET trained_until = :end"),
+            {"end": epoch(end)},
+        )
+
+    return len(data)
+
+
+def download_clouds(hours):
+    """
+    Downloads the cloudiness forecast and interpolates it to hours.
+
+    Parameters:
+        hours (pd.DatetimeIndex): Naive local starts of the hours.
+
+    Returns:
+        np.ndarray: Cloudiness in percent in the middle of every hour.
+
+    Raises:
+        requests.RequestException: If the forecast can't be downloaded.
+    """
+    response = requests.get(FORECAST_URL, timeout=10)
+    response.raise_for_status()
+    entries = response.json()["list"]
+    times = np.array([entry["dt"] for entry in entries], dtype=float)
+    clouds = np.array([entry["clouds"]["all"] for entry in entries],
+                      dtype=float)
+
+    middles = (hours + pd.Timedelta(minutes=30)).tz_localize(
+        TIMEZONE, ambiguous=np.zeros(len(hours), dtype=bool),
+        nonexistent="shift_forward")
+    return np.interp(middles.asi8 / 1e9, times, clouds)
+
+
+def update(now=None, force=False):
+    """
+    Trains the model and, if the cached forecast is older than
+    FORECAST_TTL, forecasts the hours from now to the end of tomorrow.
+
+    Parameters:
+        now (datetime): The current time, now if None.
+        force (bool): Refresh the forecast regardless of its age.
+
+    Returns:
+        bool: True if the forecast was refreshed.
+    """
+    now = now or datetime.now()
+    train(now=now)
+
+    with engine.connect() as connection:
+        issued = connection.execute(
+            text("SELECT issued FROM pv_forecast_state")).scalar()
+    if not force and issued is not None \
+            and time.time() - issued < FORECAST_TTL:
+        return False
+
+    start = now.replace(minute=0, second=0, microsecond=0)
+    end = datetime.combine(now.date(), datetime.min.time()) \
+        + timedelta(days=2)
+    hours = pd.date_range(start, end, freq="h", inclusive="left")
+    clouds = download_clouds(hours)
+
+    with engine.begin() as connection:
+        weights = _weights(connection)
+        x = features(hours, clouds)
+        power = np.clip(
+            np.einsum("ij,ij->i", x, weights[hours.hour.to_numpy()]),
+            0, None)
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO pv_forecast (hour, clouds, power) "
+                "VALUES (:hour, :clouds, :power)"
+            ),
+            [
+                {"hour": epoch(hour), "clouds": float(cloud),
+                 "power": round(float(value), 1)}
+                for hour, cloud, value in zip(hours, clouds, power)
+            ],
+        )
+        connection.execute(
+            text("DELETE FROM pv_forecast WHERE hour < :limit"),
+            {"limit": epoch(start) - RETENTION * 86400},
+        )
+        connection.execute(
+            text("UPDATE pv_forecast_state SET issued = :issued"),
+            {"issued": time.time()},
+        )
+
+    return True
+
+
+def fetch(day):
+    """
+    Returns the cached forecast of one day.
+
+    Parameters:
+        day (datetime): Midnight of the day.
+
+    Returns:
+        list: A list of (hour start (datetime), power (W)) tuples.
+    """
+    create_forecast_tables()
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT hour, power FROM pv_forecast "
+                "WHERE hour >= :start AND hour < :end ORDER BY hour"
+            ),
+            {"start": epoch(day), "end": epoch(day) + 86400},
+        ).all()
+
+    return [(datetime(1970, 1, 1) + timedelta(seconds=hour), power)
+            for hour, power in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--retrain", action="store_true",
+                        help="train again on the whole history")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    hours = train(full=args.retrain)
+    print(f"Trained on {hours} new hours in "
+          f"{time.perf_counter() - started:.1f} s")
+    with engine.connect() as connection:
+        for hour_of_day, (sun, cloudy) in enumerate(_weights(connection)):
+            if sun:
+                print(f"{hour_of_day:02d}:00 clear sky {sun:7.0f} W, "
+                      f"overcast {sun + cloudy:7.0f} W at full sun")
@@ -0,0 +1,115 @@
+"""
+Query planner choosing the cheapest resolution and source for a series.
+
+For a requested range the planner picks the finest resolution (raw,
+5-minute, hourly or daily) whose expected number of points fits in the
+point budget. Bucketed resolutions are read from the materialized rollups
+in 'rollups' and only the part of the range newer than the last rollup
+refresh is aggregated from raw rows. This way a chart covering a whole year
+reads a few hundred rollup rows instead of millions of raw samples.
+
+The module provides the following functions:
+
+- `choose_resolution(name, start, end, budget)`: Returns the name of the
+finest resolution fitting in the point budget.
+- `iter_series(name, start, end, resolution, chunk_size)`: Yields chunks of
+(date, value) rows, using rollups where they are available.
+- `fetch_series(name, start, end, budget)`: Returns the chosen resolution
+and all rows of a series, for charts.
+"""
+
+from datetime import datetime, timedelta
+import data_access
+import rollups
+
+
+DEFAULT_POINT_BUDGET = 1500
+
+# Nominal interval between raw samples of each table in seconds
+SAMPLE_INTERVALS = {
+    "solax_data": 10,
+    "tuya_data": 10,
+    "weather_data": 10,
+    "my_power_meter": 86400,
+}
+
+
+def choose_resolution(name, start, end, budget=DEFAULT_POINT_BUDGET):
+    """
+    Returns the finest resolution whose expected number of points
+    in the range doesn't exceed the budget.
+
+    Parameters:
+        name (str): The name of the series.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        budget (int): The maximum number of points.
+
+    Returns:
+        str: The name of the resolution, a key of data_access.RESOLUTIONS.
+    """
+    interval = SAMPLE_INTERVALS[data_access.SERIES[name][0]]
+    span = (end - start).total_seconds()
+
+    for resolution, step in data_access.RESOLUTIONS.items():
+        # Buckets finer than the sample interval don't reduce the points
+        if span / max(step or interval, interval) <= budget:
+            return resolution
+
+    return "day"
+
+
+def iter_series(name, start, end, resolution="raw", chunk_size=1000):
+    """
+    Yields chunks of (date, value) rows of a series. Bucketed resolutions
+    are read from the rollup table up to its last bucket and the remaining
+    newest part of the range is aggregated from raw rows.
+
+    Parameters:
+        name (str): The name of the series.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        resolution (str): The name of the resolution.
+        chunk_size (int): The maximum number of rows in one chunk.
+
+    Yields:
+        list: A list of (date, value) tuples.
+    """
+    step = data_access.RESOLUTIONS[resolution]
+    newest = rollups.last_bucket(name, step) if step else None
+
+    if newest is None:
+        yield from data_access.iter_series(
+            name, start, end, resolution, chunk_size)
+        return
+
+    # The last stored bucket may be incomplete, so it is read from raw rows
+    split = max(datetime(1970, 1, 1) + timedelta(seconds=newest), start)
+    if split > start:
+        yield from rollups.iter_rollup(
+            name, start, min(split, end), step, chunk_size)
+    if split < end:
+        yield from data_access.iter_series(
+            name, split, end, resolution, chunk_size)
+
+
+def fetch_series(name, start, end, budget=DEFAULT_POINT_BUDGET):
+    """
+    Returns all rows of a series in the resolution chosen for the range.
+
+    Parameters:
+        name (str): The name of the series.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        budget (int): The maximum number of points.
+
+    Returns:
+        tuple: The chosen resolution (str) and a list of (date, value)
+        tuples.
+    """
+    resolution = choose_resolution(name, start, end, budget)
+    rows = []
+    for chunk in iter_series(name, start, end, resolution):
+        rows.extend(chunk)
+
+    return resolution, rows
@@ -1,24 +1,22 @@
 """
 Program for checking (on another computer) if site rafalrolkiewicz.com is up and running.
-It uses Selenium for checking website, telegram bot for sending messages,
-subprocess for checking if computer is connected to wifi (reconnect if necessary)
-and schedule for scheduling website check every 5 minutes.
+It uses uptime_prober for checking website over HTTP, telegram bot for sending messages,
+network_health for checking if computer is connected to internet, subprocess
+for reconnecting to wifi if necessary
+and schedule for scheduling website check every minute.
 """
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+import startup_profiler
 import message_sender as telegram
 import schedule
 import time
-from datetime import datetime
 import subprocess
 from dotenv import load_dotenv
 import os
+import network_health
+import uptime_prober
 
+startup_profiler.mark("imports")
 
 load_dotenv()
 
@@ -31,25 +29,6 @@ network = (NETWORK_NAME, NETWORK_PSWRD)
 hostpot = (HOTSPOT_NAME, HOTSPOT_PSWRD)
 
 
-class Driver:
-    def __init__(self):
-        try:
-            self.chrome_options = webdriver.ChromeOptions()
-            self.chrome_options.binary_location = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
-            self.chrome_options.add_argument("--headless")
-            self.service = Service(
-                executable_path=ChromeDriverManager().install())
-            self.driver = webdriver.Chrome(
-                service=self.service, options=self.chrome_options)
-
-        except Exception as e:
-            print(
-                f"{datetime.now().replace(microsecond=0)} Failed to load Selenium driver: {e}")
-
-
-driver = Driver()
-
-
 def scan_wifi_networks():
     try:
         networks = subprocess.check_output(
@@ -105,74 +84,38 @@ def get_connected_network():
 
 def is_connected():
     """
-    Check if computer has access to internet by sending ping to Google.
+    Check if computer has access to internet. The state is kept by
+    a network_health.NetworkMonitor probing in the background, so no
+    ping process is started.
     """
-    try:
-        subprocess.run(["ping", "-c", "1", "8.8.8.8"], check=True,
-                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        pass
-    return False
+    return network_health.monitor().is_online()
 
 
-online_alert = True
+prober = None
 
 
 def check_site():
     """
-    Check if website rafalrolkiewicz.com is up and running.
+    Check if website rafalrolkiewicz.com is up and running. The health
+    endpoint and the layout of the dashboard are requested directly
+    by uptime_prober.UptimeProber, which also alerts on SLO breaches.
     """
-    global driver
-    global online_alert
+    global prober
 
     if not is_connected():
         connect_to_wifi(network)
 
-    browser = driver.driver
-
-    try:
-        browser.get("http://www.rafalrolkiewicz.com")
-        wait = WebDriverWait(browser, 10)
-    except:
-        print(
-            f"{datetime.now().replace(microsecond=0)} Error, couldn't load rafalrolkiewicz.com")
-        telegram.send_message(
-            f"{datetime.now().replace(microsecond=0)} Error, couldn't load rafalrolkiewicz.com!")
-
-    try:
-        ngrok_visit_site_ngrok = wait.until(EC.presence_of_element_located((
-            By.XPATH, '//*[@id="root"]/div/main/div/div/section[1]/div/footer/button')))
-        ngrok_visit_site_ngrok.click()
-    except:
-        # print("Ngrok site not present or failed")
-        pass
-
-    try:
-        site = wait.until(EC.presence_of_element_located(
-            (By.XPATH, '//*[@id="react-entry-point"]/div/div[2]/div[1]/h1')))
-        if site.text == 'ELECTRICITY PRODUCTION' and online_alert == True:
-            print(f"{datetime.now().replace(microsecond=0)} Site online.")
-            telegram.send_message(
-                f"{datetime.now().replace(microsecond=0)} Raspberry online!")
-            online_alert = False
-        elif site.text != 'ELECTRICITY PRODUCTION':
-            print("Site offline!")
-            telegram.send_message(
-                f"{datetime.now().replace(microsecond=0)} Raspberry offline!")
-            online_alert = True
-    except:
-        print("Site offline!")
-        telegram.send_message(
-            f"{datetime.now().replace(microsecond=0)} Raspberry offline!")
-        online_alert = True
-    browser.get("http://www.google.com")
+    if prober is None:
+        prober = uptime_prober.UptimeProber(notify=telegram.send_message)
+    prober.check()
 
 
-schedule.every(5).minutes.do(check_site)
-schedule.run_all()
+schedule.every(1).minutes.do(check_site)
+startup_profiler.mark("init")
 
 if __name__ == "__main__":
+    startup_profiler.report("raspberry_check.py")
+    schedule.run_all()
     while True:
         schedule.run_pending()
         time.sleep(1)
@@ -0,0 +1,159 @@
+"""
+Materialized rollups of every series in 5-minute, hourly and daily buckets.
+
+Rollups are stored in the compact series_rollup table, one row per series,
+bucket size and bucket. The table is refreshed incrementally: only buckets
+starting with the last stored one are recomputed, so a refresh touches just
+the newest raw rows. Reading a long range from the rollup table costs one
+row per bucket instead of a scan over all raw samples.
+
+The module provides the following functions:
+
+- `create_rollup_table()`: Creates the rollup table if it doesn't exist.
+- `refresh_rollups(since, names)`: Recomputes rollups from the last stored bucket
+(or from the given datetime) onward.
+- `last_bucket(name, step)`: Returns the newest stored bucket of a series.
+- `iter_rollup(name, start, end, step, chunk_size)`: Yields chunks of
+(date, value) rows read from the rollup table.
+"""
+
+from sqlalchemy import text
+import data_access
+from data_access import engine, epoch, from_epoch
+
+
+ROLLUP_RESOLUTIONS = ["5min", "hour", "day"]
+
+
+def create_rollup_table():
+    """
+    Creates the series_rollup table if it doesn't exist.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS series_rollup ("
+                "series TEXT NOT NULL, "
+                "step INTEGER NOT NULL, "
+                "bucket INTEGER NOT NULL, "
+                "value REAL, "
+                "samples INTEGER NOT NULL, "
+                "PRIMARY KEY (series, step, bucket)"
+                ") WITHOUT ROWID"
+            )
+        )
+
+
+def last_bucket(name, step, connection=None):
+    """
+    Returns the newest stored bucket of a series.
+
+    Parameters:
+        name (str): The name of the series.
+        step (int): The bucket size in seconds.
+        connection (Connection): Optional open connection to reuse.
+
+    Returns:
+        int or None: Bucket start in seconds since epoch, None if
+        the series has no rollups yet.
+    """
+    query = text(
+        "SELECT MAX(bucket) FROM series_rollup "
+        "WHERE series = :series AND step = :step"
+    )
+    params = {"series": name, "step": step}
+    if connection is not None:
+        return connection.execute(query, params).scalar()
+    with engine.connect() as connection:
+        return connection.execute(query, params).scalar()
+
+
+def refresh_rollups(since=None, names=None):
+    """
+    Recomputes rollups of all series. Buckets starting with the last stored
+    bucket are recomputed from raw rows, because the last bucket may have
+    been incomplete during the previous refresh.
+
+    Parameters:
+        since (datetime): Optional datetime to recompute from, used after
+        older raw rows were added or changed.
+        names (list): Optional names of the series to refresh, all series
+        by default.
+
+    Returns:
+        None
+    """
+    create_rollup_table()
+
+    with engine.begin() as connection:
+        for name, (table, column, aggregate) in data_access.SERIES.items():
+            if names is not None and name not in names:
+                continue
+            for resolution in ROLLUP_RESOLUTIONS:
+                step = data_access.RESOLUTIONS[resolution]
+                start = last_bucket(name, step, connection)
+                if since is not None:
+                    since_bucket = epoch(since) // step * step
+                    start = since_bucket if start is None \
+                        else min(start, since_bucket)
+                start = from_epoch(start or 0)
+
+                connection.execute(
+                    text(
+                        "INSERT OR REPLACE INTO series_rollup "
+                        "(series, step, bucket, value, samples) "
+                        f"SELECT :series, {step}, "
+                        f"CAST(strftime('%s', date) AS INTEGER) "
+                        f"/ {step} * {step}, "
+                        f"{aggregate}({column}), COUNT({column}) "
+                        f"FROM {table} WHERE date >= :start "
+                        f"GROUP BY CAST(strftime('%s', date) AS INTEGER) "
+                        f"/ {step}"
+                    ),
+                    {
+                        "series": name,
+                        "start": data_access.to_db_datetime(start, table),
+                    },
+                )
+
+
+def iter_rollup(name, start, end, step, chunk_size=1000):
+    """
+    Yields chunks of (date, value) rows of a series read from the rollup
+    table. Buckets are included if they start in the range.
+
+    Parameters:
+        name (str): The name of the series.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        step (int): The bucket size in seconds.
+        chunk_size (int): The maximum number of rows in one chunk.
+
+    Yields:
+        list: A list of (date, value) tuples, date formatted as
+        'YYYY-MM-DD HH:MM:SS'.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            text(
+                "SELECT datetime(bucket, 'unixepoch'), value "
+                "FROM series_rollup "
+                "WHERE series = :series AND step = :step "
+                "AND bucket >= :start AND bucket < :end "
+                "ORDER BY bucket"
+            ),
+            {
+                "series": name,
+                "step": step,
+                "start": epoch(start) // step * step,
+                "end": epoch(end),
+            },
+        )
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
@@ -1,18 +1,20 @@
+import startup_profiler
+import argparse
 import os
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import multiprocessing
 from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from sqlalchemy import create_engine, Column, Integer, Date, MetaData, Table, select
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, Date, MetaData, Table, select, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+import meter_client
+import rollups
+import energy_balance
+import tariff
+from data_access import engine
+from session_store import SessionStore
 
+startup_profiler.mark("imports")
 
 load_dotenv()
 
@@ -20,7 +22,6 @@ LOGIN = os.getenv("SCRAPER_LOGIN")
 PASSWORD = os.getenv("SCRAPER_PASSWORD")
 
 Base = declarative_base()
-engine = create_engine("sqlite:///electricity.db")
 
 
 class MyPowerMeter(Base):
@@ -38,9 +39,14 @@ session = Session()
 
 
 def login():
+    # Selenium is imported only when the browser is really used
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.wait import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     LOGIN = os.getenv("SCRAPER_LOGIN")
     PASSWORD = os.getenv("SCRAPER_PASSWORD")
-    driver.get("https://mojlicznik.energa-operator.pl/dp/UserLogin.do")
+    driver.get(meter_client.PORTAL_URL + meter_client.LOGIN_PATH)
     WebDriverWait(driver, 10).until(
         EC.presence_of_element_located((By.ID, "loginRadio"))).click()
     user = WebDriverWait(driver, 10).until(
@@ -54,6 +60,8 @@ def login():
 
 
 def download_data():
+    from selenium.webdriver.common.by import By
+
     data = []
     digits = driver.find_elements(By.CLASS_NAME, "digit1")
     for i in range(16):
@@ -75,11 +83,25 @@ def get_todays_date():
     return datetime.now().date()
 
 
-def write_to_db():
+def download_data_http():
+    """
+    Downloads the reading with a plain HTTP session, without starting
+    a browser. A saved portal session is reused if it is still valid.
+
+    Returns:
+        tuple: electricity_taken (int) and electricity_given (int).
+    """
+    client = meter_client.MeterPortalClient(store=SessionStore())
+    try:
+        return client.read_meter()
+    finally:
+        client.close()
+
+
+def write_to_db(taken, given):
     date = get_todays_date()
-    taken, given = download_data()
     last_row = session.query(MyPowerMeter).order_by(
-        MyPowerMeter.id.desc()).first()
+        MyPowerMeter.date.desc()).first()
     taken_yesterday = last_row.taken
     given_yesterday = last_row.given
     taken_daily = taken - taken_yesterday
@@ -94,12 +116,211 @@ def write_to_db():
     print(
         f"\n{datetime.now().date()} Success, downloaded and saved data. Date: {date}, taken: {taken/10000}, given: {given/10000}, taken yesterday: {taken_daily/10000}, given yesterday: {given_daily/10000}"
     )
+    return {
+        "status": "updated",
+        "date": date.isoformat(),
+        "taken": taken,
+        "given": given,
+        "taken_daily": taken_daily,
+        "given_daily": given_daily,
+    }
+
+
+def daily_usage(profile):
+    """
+    Sums a usage profile (daily or hourly) into days.
+
+    Parameters:
+        profile (list): A list of (period start, taken, given) tuples.
+
+    Returns:
+        dict: Day (date): [taken, given], None if a value is missing.
+    """
+    days = {}
+    for moment, taken, given in profile:
+        day = days.setdefault(moment.date(), [0, 0])
+        for index, value in enumerate((taken, given)):
+            if value is None or day[index] is None:
+                day[index] = None
+            else:
+                day[index] += value
+
+    return days
+
+
+def reconstruct_readings(readings, usage, start, end):
+    """
+    Reconstructs meter readings of days without a stored row from stored
+    readings and daily usage: reading(D + 1) = reading(D) + usage(D).
+    Readings are carried forward from the closest earlier stored row and,
+    before the first stored row, backward from the closest later one.
+
+    Parameters:
+        readings (dict): Day (date): [taken, given] of stored rows.
+        usage (dict): Day (date): [taken, given] usage of the day.
+        start (date): The first day of the range.
+        end (date): The day after the range.
+
+    Returns:
+        dict: Day (date): (taken, given) of days to insert.
+    """
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    filled = {}
+
+    for index in range(2):
+        current = None
+        for day in days:
+            if day in readings:
+                current = readings[day][index]
+            elif current is not None:
+                filled.setdefault(day, [None, None])[index] = current
+            value = usage.get(day, [None, None])[index]
+            current = None if current is None or value is None \
+                else current + value
+
+        current = None
+        for day in reversed(days):
+            value = usage.get(day, [None, None])[index]
+            if day in readings:
+                current = readings[day][index]
+            elif current is None or value is None:
+                current = None
+            else:
+                current -= value
+                values = filled.setdefault(day, [None, None])
+                if values[index] is None:
+                    values[index] = current
+
+    return {day: tuple(values) for day, values in filled.items()
+            if day < end and None not in values}
+
+
+def recompute_daily(since):
+    """
+    Recomputes taken_daily and given_daily of every row from 'since' on
+    in one set-based UPDATE: each row gets the difference between
+    the next reading and its own (LEAD window function). The last row
+    stays empty until the next reading arrives.
+
+    The meter is read around noon (see scraping_scheduler.py), so
+    taken_daily of date D is the usage from noon of D to noon of D + 1,
+    not of the calendar day. Readings filled in by backfill() are built
+    from the portal's calendar-day usage instead, so their deltas are
+    exactly the usage of the calendar day D. energy_balance.py and
+    tariff.py treat every delta as the usage of the calendar day D, which
+    is off by half a day for real readings.
+
+    Parameters:
+        since (date): The first day to recompute.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "UPDATE my_power_meter "
+                "SET taken_daily = delta.taken_daily, "
+                "given_daily = delta.given_daily "
+                "FROM (SELECT id, "
+                "LEAD(taken) OVER (ORDER BY date) - taken AS taken_daily, "
+                "LEAD(given) OVER (ORDER BY date) - given AS given_daily "
+                "FROM my_power_meter WHERE date >= :since) AS delta "
+                "WHERE my_power_meter.id = delta.id"
+            ),
+            {"since": since.isoformat()},
+        )
+
+
+def backfill(start, end, resolution="day"):
+    """
+    Downloads the historical usage profile of the range in one portal
+    session and fills in days missing in the my_power_meter table.
+    Readings of the missing days are reconstructed from stored readings
+    and the daily usage, inserted in bulk (days already stored are
+    skipped) and the daily deltas, their rollups and the energy balance
+    are recomputed for the whole range.
+
+    Parameters:
+        start (date): The first day of the range.
+        end (date): The last day of the range.
+        resolution (str): Profile downloaded from the portal,
+        'day' or 'hour'.
+
+    Returns:
+        int: The number of inserted rows.
+    """
+    end = end + timedelta(days=1)
+    with engine.connect() as connection:
+        # Start from the last stored reading before the range, its usage
+        # carries the readings into the range
+        anchor = connection.execute(
+            text("SELECT MAX(date) FROM my_power_meter WHERE date < :start"),
+            {"start": start.isoformat()},
+        ).scalar()
+        first = datetime.strptime(anchor, "%Y-%m-%d").date() if anchor \
+            else start
+        # and stop at the first stored reading after the range
+        last = connection.execute(
+            text("SELECT MIN(date) FROM my_power_meter WHERE date >= :end"),
+            {"end": end.isoformat()},
+        ).scalar()
+        last = datetime.strptime(last, "%Y-%m-%d").date() if last else end
+        readings = {
+            datetime.strptime(date, "%Y-%m-%d").date(): (taken, given)
+            for date, taken, given in connection.execute(
+                text(
+                    "SELECT date, taken, given FROM my_power_meter "
+                    "WHERE date >= :first AND date <= :last"
+                ),
+                {"first": first.isoformat(), "last": last.isoformat()},
+            )
+        }
+
+    client = meter_client.MeterPortalClient(store=SessionStore())
+    try:
+        usage = daily_usage(client.read_usage(first, last, resolution))
+    finally:
+        client.close()
+
+    filled = reconstruct_readings(readings, usage, first, last)
+    rows = [
+        {"date": day.isoformat(), "taken": taken, "given": given}
+        for day, (taken, given) in sorted(filled.items())
+        if start <= day < end
+    ]
+
+    inserted = 0
+    if rows:
+        with engine.begin() as connection:
+            # One executemany, rowcount is the sum over all rows
+            inserted = connection.execute(
+                text(
+                    "INSERT INTO my_power_meter (date, taken, given) "
+                    "SELECT :date, :taken, :given WHERE NOT EXISTS "
+                    "(SELECT 1 FROM my_power_meter WHERE date = :date)"
+                ),
+                rows,
+            ).rowcount
+    recompute_daily(first)
+    rollups.refresh_rollups(
+        datetime.combine(first, datetime.min.time()),
+        ["taken", "given", "taken_daily", "given_daily"],
+    )
+    energy_balance.refresh(datetime.combine(first, datetime.min.time()))
+    tariff.refresh(datetime.combine(first, datetime.min.time()))
+
+    print(
+        f"\n{datetime.now().date()} Success, backfilled {inserted} days "
+        f"between {start} and {end - timedelta(days=1)}."
+    )
+    return inserted
 
 
 def is_data_actual():
     today = get_todays_date().strftime("%j")
     last_row = session.query(MyPowerMeter).order_by(
-        MyPowerMeter.id.desc()).first()
+        MyPowerMeter.date.desc()).first()
     last_row_date = last_row.date.strftime("%j")
 
     if last_row_date == today:
@@ -108,19 +329,66 @@ def is_data_actual():
         return False
 
 
-def close_program():
-    driver.close()
-    driver.quit()
-    session.close()
+def run(selenium=False):
+    """
+    Downloads and saves today's meter reading unless it is already stored.
+    Used by scraping_scheduler.py in its worker process and by the command
+    line.
 
+    Parameters:
+        selenium (bool): Use the Chromium browser instead of HTTP.
+
+    Returns:
+        dict: 'status' ('actual' or 'updated') and, if updated, the saved
+        'date', 'taken', 'given', 'taken_daily' and 'given_daily'.
+    """
+    global driver
+
+    try:
+        if is_data_actual():
+            print(f"{datetime.now().date()} Success, data is actual.")
+            return {"status": "actual"}
+
+        if not selenium:
+            return write_to_db(*download_data_http())
+
+        # The browser is kept as a fallback if the portal changes
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
 
-if __name__ == "__main__":
-    if not is_data_actual():
-        # print("Downloading data...")
         service = Service('/usr/lib/chromium-browser/chromedriver')
         driver = webdriver.Chrome(service=service)
-        login()
-        write_to_db()
-        close_program()
+        try:
+            login()
+            return write_to_db(*download_data())
+        finally:
+            driver.quit()
+    finally:
+        session.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Downloads power meter readings from the portal.")
+    parser.add_argument("--selenium", action="store_true",
+                        help="use the Chromium browser instead of HTTP")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"),
+                        type=lambda value: datetime.strptime(
+                            value, "%Y-%m-%d").date(),
+                        help="fill in missing days between two dates "
+                             "(YYYY-MM-DD)")
+    parser.add_argument("--hourly", action="store_true",
+                        help="backfill from the hourly profile")
+    return parser.parse_args()
+
+
+startup_profiler.mark("init")
+
+if __name__ == "__main__":
+    startup_profiler.report("scraper.py")
+    args = parse_args()
+    if args.backfill:
+        backfill(*args.backfill, "hour" if args.hourly else "day")
+        session.close()
     else:
-        print(f"{datetime.now().date()} Success, data is actual.")
+        run(args.selenium)
@@ -1,98 +1,75 @@
 """
-This program schedules a scraper script to run periodically and sends updates
-to a Telegram chat. The time_limit function runs the given function with a
-time limit of 10 minutes and raises a multiprocessing.TimeoutError if
-the function takes longer than 10 minutes to run. The run_scraper function
-runs a scraper script to download data from energy provider and returns
-the updated update time. It tries to download data everyday at 12:00 PM
-and retries every hour if fail. The change_update_time function takes in
-two parameters: mode and update_time. Mode is a string that specifies whether
-the update time should be incremented by one hour or set up to next day 12PM.
-Update_time is a datetime object that represents the current update time.
-The function returns a datetime object that represents the next update time.
-The main function schedules the scraper script to run periodically
-and sends updates to a Telegram chat.
+This program schedules the scraper to run periodically and sends updates
+to a Telegram chat. The scraper (scraper.run) runs in a reusable worker
+process of job_runner.JobRunner with a time limit of 10 minutes, after which
+it is cancelled and the worker is replaced. It tries to download data
+everyday at 12:00 PM and retries every hour if it fails. The next update
+time and the last result are persisted in logs/scraping_scheduler_state.json,
+so a restarted scheduler doesn't run the scraper again before it's due.
+The change_update_time function takes in two parameters: mode and
+update_time. Mode is a string that specifies whether the update time should
+be incremented by one hour or set up to next day 12PM. Update_time is
+a datetime object that represents the current update time. The function
+returns a datetime object that represents the next update time.
+The main function schedules the scraper to run periodically and sends
+updates to a Telegram chat.
 """
 
-import message_sender as telegram
-import multiprocessing
+import startup_profiler
+from message_sender import install_sigterm_flush, notify, send_message
+import asyncio
 import logging
-import subprocess
 from datetime import datetime, timedelta
-import time
+from job_runner import JobRunner, JobState
+
+startup_profiler.mark("imports")
 
 logging.basicConfig(filename="logs/scraping_scheduler_logs.log",
                     level=logging.INFO)
 
+STATE_FILE = "logs/scraping_scheduler_state.json"
+TIMEOUT = 600
 
-def time_limit(function, update_time):
-    """
-    Runs the given function with a time limit of 10 minutes (600 seconds).
-
-    Parameters:
-        function: The function to run.
-        update_time: The current update time.
-
-    Returns:
-        The updated update time
-
-    Raises:
-        multiprocessing.TimeoutError: If the function takes
-        longer than 10 minutes to run.
 
+async def run_scraper(runner, update_time):
     """
-    pool = multiprocessing.Pool(processes=1)
-    result = pool.apply_async(function)
-    pool.close()
-
-    try:
-        result.get(timeout=600)
-        pool.join()
-    except multiprocessing.TimeoutError:
-        # Timeout occurred, terminate the pool
-        pool.terminate()
-        pool.join()
-
-    if result.ready():
-        update_time = result.get()
-    else:
-        print("Timeout occurred")
-        telegram.send_message("Timeout occurred")
-        update_time = change_update_time("next_hour", update_time)
-
-    return update_time
-
+    Runs the scraper with a time limit of 10 minutes and returns the next
+    update time.
 
-def run_scraper():
-    """
-    Runs a scraper script and returns the update time.
+    Parameters:
+    runner (JobRunner): The runner with the scraper's worker process.
+    update_time (datetime): The current update time.
 
     Returns:
-    datetime: The updated update time after running scraper.py.
-
+    tuple: The next update time (datetime) and the result of the run
+    (JobResult).
     """
-    command = ["python", "scraper.py"]
-    result = subprocess.run(command, capture_output=True)
-
-    output = result.stdout.decode("utf-8")
-    error = result.stderr.decode("utf-8")
+    result = await runner.run("scraper", "scraper:run", timeout=TIMEOUT)
 
-    print(str(output))
-    if output:
-        telegram.send_message(str(output))
+    # Output isn't captured when the runner works in-process
+    summary = result.output.strip() or (
+        str(result.value) if result.value else "")
+    if summary:
+        notify(summary, send_message)
 
-    if "Success" in str(output):
+    if result.ok:
         update_time = change_update_time("next_day", datetime.now())
+        notify(f"{update_time} Next update time", send_message)
     else:
-        update_time = change_update_time("next_hour", datetime.now())
-        print(f"Error occurred{str(error)}")
-        telegram.send_message(f"Error occurred{str(error)}")
+        if result.status == "timeout":
+            notify("Timeout occurred", send_message)
+            update_time = change_update_time("next_hour", update_time)
+        else:
+            notify(f"Error occurred{result.error}", send_message)
+            update_time = change_update_time("next_hour", datetime.now())
+        notify(f"{update_time} Next update try time", send_message)
 
-    logging.info(f"Command: {command}")
-    logging.info(f"Output: {output}")
-    logging.info(f"Error: {error}")
+    logging.info(f"Status: {result.status} in {result.duration:.1f} s")
+    logging.info(f"Result: {result.value}")
+    logging.info(f"Output: {result.output}")
+    logging.info(f"Error: {result.error}")
 
-    return update_time
+    return update_time, result
 
 
 def change_update_time(mode, update_time):
@@ -116,25 +93,47 @@ def change_update_time(mode, update_time):
         update_time = update_time + timedelta(days=1)
         update_time = update_time.replace(
             hour=12, minute=0, second=0, microsecond=0)
-        print(f"{update_time} Next update time")
-        telegram.send_message(f"{update_time} Next update time")
 
     elif mode == "next_hour":
         update_time = update_time + timedelta(hours=1)
         update_time = update_time.replace(microsecond=0)
-        print(f"{update_time} Next update try time")
-        telegram.send_message(f"{update_time} Next update try time")
 
     return update_time
 
 
+async def main(in_process=False):
+    """
+    Runs the scraper whenever the update time comes.
+
+    Parameters:
+    in_process (bool): Run the scraper in a thread of this process
+    (unified_runtime.py) instead of a worker process.
+
+    Returns:
+    None
+    """
+    state = JobState(STATE_FILE)
+    runner = JobRunner(in_process=in_process)
+    try:
+        while True:
+            now = datetime.now()
+            update_time = state.next_run("scraper", default=now)
+            # if it's time to update
+            if update_time <= now:
+                # if scraper fail to download data, try every hour to success
+                update_time, result = await run_scraper(runner, update_time)
+                state.update("scraper", update_time, result)
+            # sleep until the update time, but wake up regularly in case
+            # the clock was changed
+            delay = (update_time - datetime.now()).total_seconds()
+            await asyncio.sleep(min(max(delay, 1), 60))
+    finally:
+        runner.close()
+
+
+startup_profiler.mark("init")
+
 if __name__ == "__main__":
-    update_time = datetime.now()
-    while True:
-        now = datetime.now()
-        # if it's time to update
-        if update_time < now:
-            # run scraper with time limit of 10 minutes
-            # if scraper fail to download data, try every hour to success
-            update_time = time_limit(run_scraper, update_time)
-        time.sleep(1)
+    startup_profiler.report("scraping_scheduler.py")
+    install_sigterm_flush()
+    asyncio.run(main())
@@ -0,0 +1,199 @@
+"""
+Encrypted store of the meter portal's session cookies.
+
+meter_client.py saves the cookies of an authenticated session here, so the
+next run of the scraper (an hourly retry, a backfill or the next day's run)
+continues the same session instead of logging in again. The file is
+encrypted with Fernet (AES with HMAC) from the cryptography package, because
+the cookies give access to the portal account.
+
+Every saved session has an expiry time: the earliest expiry of its cookies,
+limited by MAX_IDLE after the last use for cookies without one (the portal
+drops idle sessions). An expired or unreadable session is never returned,
+so the client logs in again only when it's needed.
+
+The key is read from the SESSION_STORE_KEY environment variable (a Fernet
+key, see `generate_key()`). Without it a key is generated on the first use
+and kept next to the store in a file readable only by its owner.
+
+The module provides the following:
+
+- `SessionStore`: Saves, loads and clears the encrypted session.
+- `generate_key()`: Returns a new key for SESSION_STORE_KEY.
+"""
+
+import json
+import os
+import time
+from http.cookiejar import Cookie
+from requests.cookies import RequestsCookieJar
+
+
+STORE_FILE = "logs/meter_session.bin"
+KEY_FILE = "logs/meter_session.key"
+# Lifetime of cookies without an expiry after the last use, in seconds
+MAX_IDLE = int(os.getenv("SESSION_STORE_MAX_IDLE", 30 * 60))
+
+
+def generate_key():
+    """
+    Returns a new random key.
+
+    Returns:
+        str: A Fernet key, urlsafe base64 encoded.
+    """
+    from cryptography.fernet import Fernet
+
+    return Fernet.generate_key().decode()
+
+
+def load_key(key_file=KEY_FILE):
+    """
+    Returns the encryption key: SESSION_STORE_KEY or the key file, which
+    is created with a new key if it doesn't exist.
+
+    Parameters:
+        key_file (str): The path of the key file.
+
+    Returns:
+        bytes: The Fernet key.
+    """
+    key = os.getenv("SESSION_STORE_KEY")
+    if key:
+        return key.encode()
+
+    try:
+        with open(key_file, "rb") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(key_file) or ".", exist_ok=True)
+    key = generate_key().encode()
+    fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(key)
+
+    return key
+
+
+class SessionStore:
+    """
+    Encrypted file with cookies of one session.
+
+    Parameters:
+        path (str): The path of the store file.
+        key (bytes): Optional Fernet key, load_key() by default.
+        max_idle (int): Lifetime of cookies without an expiry after
+        the last use, in seconds.
+    """
+
+    def __init__(self, path=STORE_FILE, key=None, max_idle=MAX_IDLE):
+        from cryptography.fernet import Fernet
+
+        self.path = path
+        self.fernet = Fernet(key or load_key())
+        self.max_idle = max_idle
+
+    def save(self, cookies):
+        """
+        Encrypts and saves the cookies with their expiry time. Saving
+        after every successful request extends the idle limit.
+
+        Parameters:
+            cookies (RequestsCookieJar): Cookies of the session.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        expires = now + self.max_idle
+        for cookie in cookies:
+            if cookie.expires is not None:
+                expires = min(expires, cookie.expires)
+
+        payload = {
+            "saved": now,
+            "expires": expires,
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "secure": cookie.secure,
+                    "expires": cookie.expires,
+                }
+                for cookie in cookies
+            ],
+        }
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(self.fernet.encrypt(json.dumps(payload).encode()))
+        os.replace(temporary, self.path)
+
+    def load(self):
+        """
+        Loads the saved cookies if the session hasn't expired.
+
+        Returns:
+            RequestsCookieJar or None: The cookies, None if there is no
+            valid session.
+        """
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self.path, "rb") as file:
+                payload = json.loads(self.fernet.decrypt(file.read()))
+        except (OSError, ValueError, InvalidToken):
+            return None
+
+        if payload["expires"] <= time.time():
+            return None
+
+        jar = RequestsCookieJar()
+        for item in payload["cookies"]:
+            jar.set_cookie(Cookie(
+                version=0, name=item["name"], value=item["value"],
+                port=None, port_specified=False,
+                domain=item["domain"],
+                domain_specified=bool(item["domain"]),
+                domain_initial_dot=item["domain"].startswith("."),
+                path=item["path"], path_specified=True,
+                secure=item["secure"], expires=item["expires"],
+                discard=item["expires"] is None, comment=None,
+                comment_url=None, rest={},
+            ))
+
+        return jar
+
+    def expires(self):
+        """
+        Returns the expiry time of the saved session.
+
+        Returns:
+            float or None: Seconds since epoch, None if there is no
+            readable session.
+        """
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self.path, "rb") as file:
+                return json.loads(self.fernet.decrypt(file.read()))["expires"]
+        except (OSError, ValueError, KeyError, InvalidToken):
+            return None
+
+    def clear(self):
+        """
+        Removes the saved session, e.g. after the portal rejected it.
+
+        Returns:
+            None
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
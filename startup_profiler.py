@@ -0,0 +1,101 @@
+"""
+Startup time instrumentation and lazy imports for the entry points.
+
+Each entry point imports this module first, marks the end of its imports
+and of its initialization, and reports the durations when it starts
+running. Reports are printed and appended to logs/startup_times.log,
+so cold starts of restarted processes can be compared over time.
+
+The module provides the following functions:
+
+- `lazy_import(name)`: Returns a module that is loaded on first
+attribute access.
+- `mark(label)`: Records the time elapsed since the previous mark.
+- `report(name)`: Prints and logs all recorded durations of the process.
+"""
+
+import importlib.util
+import os
+import sys
+import time
+from datetime import datetime
+
+
+LOG_FILE = "logs/startup_times.log"
+
+_started = time.perf_counter()
+_last = _started
+_marks = []
+
+
+def lazy_import(name):
+    """
+    Returns a module which is executed only when one of its attributes
+    is accessed for the first time. Heavy dependencies imported this way
+    don't slow down the start of processes which don't use them.
+
+    Parameters:
+        name (str): The full name of the module, e.g. "pandas".
+
+    Returns:
+        module: The lazily loaded module.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
+
+
+def mark(label):
+    """
+    Records the time elapsed since the previous mark (or since this module
+    was imported) under the given label.
+
+    Parameters:
+        label (str): The name of the startup phase, e.g. "imports".
+
+    Returns:
+        float: The duration of the phase in seconds.
+    """
+    global _last
+    now = time.perf_counter()
+    duration = now - _last
+    _marks.append((label, duration))
+    _last = now
+
+    return duration
+
+
+def report(name):
+    """
+    Prints all recorded startup phases with the total startup time and
+    appends them to the startup log file.
+
+    Parameters:
+        name (str): The name of the entry point, e.g. "app.py".
+
+    Returns:
+        str: The report line.
+    """
+    phases = ", ".join(
+        f"{label}: {duration:.3f} s" for label, duration in _marks)
+    total = _last - _started
+    line = (f"{datetime.now().replace(microsecond=0)} {name} startup "
+            f"{total:.3f} s ({phases})")
+    print(line)
+
+    try:
+        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+        with open(LOG_FILE, "a") as log:
+            log.write(line + "\n")
+    except OSError:
+        pass
+
+    return line
@@ -0,0 +1,314 @@
+"""
+Supervisor of the project's long-running services.
+
+The supervisor starts every service as its own child process, so it doesn't
+have to scan all processes of the system to find them. Exits are detected
+when the kernel sends SIGCHLD: the handler only sets a flag, and the next
+`poll()` reaps the exited children with os.wait4(), which also returns their
+resource usage (CPU time and peak memory).
+
+An exited service is restarted with exponential backoff: 1 s after the
+first failure, then 2 s, 4 s and so on up to MAX_BACKOFF. A service which
+ran longer than STABLE_AFTER seconds starts counting from the beginning
+again. Restart counts, exit codes and resource usage are kept per service.
+
+On SIGTERM (or SIGINT) the supervisor stops: every service gets SIGTERM,
+and services still running after a grace period are killed.
+
+The module provides the following:
+
+- `Service`: State and statistics of one supervised service.
+- `Supervisor`: Starts, reaps, restarts and stops the services.
+"""
+
+import os
+import signal
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from message_sender import notify
+
+
+BASE_BACKOFF = 1
+MAX_BACKOFF = 300
+STABLE_AFTER = 60
+STOP_TIMEOUT = 10
+
+
+@dataclass
+class Service:
+    """
+    State and statistics of one supervised service.
+
+    Attributes:
+        name (str): The name of the service, e.g. 'app.py'.
+        command (list): The command starting the service.
+        process (subprocess.Popen): The running process, None if stopped.
+        enabled (bool): False if the service was stopped on purpose.
+        started (float): Monotonic time of the last start.
+        next_start (float): Monotonic time of the next allowed start.
+        failures (int): Exits in a row without running STABLE_AFTER seconds.
+        restarts (int): All starts after the first one.
+        runs (int): All starts.
+        last_exit (int): Exit code of the last run, negative for signals.
+        last_exit_time (datetime): Time of the last exit.
+        cpu_time (float): User and system CPU time of finished runs.
+        max_rss (int): The highest peak memory of finished runs, in kB.
+    """
+
+    name: str
+    command: list
+    process: subprocess.Popen = None
+    enabled: bool = True
+    started: float = 0.0
+    next_start: float = 0.0
+    failures: int = 0
+    restarts: int = 0
+    runs: int = 0
+    last_exit: int = None
+    last_exit_time: datetime = None
+    cpu_time: float = 0.0
+    max_rss: int = 0
+
+    @property
+    def running(self):
+        return self.process is not None
+
+    def backoff(self):
+        """
+        Returns the delay before the next start after a failure.
+
+        Returns:
+            float: Seconds.
+        """
+        if self.failures == 0:
+            return 0
+        return min(BASE_BACKOFF * 2 ** (self.failures - 1), MAX_BACKOFF)
+
+
+class Supervisor:
+    """
+    Owns the service processes and keeps them running.
+
+    Parameters:
+        services (dict): Service name: command (list).
+        notify: Optional function called with a message (str) when
+        a service starts or exits.
+    """
+
+    def __init__(self, services, notify=None):
+        self.services = {
+            name: Service(name, command) for name, command in services.items()
+        }
+        self.notify = notify
+        self.child_exited = False
+        self.stopping = False
+
+    def install_signal_handlers(self):
+        """
+        Installs handlers of SIGCHLD (a child exited) and SIGTERM/SIGINT
+        (stop the supervisor). The handlers only set flags, the work is
+        done by poll() and shutdown().
+
+        Returns:
+            None
+        """
+        signal.signal(signal.SIGCHLD, self._on_child_exit)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+    def _on_child_exit(self, signum, frame):
+        self.child_exited = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _message(self, text):
+        notify(f"{datetime.now().replace(microsecond=0)} {text}", self.notify)
+
+    def start(self, name):
+        """
+        Starts a service (and enables it if it was stopped).
+
+        Parameters:
+            name (str): The name of the service.
+
+        Returns:
+            None
+        """
+        service = self.services[name]
+        service.enabled = True
+        if service.running:
+            return
+
+        try:
+            service.process = subprocess.Popen(service.command)
+        except OSError as e:
+            service.failures += 1
+            service.next_start = time.monotonic() + service.backoff()
+            self._message(f"Error starting {name}: {e}")
+            return
+
+        if service.runs:
+            service.restarts += 1
+        service.runs += 1
+        service.started = time.monotonic()
+        self._message(f"{name} has been started.")
+
+    def stop(self, name, timeout=STOP_TIMEOUT):
+        """
+        Stops a service and keeps it stopped until start() is called.
+
+        Parameters:
+            name (str): The name of the service.
+            timeout (float): Seconds to wait before the service is killed.
+
+        Returns:
+            None
+        """
+        service = self.services[name]
+        service.enabled = False
+        self._terminate([service], timeout)
+
+    def reap(self):
+        """
+        Collects the exit status and resource usage of exited services
+        without blocking and schedules their restart.
+
+        Returns:
+            list: Names of the services which exited.
+        """
+        exited = []
+        now = time.monotonic()
+
+        for service in self.services.values():
+            if not service.running:
+                continue
+            try:
+                pid, status, usage = os.wait4(service.process.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid, status, usage = service.process.pid, 0, None
+            if pid == 0:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            service.process.returncode = code
+            service.process = None
+            service.last_exit = code
+            service.last_exit_time = datetime.now().replace(microsecond=0)
+            if usage is not None:
+                service.cpu_time += usage.ru_utime + usage.ru_stime
+                service.max_rss = max(service.max_rss, usage.ru_maxrss)
+
+            if now - service.started >= STABLE_AFTER:
+                service.failures = 1
+            else:
+                service.failures += 1
+            service.next_start = now + service.backoff()
+            exited.append(service.name)
+
+            if service.enabled and not self.stopping:
+                self._message(
+                    f"{service.name} exited with code {code}, restarting "
+                    f"in {service.backoff():.0f} s.")
+
+        return exited
+
+    def poll(self):
+        """
+        Reaps exited services and starts services which are due. Called
+        regularly from the main loop.
+
+        Returns:
+            None
+        """
+        if self.child_exited:
+            self.child_exited = False
+            self.reap()
+
+        now = time.monotonic()
+        for service in self.services.values():
+            if service.enabled and not service.running \
+                    and now >= service.next_start and not self.stopping:
+                self.start(service.name)
+
+    def _terminate(self, services, timeout):
+        """
+        Sends SIGTERM to the services, waits for them and kills those
+        which are still running after the timeout.
+
+        Parameters:
+            services (list): Services to stop.
+            timeout (float): Seconds to wait.
+
+        Returns:
+            None
+        """
+        running = [service for service in services if service.running]
+        for service in running:
+            try:
+                service.process.terminate()
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + timeout
+        while any(service.running for service in running) \
+                and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for service in running:
+            if service.running:
+                service.process.kill()
+        while any(service.running for service in running):
+            self.reap()
+            time.sleep(0.1)
+
+    def shutdown(self, timeout=STOP_TIMEOUT):
+        """
+        Stops all services gracefully.
+
+        Parameters:
+            timeout (float): Seconds to wait before services are killed.
+
+        Returns:
+            None
+        """
+        self.stopping = True
+        self._terminate(list(self.services.values()), timeout)
+
+    def pids(self):
+        """
+        Returns process ids of the services.
+
+        Returns:
+            dict: Service name: pid, None if the service isn't running.
+        """
+        return {
+            name: service.process.pid if service.running else None
+            for name, service in self.services.items()
+        }
+
+    def status(self):
+        """
+        Returns the state and statistics of every service.
+
+        Returns:
+            dict: Service name: dictionary with 'running', 'pid',
+            'restarts', 'failures', 'last_exit', 'last_exit_time',
+            'cpu_time' (s) and 'max_rss' (kB) of finished runs.
+        """
+        return {
+            name: {
+                "running": service.running,
+                "pid": service.process.pid if service.running else None,
+                "restarts": service.restarts,
+                "failures": service.failures,
+                "last_exit": service.last_exit,
+                "last_exit_time": service.last_exit_time,
+                "cpu_time": round(service.cpu_time, 2),
+                "max_rss": service.max_rss,
+            }
+            for name, service in self.services.items()
+        }
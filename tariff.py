@@ -0,0 +1,448 @@
+"""
+Time-of-use tariff and electricity bills.
+
+Tariffs are versioned: every version has the date it is valid from,
+a fixed monthly fee, the net-metering ratio (in the Polish net-metering
+scheme 0.8 kWh of credit for every exported kWh, valid for CREDIT_MONTHS
+months) and time-of-use zones with a rate (PLN per kWh, energy and
+distribution together). A zone applies in its 'hours' ([start, end)
+ranges) on its 'weekdays' (0 is Monday); the zone without hours is used
+otherwise. Versions are read from the JSON file given by the TARIFF_FILE
+environment variable (default tariff.json), as a list of objects like
+`default_tariffs()`. The rates of all versions are expanded into one
+array indexed by version, weekday and hour, so the rate of every hour
+of a range is a single array lookup.
+
+The grid meter (my_power_meter) is read once a day, so hourly import and
+export are estimated: the daily import is split in proportion to the
+heater's consumption not covered by PV plus BASE_LOAD, the daily export
+in proportion to the PV production left over by the heater (both from
+energy_balance_hourly, see energy_balance.py). Days without PV data are
+split evenly over the daylight hours, so the hours always add up to the
+meter.
+
+Materialized tables (keys are seconds since epoch of the naive local
+time, as in rollups.py):
+
+- tariff_daily: imported and exported kWh, import_cost, credit (kWh
+  earned by export), heater kWh and heater_cost of days with a meter
+  reading. Days are closed once the meter was read, so they are computed
+  once; all days are recomputed when the tariff file changes.
+- tariff_monthly: the bill of every month. Credits are used oldest first
+  and valued at the month's average import rate; credits older than
+  CREDIT_MONTHS months expire.
+
+The module provides the following:
+
+- `create_tariff_tables()`: Creates the tables.
+- `default_tariffs()`: The tariff versions used without a tariff file.
+- `load_tariffs(path)`: Reads tariff versions from a JSON file.
+- `rates(times, tariffs)`: Rate of every hour (vectorized).
+- `hourly_costs(start, end)`: Estimated cost and credit of every hour.
+- `refresh(since)`: Computes new closed days and all monthly bills.
+- `fetch_bills(start, end)`: Returns the monthly bills.
+"""
+
+import startup_profiler
+import hashlib
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from data_access import engine, epoch, store_frame
+from pv_forecast import solar_elevation_sine
+
+pd = startup_profiler.lazy_import("pandas")
+np = startup_profiler.lazy_import("numpy")
+
+TARIFF_FILE = os.getenv("TARIFF_FILE", "tariff.json")
+DAY = 86400
+# Consumption of the house without the heater, kWh per hour
+BASE_LOAD = 0.25
+CREDIT_MONTHS = 12
+
+DAILY_COLUMNS = ["imported", "exported", "import_cost", "credit", "heater",
+                 "heater_cost"]
+MONTHLY_COLUMNS = ["imported", "exported", "import_cost", "credit",
+                   "credit_used", "credit_value", "credit_balance", "fixed",
+                   "total", "heater", "heater_cost", "closed"]
+
+
+def default_tariffs():
+    """
+    Returns the tariff versions used when there is no tariff file: G12
+    (cheaper 13-15 and 22-6) with example gross rates.
+
+    Returns:
+        list: Tariff versions (dict), oldest first.
+    """
+    return [
+        {
+            "valid_from": "2023-01-01",
+            "name": "G12",
+            "fixed_monthly": 25.0,
+            "net_metering": 0.8,
+            "zones": [
+                {"name": "off-peak", "rate": 0.60,
+                 "hours": [[0, 6], [13, 15], [22, 24]]},
+                {"name": "peak", "rate": 1.03},
+            ],
+        },
+        {
+            "valid_from": "2024-07-01",
+            "name": "G12",
+            "fixed_monthly": 28.0,
+            "net_metering": 0.8,
+            "zones": [
+                {"name": "off-peak", "rate": 0.68,
+                 "hours": [[0, 6], [13, 15], [22, 24]]},
+                {"name": "peak", "rate": 1.14},
+            ],
+        },
+    ]
+
+
+def load_tariffs(path=TARIFF_FILE):
+    """
+    Reads tariff versions from a JSON file.
+
+    Parameters:
+        path (str): The path of the file.
+
+    Returns:
+        list: Tariff versions sorted by valid_from, default_tariffs() if
+        the file doesn't exist.
+
+    Raises:
+        ValueError: If a version has no valid_from, no zone without hours
+        or an invalid zone.
+    """
+    try:
+        with open(path) as file:
+            tariffs = json.load(file)
+    except FileNotFoundError:
+        tariffs = default_tariffs()
+
+    for tariff in tariffs:
+        if "valid_from" not in tariff:
+            raise ValueError(f"Tariff without valid_from: {tariff}")
+        defaults = [zone for zone in tariff.get("zones", [])
+                    if "hours" not in zone]
+        if len(defaults) != 1:
+            raise ValueError(
+                f"Tariff {tariff['valid_from']} needs one zone without hours")
+        for zone in tariff["zones"]:
+            if "rate" not in zone:
+                raise ValueError(f"Zone without rate: {zone}")
+
+    return sorted(tariffs, key=lambda tariff: tariff["valid_from"])
+
+
+def fingerprint(tariffs):
+    return hashlib.sha256(
+        json.dumps(tariffs, sort_keys=True).encode()).hexdigest()
+
+
+def rate_table(tariffs):
+    """
+    Expands the zones of every version into rates by weekday and hour.
+
+    Parameters:
+        tariffs (list): Tariff versions, oldest first.
+
+    Returns:
+        np.ndarray: Rates of shape (versions, 7, 24).
+    """
+    table = np.zeros((len(tariffs), 7, 24))
+    for version, tariff in enumerate(tariffs):
+        zones = tariff["zones"]
+        default = next(zone for zone in zones if "hours" not in zone)
+        table[version] = default["rate"]
+        for zone in zones:
+            if "hours" not in zone:
+                continue
+            weekdays = zone.get("weekdays", range(7))
+            for start, end in zone["hours"]:
+                for weekday in weekdays:
+                    table[version, weekday, start:end] = zone["rate"]
+
+    return table
+
+
+def versions(times, tariffs):
+    """
+    Returns the index of the version valid at every time, -1 before the
+    first version.
+    """
+    starts = np.array([tariff["valid_from"] for tariff in tariffs],
+                      dtype="datetime64[s]")
+    return np.searchsorted(
+        starts, pd.DatetimeIndex(times).to_numpy(dtype="datetime64[s]"),
+        side="right") - 1
+
+
+def rates(times, tariffs):
+    """
+    Returns the rate of every hour.
+
+    Parameters:
+        times: Naive local starts of hours (array-like of datetimes).
+        tariffs (list): Tariff versions, oldest first.
+
+    Returns:
+        np.ndarray: PLN per kWh, NaN before the first version.
+    """
+    times = pd.DatetimeIndex(times)
+    table = rate_table(tariffs)
+    version = versions(times, tariffs)
+    result = table[version.clip(min=0), times.weekday.to_numpy(),
+                   times.hour.to_numpy()]
+    return np.where(version >= 0, result, np.nan)
+
+
+def hourly_costs(start, end, tariffs=None):
+    """
+    Estimates import, export, cost and credit of every hour of the days
+    with a meter reading.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+        tariffs (list): Tariff versions, load_tariffs() if None.
+
+    Returns:
+        pd.DataFrame: Columns 'time', 'rate', 'imported', 'exported',
+        'import_cost', 'credit' (kWh), 'heater' and 'heater_cost'.
+    """
+    tariffs = tariffs or load_tariffs()
+    with engine.connect() as connection:
+        frame = pd.read_sql(
+            text(
+                "SELECT h.hour, h.pv, h.heater, h.heater_from_pv, "
+                "d.imported AS day_imported, d.exported AS day_exported "
+                "FROM energy_balance_hourly h "
+                f"JOIN energy_balance_daily d ON d.day = h.hour / {DAY} * {DAY} "
+                "WHERE h.hour >= :start AND h.hour < :end "
+                "AND d.imported IS NOT NULL ORDER BY h.hour"
+            ),
+            connection,
+            params={"start": epoch(start), "end": epoch(end)},
+        )
+    frame.insert(0, "time", pd.to_datetime(frame.pop("hour"), unit="s"))
+    frame = frame.fillna({"pv": 0, "heater": 0, "heater_from_pv": 0})
+    day = frame["time"].dt.floor("D")
+
+    import_weight = frame["heater"] - frame["heater_from_pv"] + BASE_LOAD
+    export_weight = frame["pv"] - frame["heater_from_pv"]
+    # Days without weights (e.g. no PV data) are split evenly over the
+    # daylight hours, or over the whole day
+    daylight = pd.Series(solar_elevation_sine(
+        frame["time"] + pd.Timedelta(minutes=30)) > 0,
+        index=frame.index).astype(float)
+    for column, weight in (("imported", import_weight),
+                           ("exported", export_weight)):
+        for fallback in (daylight, 1.0):
+            total = weight.groupby(day).transform("sum")
+            weight = weight.where(total > 0, fallback)
+        total = weight.groupby(day).transform("sum")
+        frame[column] = frame[f"day_{column}"].fillna(0) * weight / total
+
+    ratios = np.array([tariff.get("net_metering", 0.0)
+                       for tariff in tariffs])
+    version = versions(frame["time"], tariffs)
+    frame["rate"] = rates(frame["time"], tariffs)
+    frame["import_cost"] = frame["imported"] * frame["rate"]
+    frame["credit"] = frame["exported"] * np.where(
+        version >= 0, ratios[version.clip(min=0)], 0.0)
+    frame["heater_cost"] = frame["heater"] * frame["rate"]
+
+    return frame[["time", "rate", "imported", "exported", "import_cost",
+                  "credit", "heater", "heater_cost"]]
+
+
+def create_tariff_tables():
+    """
+    Creates the daily and monthly tables and the state table holding
+    the fingerprint of the tariffs the days were computed with.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS tariff_daily ("
+                "day INTEGER PRIMARY KEY, "
+                + ", ".join(f"{column} REAL" for column in DAILY_COLUMNS)
+                + ")"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS tariff_monthly ("
+                "month INTEGER PRIMARY KEY, "
+                + ", ".join(f"{column} REAL" for column in MONTHLY_COLUMNS)
+                + ")"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS tariff_state ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                "fingerprint TEXT)"
+            )
+        )
+
+
+def settle(months, tariffs):
+    """
+    Computes monthly bills: credits are used oldest first, expire after
+    CREDIT_MONTHS months and are valued at the month's average import
+    rate.
+
+    Parameters:
+        months (pd.DataFrame): Monthly sums with 'month' (datetime),
+        'imported', 'import_cost' and 'credit', oldest first.
+        tariffs (list): Tariff versions, oldest first.
+
+    Returns:
+        pd.DataFrame: The months with credit_used, credit_value,
+        credit_balance, fixed and total. Costs and the total are NaN
+        before the first tariff version.
+    """
+    fees = np.array([tariff.get("fixed_monthly", 0.0) for tariff in tariffs])
+    version = versions(months["month"], tariffs)
+    # [calendar month index, unused credit] of the last CREDIT_MONTHS
+    # months, so months missing from the data still count
+    credits = deque()
+    used, values, balances = [], [], []
+    for row in months.itertuples():
+        index = row.month.year * 12 + row.month.month - 1
+        while credits and credits[0][0] <= index - CREDIT_MONTHS:
+            credits.popleft()
+        need = row.imported
+        for credit in credits:
+            take = min(credit[1], need)
+            credit[1] -= take
+            need -= take
+        credits.append([index, row.credit])
+        month_used = row.imported - need
+        used.append(month_used)
+        values.append(month_used * row.import_cost / row.imported
+                      if row.imported else 0.0)
+        balances.append(sum(credit[1] for credit in credits))
+
+    months = months.assign(credit_used=used, credit_value=values,
+                           credit_balance=balances)
+    # Months before the first version have no bill
+    tariffed = version >= 0
+    for column in ("import_cost", "credit_value", "heater_cost"):
+        months[column] = months[column].where(tariffed)
+    months["fixed"] = np.where(tariffed, fees[version.clip(min=0)], np.nan)
+    months["total"] = months["import_cost"] - months["credit_value"] \
+        + months["fixed"]
+
+    return months
+
+
+def refresh(since=None):
+    """
+    Computes the days with a meter reading which aren't cached yet (or
+    all of them from 'since', or after a tariff change) and settles all
+    months again.
+
+    Parameters:
+        since (datetime): Recompute the days from this day.
+
+    Returns:
+        None
+    """
+    create_tariff_tables()
+    tariffs = load_tariffs()
+    current = fingerprint(tariffs)
+
+    with engine.begin() as connection:
+        stored = connection.execute(
+            text("SELECT fingerprint FROM tariff_state")).scalar()
+        if stored != current:
+            connection.execute(text("DELETE FROM tariff_daily"))
+            since = None
+        elif since is not None:
+            connection.execute(
+                text("DELETE FROM tariff_daily WHERE day >= :start"),
+                {"start": epoch(since)},
+            )
+        # Days with a meter reading which aren't cached yet
+        missing = connection.execute(
+            text(
+                "SELECT MIN(day), MAX(day) FROM energy_balance_daily "
+                "WHERE imported IS NOT NULL "
+                "AND day NOT IN (SELECT day FROM tariff_daily)"
+            )
+        ).one()
+
+    if missing[0] is not None:
+        start = datetime(1970, 1, 1) + timedelta(seconds=missing[0])
+        end = datetime(1970, 1, 1) + timedelta(seconds=missing[1] + DAY)
+        hourly = hourly_costs(start, end, tariffs)
+        # Costs stay NULL before the first tariff version
+        daily = hourly.groupby(hourly["time"].dt.floor("D"))[
+            DAILY_COLUMNS].sum(min_count=1).reset_index()
+        daily["day"] = (daily["time"] - pd.Timestamp(1970, 1, 1)) \
+            // pd.Timedelta(seconds=1)
+        with engine.begin() as connection:
+            store_frame(connection, "tariff_daily", daily,
+                        ["day"] + DAILY_COLUMNS)
+
+    with engine.begin() as connection:
+        month = "strftime('%s', day, 'unixepoch', 'start of month') + 0"
+        months = pd.read_sql(
+            text(
+                f"SELECT {month} AS month, COUNT(*) AS days, "
+                + ", ".join(f"SUM({column}) AS {column}"
+                            for column in DAILY_COLUMNS)
+                + " FROM tariff_daily GROUP BY 1 ORDER BY 1"
+            ),
+            connection,
+        )
+        months["month"] = pd.to_datetime(months["month"], unit="s")
+        months["closed"] = (
+            months["days"] == months["month"].dt.days_in_month).astype(float)
+        bills = settle(months, tariffs)
+        bills["month"] = (bills["month"] - pd.Timestamp(1970, 1, 1)) \
+            // pd.Timedelta(seconds=1)
+        connection.execute(text("DELETE FROM tariff_monthly"))
+        store_frame(connection, "tariff_monthly", bills,
+                    ["month"] + MONTHLY_COLUMNS)
+        connection.execute(
+            text("INSERT OR REPLACE INTO tariff_state (id, fingerprint) "
+                 "VALUES (1, :fingerprint)"),
+            {"fingerprint": current},
+        )
+
+
+def fetch_bills(start, end):
+    """
+    Returns the monthly bills in a range.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        pd.DataFrame: Column 'time' (datetime) and MONTHLY_COLUMNS.
+    """
+    create_tariff_tables()
+    with engine.connect() as connection:
+        frame = pd.read_sql(
+            text(
+                "SELECT * FROM tariff_monthly "
+                "WHERE month >= :start AND month < :end ORDER BY month"
+            ),
+            connection,
+            params={"start": epoch(start), "end": epoch(end)},
+        )
+    frame.insert(0, "time", pd.to_datetime(frame.pop("month"), unit="s"))
+
+    return frame
@@ -0,0 +1,351 @@
+"""
+Telemetry of the host and the services running on it.
+
+house_energy.py calls `TelemetryCollector.collect()` every minute. Every
+sample is stored in the telemetry_samples table as (time, source, metric,
+value) rows, where the source is 'host' or the name of a service
+(e.g. 'app.py'):
+
+- host: CPU usage, used memory, load average, MB written to the disk
+  holding the database, free disk space, database file size and
+  temperature
+- services: CPU usage, resident memory (RSS) and MB written
+
+Samples are aggregated into hourly means and maximums in the
+telemetry_hourly table. Raw samples are kept for RAW_RETENTION days and
+hourly rows for HOURLY_RETENTION days, so the tables stay small.
+Both tables are WITHOUT ROWID tables clustered by source, metric and time.
+
+Times are stored as seconds since epoch of the naive local time, the same
+way as in rollups.py.
+
+The module provides the following:
+
+- `create_telemetry_tables()`: Creates the sample and hourly tables.
+- `TelemetryCollector`: Samples host and service metrics.
+- `refresh_hourly()`: Aggregates new samples into hourly rows and removes
+old rows.
+- `fetch(metric, start, end)`: Returns a metric of every source in a range.
+"""
+
+import os
+from datetime import datetime, timedelta
+import psutil
+from sqlalchemy import text
+from data_access import engine, epoch
+
+
+DATABASE_FILE = "electricity.db"
+RAW_RETENTION = 7
+HOURLY_RETENTION = 365
+# Longer ranges are read from hourly rows
+RAW_RANGE = timedelta(days=2)
+
+# Metric name: label shown in the dashboard
+METRICS = {
+    "cpu_percent": "CPU usage [%]",
+    "memory_mb": "Memory [MB]",
+    "write_mb": "Disk writes [MB per sample]",
+    "load_1m": "Load average (1 min)",
+    "disk_free_mb": "Free disk space [MB]",
+    "db_size_mb": "Database size [MB]",
+    "temperature_c": "Temperature [°C]",
+}
+MB = 2 ** 20
+
+
+def create_telemetry_tables():
+    """
+    Creates the telemetry_samples and telemetry_hourly tables.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS telemetry_samples ("
+                "source TEXT NOT NULL, "
+                "metric TEXT NOT NULL, "
+                "time INTEGER NOT NULL, "
+                "value REAL NOT NULL, "
+                "PRIMARY KEY (source, metric, time)) WITHOUT ROWID"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS telemetry_hourly ("
+                "source TEXT NOT NULL, "
+                "metric TEXT NOT NULL, "
+                "hour INTEGER NOT NULL, "
+                "mean REAL NOT NULL, "
+                "maximum REAL NOT NULL, "
+                "samples INTEGER NOT NULL, "
+                "PRIMARY KEY (source, metric, hour)) WITHOUT ROWID"
+            )
+        )
+
+
+def block_device(path):
+    """
+    Returns the name of the disk partition holding a file, as used by
+    psutil.disk_io_counters(perdisk=True), e.g. 'mmcblk0p2'.
+
+    Parameters:
+        path (str): The path of the file.
+
+    Returns:
+        str or None: The partition name, None if it can't be found.
+    """
+    try:
+        device = os.stat(path).st_dev
+        uevent = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}/uevent"
+        with open(uevent) as file:
+            for line in file:
+                if line.startswith("DEVNAME="):
+                    return line.strip().split("=", 1)[1]
+    except OSError:
+        pass
+    return None
+
+
+def read_temperature():
+    """
+    Returns the CPU temperature.
+
+    Returns:
+        float or None: Degrees Celsius, None if there is no sensor.
+    """
+    sensors = getattr(psutil, "sensors_temperatures", lambda: {})()
+    for name in ("cpu_thermal", "coretemp", "k10temp"):
+        if sensors.get(name):
+            return sensors[name][0].current
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp") as file:
+            return int(file.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+class TelemetryCollector:
+    """
+    Samples host and service metrics. CPU usage and written bytes are
+    computed since the previous sample, so the collector keeps
+    the psutil objects and counters between calls.
+
+    Parameters:
+        services: Function returning a dictionary of service name: pid
+        (or None when the service isn't running).
+        database_file (str): The path of the database file.
+    """
+
+    def __init__(self, services, database_file=DATABASE_FILE):
+        self.services = services
+        self.database_file = database_file
+        self.device = block_device(database_file)
+        self.processes = {}
+        self.written = {}
+        psutil.cpu_percent(None)
+
+    def _disk_written(self):
+        if self.device is not None:
+            counters = psutil.disk_io_counters(perdisk=True).get(self.device)
+            if counters is not None:
+                return counters.write_bytes
+        counters = psutil.disk_io_counters()
+        return counters.write_bytes if counters else None
+
+    def _delta(self, key, value):
+        """
+        Returns the increase of a counter since the previous sample.
+
+        Parameters:
+            key: The counter identifier.
+            value (int): The current value of the counter.
+
+        Returns:
+            float or None: The increase in MB, None for the first sample.
+        """
+        previous = self.written.get(key)
+        self.written[key] = value
+        if previous is None or value is None or value < previous:
+            return None
+        return (value - previous) / MB
+
+    def sample_host(self):
+        """
+        Samples host metrics.
+
+        Returns:
+            dict: Metric name: value.
+        """
+        values = {
+            "cpu_percent": psutil.cpu_percent(None),
+            "memory_mb": (psutil.virtual_memory().total
+                          - psutil.virtual_memory().available) / MB,
+            "load_1m": os.getloadavg()[0],
+            "write_mb": self._delta("host", self._disk_written()),
+            "temperature_c": read_temperature(),
+        }
+        try:
+            values["disk_free_mb"] = psutil.disk_usage(
+                os.path.dirname(os.path.abspath(self.database_file))).free / MB
+            values["db_size_mb"] = sum(
+                os.path.getsize(self.database_file + suffix)
+                for suffix in ("", "-wal")
+                if os.path.exists(self.database_file + suffix)
+            ) / MB
+        except OSError:
+            pass
+
+        return values
+
+    def sample_service(self, name, pid):
+        """
+        Samples metrics of one service process.
+
+        Parameters:
+            name (str): The name of the service.
+            pid (int): The process id.
+
+        Returns:
+            dict: Metric name: value, empty if the process is gone.
+        """
+        process = self.processes.get(name)
+        if process is None or process.pid != pid:
+            process = self.processes[name] = psutil.Process(pid)
+            self.written.pop(name, None)
+            # The first call only starts measuring CPU time
+            process.cpu_percent(None)
+
+        try:
+            with process.oneshot():
+                values = {
+                    "cpu_percent": process.cpu_percent(None),
+                    "memory_mb": process.memory_info().rss / MB,
+                }
+                io = getattr(process, "io_counters", None)
+                written = io().write_bytes if io else None
+        except psutil.Error:
+            self.processes.pop(name, None)
+            return {}
+
+        values["write_mb"] = self._delta(name, written)
+        return values
+
+    def collect(self, now=None):
+        """
+        Samples all metrics and stores them in one transaction.
+
+        Parameters:
+            now (datetime): Time of the sample, now if None.
+
+        Returns:
+            int: The number of stored values.
+        """
+        moment = int(epoch(now or datetime.now().replace(microsecond=0)))
+        samples = {"host": self.sample_host()}
+        for name, pid in self.services().items():
+            if pid is not None:
+                try:
+                    samples[name] = self.sample_service(name, pid)
+                except psutil.Error:
+                    samples[name] = {}
+
+        rows = [
+            {"source": source, "metric": metric, "time": moment,
+             "value": value}
+            for source, values in samples.items()
+            for metric, value in values.items()
+            if value is not None
+        ]
+        if rows:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        "INSERT OR REPLACE INTO telemetry_samples "
+                        "(source, metric, time, value) "
+                        "VALUES (:source, :metric, :time, :value)"
+                    ),
+                    rows,
+                )
+
+        return len(rows)
+
+
+def refresh_hourly(now=None):
+    """
+    Aggregates samples into hourly rows, starting with the last stored
+    hour (it may have been incomplete), and removes samples and hourly
+    rows older than their retention.
+
+    Parameters:
+        now (datetime): The current time, now if None.
+
+    Returns:
+        None
+    """
+    now = epoch(now or datetime.now())
+
+    with engine.begin() as connection:
+        start = connection.execute(
+            text("SELECT MAX(hour) FROM telemetry_hourly")
+        ).scalar() or 0
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO telemetry_hourly "
+                "(source, metric, hour, mean, maximum, samples) "
+                "SELECT source, metric, time / 3600 * 3600, AVG(value), "
+                "MAX(value), COUNT(*) FROM telemetry_samples "
+                "WHERE time >= :start GROUP BY source, metric, time / 3600"
+            ),
+            {"start": start},
+        )
+        connection.execute(
+            text("DELETE FROM telemetry_samples WHERE time < :limit"),
+            {"limit": now - RAW_RETENTION * 86400},
+        )
+        connection.execute(
+            text("DELETE FROM telemetry_hourly WHERE hour < :limit"),
+            {"limit": now - HOURLY_RETENTION * 86400},
+        )
+
+
+def fetch(metric, start, end):
+    """
+    Returns values of a metric of every source in a range: raw samples
+    for ranges up to RAW_RANGE, hourly means for longer ones.
+
+    Parameters:
+        metric (str): The name of the metric, a key of METRICS.
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        dict: Source name: list of (time (datetime), value (float)) tuples.
+    """
+    if end - start <= RAW_RANGE:
+        query = (
+            "SELECT source, time, value FROM telemetry_samples "
+            "WHERE metric = :metric AND time >= :start AND time < :end "
+            "ORDER BY source, time"
+        )
+    else:
+        query = (
+            "SELECT source, hour, mean FROM telemetry_hourly "
+            "WHERE metric = :metric AND hour >= :start AND hour < :end "
+            "ORDER BY source, hour"
+        )
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(query),
+            {"metric": metric, "start": epoch(start), "end": epoch(end)},
+        ).all()
+
+    series = {}
+    for source, moment, value in rows:
+        series.setdefault(source, []).append(
+            (datetime(1970, 1, 1) + timedelta(seconds=moment), value))
+
+    return series
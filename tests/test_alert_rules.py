@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from alert_rules import Rule, Staleness, WindowAggregate
+
+
+def samples(start, end, step=10):
+    moment = start
+    while moment < end:
+        yield moment
+        moment += timedelta(seconds=step)
+
+
+def test_rule_is_abstract():
+    with pytest.raises(TypeError):
+        Rule("rule", "series")
+
+
+def test_window_waits_for_whole_window_every_day():
+    rule = WindowAggregate("pv_low_noon", "live_production", hours=[11, 14],
+                           window=3600, below=300, clear=100)
+    day = datetime(2026, 6, 1)
+    events = []
+    for offset in (0, 1):
+        start = day + timedelta(days=offset, hours=11)
+        for moment in samples(start, start + timedelta(hours=3)):
+            event = rule.update(moment, 1000 if offset == 0 else 50)
+            if event:
+                events.append((moment, event))
+        assert rule.update(start + timedelta(hours=3), 50) in (None,
+                                                               "cleared")
+
+    # Day 1 is fine; day 2 fires only after a whole window of low values
+    assert events == [(day + timedelta(days=1, hours=12), "fired")]
+
+
+def test_staleness_starts_over_every_day():
+    rule = Staleness("pv_stale", "live_production", hours=[9, 17],
+                     max_age=900)
+    day = datetime(2026, 6, 1)
+    for moment in samples(day + timedelta(hours=9),
+                          day + timedelta(hours=17), 60):
+        assert rule.update(moment, 500) is None
+    rule.update(day + timedelta(hours=17), None)
+
+    # No PV value in the first cycles of the next day
+    start = day + timedelta(days=1, hours=9)
+    assert rule.update(start, None) is None
+    assert rule.observed == 0
+    assert rule.update(start + timedelta(seconds=900), None) is None
+    assert rule.update(start + timedelta(seconds=960), None) == "fired"
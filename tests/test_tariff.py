@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+import tariff
+from data_access import epoch
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'electricity.db'}")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE energy_balance_hourly (hour INTEGER PRIMARY KEY, "
+            "pv REAL, heater REAL, heater_from_pv REAL)"))
+        connection.execute(text(
+            "CREATE TABLE energy_balance_daily (day INTEGER PRIMARY KEY, "
+            "imported REAL, exported REAL)"))
+    monkeypatch.setattr(tariff, "engine", engine)
+    return engine
+
+
+def add_day(engine, day, pv, imported, exported):
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO energy_balance_daily VALUES (:day, :imported, "
+                 ":exported)"),
+            {"day": epoch(day), "imported": imported, "exported": exported})
+        connection.execute(
+            text("INSERT INTO energy_balance_hourly VALUES (:hour, :pv, 0, "
+                 "0)"),
+            [{"hour": epoch(day) + hour * 3600, "pv": pv(hour)}
+             for hour in range(24)])
+
+
+def test_hours_add_up_to_the_meter(database):
+    add_day(database, datetime(2023, 6, 13), lambda hour: 1.0 * (
+        8 <= hour < 18), 10.0, 40.0)
+    # PV data is missing, but the meter recorded export
+    add_day(database, datetime(2023, 6, 14), lambda hour: None, 12.0, 45.8)
+
+    hourly = tariff.hourly_costs(datetime(2023, 6, 13),
+                                 datetime(2023, 6, 15))
+    daily = hourly.groupby(hourly["time"].dt.day)[
+        ["imported", "exported"]].sum()
+
+    assert daily.loc[13].tolist() == pytest.approx([10.0, 40.0])
+    assert daily.loc[14].tolist() == pytest.approx([12.0, 45.8])
+    day = hourly[hourly["time"].dt.day == 14]
+    exported = day.set_index(day["time"].dt.hour)["exported"]
+    assert exported[0] == 0
+    assert exported[12] > 0
+    assert exported[12] == pytest.approx(exported[13])
+
+
+def test_credits_expire_by_calendar_month():
+    # No data from February to December 2022
+    months = pd.DataFrame({
+        "month": pd.to_datetime(["2022-01-01", "2023-01-01", "2023-02-01"]),
+        "imported": [0.0, 5.0, 5.0],
+        "import_cost": [0.0, 5.0, 5.0],
+        "heater_cost": [0.0, 0.0, 0.0],
+        "credit": [10.0, 0.0, 0.0],
+    })
+
+    settled = tariff.settle(months, tariff.default_tariffs())
+
+    assert settled["credit_used"].tolist() == [0.0, 0.0, 0.0]
+    assert settled["credit_balance"].tolist() == [10.0, 0.0, 0.0]
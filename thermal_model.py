@@ -0,0 +1,361 @@
+"""
+Thermal model of the rooms and heating degree-days.
+
+Room temperatures (tuya_data) and the outside temperature (weather_data)
+are averaged in STEP second buckets in SQLite and analysed in one
+vectorized pass per chunk of days. For every room and pair of consecutive
+buckets, the temperature change (K/h) is related to the difference
+between the room and the outside (Newton's law of cooling):
+
+- loss rate (1/h): fitted by least squares through the origin while the
+  room cools, change = -loss_rate * difference. A room losing 0.05 of its
+  difference to the outside per hour cools from 21 °C to about 16 °C in
+  5 hours at 0 °C outside.
+- heat-up rate (K/h): the mean warming of the room while it warms,
+  corrected for the loss at the same time.
+
+The thermostats switch the heaters of single rooms, and some heater is on
+almost all the time in winter, so the whole house smart meter can't tell
+when a room is heated. A room counts as heated while it warms and as not
+heated while it cools; buckets where the direction changes are skipped.
+
+Only the sums of the fits are stored per day, and the rates are fitted
+over the WINDOW_DAYS days up to each day, so a single day with few
+heater-off hours doesn't decide the trend.
+
+Heating degree-days follow Eurostat: 18 °C minus the mean outside
+temperature of the day, if that is 15 °C or less. The heater's energy per
+degree-day is the efficiency trend of the whole house.
+
+The energy of a room is estimated: the heater's daily energy (from
+heater_energy_hourly, see energy_counter.py) is split by the rooms'
+losses, loss_rate * difference summed over the day. This assumes similar
+heat capacities of the rooms.
+
+Materialized tables (days are seconds since epoch of the naive local
+time, as in rollups.py):
+
+- thermal_rooms_daily: day, room, temperature (mean), the fit sums,
+  loss_rate, heat_up_rate and energy (kWh).
+- thermal_daily: day, outside (mean), degree_days, heater (kWh) and
+  intensity (kWh per degree-day).
+
+`refresh()` recomputes the last two days, the first run the whole history.
+
+The module provides the following:
+
+- `create_thermal_tables()`: Creates the tables.
+- `refresh(since)`: Recomputes the tables from 'since' (incrementally by
+default).
+- `fetch_rooms(start, end)`: Returns the daily rows of the rooms.
+- `fetch_house(start, end)`: Returns the daily degree-days and intensity.
+"""
+
+import startup_profiler
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from data_access import bucketed_means, engine, epoch, store_frame
+
+pd = startup_profiler.lazy_import("pandas")
+np = startup_profiler.lazy_import("numpy")
+
+ROOMS = ["bathroom_upper", "bathroom_lower", "first_bedroom",
+         "second_bedroom", "third_bedroom"]
+DAY = 86400
+# Bucket of the temperatures in seconds, shorter than a thermostat cycle
+STEP = 600
+CHUNK_DAYS = 31
+# Days the rates are fitted over
+WINDOW_DAYS = 14
+# Smallest room and outside difference (K) used in the fits
+MIN_DIFFERENCE = 2.0
+# Fewer buckets of outside temperature in a day give no degree-days
+MIN_BUCKETS = 108
+HDD_BASE = 18.0
+HDD_THRESHOLD = 15.0
+
+SUMS = ["loss_xx", "loss_xy", "loss_hours", "heat_rate", "heat_difference",
+        "heat_hours", "difference_hours"]
+ROOM_COLUMNS = ["temperature"] + SUMS + ["loss_rate", "heat_up_rate",
+                                         "energy"]
+HOUSE_COLUMNS = ["outside", "degree_days", "heater", "intensity"]
+
+
+def create_thermal_tables():
+    """
+    Creates the daily tables of the rooms and of the house.
+
+    Returns:
+        None
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS thermal_rooms_daily ("
+                "day INTEGER NOT NULL, "
+                "room TEXT NOT NULL, "
+                + ", ".join(f"{column} REAL" for column in ROOM_COLUMNS)
+                + ", PRIMARY KEY (day, room)) WITHOUT ROWID"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS thermal_daily ("
+                "day INTEGER PRIMARY KEY, "
+                + ", ".join(f"{column} REAL" for column in HOUSE_COLUMNS)
+                + ")"
+            )
+        )
+
+
+def degree_days(outside):
+    """
+    Returns Eurostat heating degree-days of mean daily temperatures.
+
+    Parameters:
+        outside: Mean outside temperatures of days (°C).
+
+    Returns:
+        Degree-days, 0 on days warmer than HDD_THRESHOLD.
+    """
+    return np.where(outside <= HDD_THRESHOLD, HDD_BASE - outside, 0.0)
+
+
+def _samples(start, end):
+    """
+    Returns STEP second means of the room and outside temperatures, one
+    row per bucket of the range.
+    """
+    buckets = pd.DataFrame(
+        {"time": pd.date_range(start, end, freq=f"{STEP}s",
+                               inclusive="left")})
+    rooms = pd.DataFrame(bucketed_means("tuya_data", ROOMS, start, end, STEP),
+                         columns=["time"] + ROOMS)
+    outside = pd.DataFrame(
+        bucketed_means("weather_data", ["weather_temperature"], start, end,
+                       STEP),
+        columns=["time", "outside"])
+
+    return buckets.merge(rooms, on="time", how="left") \
+        .merge(outside, on="time", how="left")
+
+
+def _sums(samples):
+    """
+    Computes the daily fit sums and mean temperatures of every room.
+
+    Parameters:
+        samples (pd.DataFrame): Output of _samples, including the bucket
+        after the last day.
+
+    Returns:
+        pd.DataFrame: Columns day, room, temperature and SUMS (durations
+        in hours).
+    """
+    day = samples["time"].dt.floor("D")
+    hours = STEP / 3600
+    frames = []
+    for room in ROOMS:
+        temperature = samples[room]
+        change = (temperature.shift(-1) - temperature) / hours
+        before = change.shift(1)
+        difference = (temperature + temperature.shift(-1)) / 2 \
+            - samples["outside"]
+        valid = change.notna() & difference.notna() \
+            & (difference >= MIN_DIFFERENCE)
+        loss = valid & (change < 0) & (before < 0)
+        heat = valid & (change > 0) & (before > 0)
+        frame = pd.DataFrame({
+            "day": day,
+            "temperature": temperature,
+            "loss_xx": (difference ** 2).where(loss, 0),
+            "loss_xy": (-change * difference).where(loss, 0),
+            "loss_hours": loss * hours,
+            "heat_rate": change.where(heat, 0),
+            "heat_difference": difference.where(heat, 0),
+            "heat_hours": heat * hours,
+            "difference_hours": difference.clip(lower=0).fillna(0) * hours,
+        })
+        frame = frame.groupby("day").agg(
+            {"temperature": "mean", **{column: "sum" for column in SUMS}})
+        frame["room"] = room
+        frames.append(frame.reset_index())
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def _rates(rooms, heater):
+    """
+    Fits the rates of every room over WINDOW_DAYS days and splits the
+    heater's daily energy between the rooms.
+
+    Parameters:
+        rooms (pd.DataFrame): Daily rows of the rooms with the SUMS,
+        including WINDOW_DAYS - 1 days before the computed ones.
+        heater (pd.Series): The heater's energy per day.
+
+    Returns:
+        pd.DataFrame: The rows with loss_rate, heat_up_rate and energy.
+    """
+    hours = STEP / 3600
+    rooms = rooms.sort_values(["room", "day"]).reset_index(drop=True)
+    window = rooms.set_index("day").groupby("room")[SUMS].rolling(
+        f"{WINDOW_DAYS}D").sum().reset_index(drop=True)
+
+    loss_rate = window["loss_xy"] / window["loss_xx"].where(
+        window["loss_xx"] > 0)
+    rooms["loss_rate"] = loss_rate.clip(lower=0)
+    rooms["heat_up_rate"] = (
+        (window["heat_rate"] + rooms["loss_rate"] * window["heat_difference"])
+        / (window["heat_hours"] / hours).where(window["heat_hours"] > 0))
+
+    losses = rooms["loss_rate"] * rooms["difference_hours"]
+    share = losses / losses.groupby(rooms["day"]).transform("sum").where(
+        lambda total: total > 0)
+    rooms["energy"] = share * rooms["day"].map(heater)
+
+    return rooms
+
+
+def _compute(connection, start, end):
+    """
+    Computes and stores the days of a range.
+
+    Parameters:
+        connection: Open database connection.
+        start (datetime): Midnight of the first day.
+        end (datetime): Midnight after the last day.
+
+    Returns:
+        None
+    """
+    samples = _samples(start, end + timedelta(seconds=STEP))
+    rooms = _sums(samples)
+    rooms = rooms[rooms["day"] < end]
+
+    samples = samples[samples["time"] < end]
+    house = samples.groupby(samples["time"].dt.floor("D")).agg(
+        outside=("outside", "mean"), buckets=("outside", "count"))
+    house.index.name = "day"
+    heater = pd.read_sql(
+        text(
+            f"SELECT hour / {DAY} * {DAY} AS day, SUM(energy) AS heater "
+            f"FROM heater_energy_hourly "
+            f"WHERE hour >= :start AND hour < :end GROUP BY 1"
+        ),
+        connection,
+        params={"start": epoch(start), "end": epoch(end)},
+    )
+    heater = heater.set_index(pd.to_datetime(heater["day"], unit="s"))
+    house["heater"] = heater["heater"].reindex(house.index)
+    house["outside"] = house["outside"].where(
+        house["buckets"] >= MIN_BUCKETS)
+    house["degree_days"] = pd.Series(
+        degree_days(house["outside"]), index=house.index).where(
+        house["outside"].notna())
+    house["intensity"] = house["heater"] / house["degree_days"].where(
+        house["degree_days"] > 0)
+    house = house.reset_index()
+
+    previous = pd.read_sql(
+        text(
+            f"SELECT day, room, temperature, {', '.join(SUMS)} "
+            f"FROM thermal_rooms_daily WHERE day >= :first AND day < :start"
+        ),
+        connection,
+        params={"first": epoch(start) - (WINDOW_DAYS - 1) * DAY,
+                "start": epoch(start)},
+    )
+    previous["day"] = pd.to_datetime(previous["day"], unit="s")
+    if len(previous):
+        rooms = pd.concat([previous, rooms], ignore_index=True)
+    rooms = _rates(rooms, house.set_index("day")["heater"])
+    rooms = rooms[rooms["day"] >= start]
+
+    for frame in (rooms, house):
+        frame["day"] = (frame["day"] - pd.Timestamp(1970, 1, 1)) \
+            // pd.Timedelta(seconds=1)
+    store_frame(connection, "thermal_rooms_daily", rooms,
+                ["day", "room"] + ROOM_COLUMNS)
+    store_frame(connection, "thermal_daily", house, ["day"] + HOUSE_COLUMNS)
+
+
+def refresh(since=None, now=None):
+    """
+    Recomputes the tables from the day of 'since' to today, in chunks of
+    CHUNK_DAYS days.
+
+    Parameters:
+        since (datetime): Start of the recomputed range. If None, the
+        refresh starts the day before the last computed day or, on the
+        first run, covers the whole history.
+        now (datetime): The current time, now if None.
+
+    Returns:
+        None
+    """
+    create_thermal_tables()
+    now = now or datetime.now()
+
+    with engine.connect() as connection:
+        if since is None:
+            last = connection.execute(
+                text("SELECT MAX(day) FROM thermal_daily")).scalar()
+            if last is not None:
+                since = datetime(1970, 1, 1) + timedelta(seconds=last - DAY)
+            else:
+                first = connection.execute(
+                    text("SELECT MIN(date) FROM tuya_data")).scalar()
+                since = datetime.fromisoformat(first) if first else now
+
+    start = datetime.combine(since.date(), datetime.min.time())
+    end = datetime.combine(now.date(), datetime.min.time()) \
+        + timedelta(days=1)
+
+    while start < end:
+        chunk_end = min(start + timedelta(days=CHUNK_DAYS), end)
+        with engine.begin() as connection:
+            _compute(connection, start, chunk_end)
+        start = chunk_end
+
+
+def _fetch(table, start, end):
+    create_thermal_tables()
+    with engine.connect() as connection:
+        frame = pd.read_sql(
+            text(f"SELECT * FROM {table} "
+                 f"WHERE day >= :start AND day < :end ORDER BY day"),
+            connection,
+            params={"start": epoch(start), "end": epoch(end)},
+        )
+    frame.insert(0, "time", pd.to_datetime(frame.pop("day"), unit="s"))
+
+    return frame
+
+
+def fetch_rooms(start, end):
+    """
+    Returns the daily rows of the rooms in a range.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        pd.DataFrame: Columns 'time' (datetime), 'room' and ROOM_COLUMNS.
+    """
+    return _fetch("thermal_rooms_daily", start, end)
+
+
+def fetch_house(start, end):
+    """
+    Returns the daily degree-days, heater energy and intensity in a range.
+
+    Parameters:
+        start (datetime): The beginning of the range.
+        end (datetime): The end of the range.
+
+    Returns:
+        pd.DataFrame: Columns 'time' (datetime) and HOUSE_COLUMNS.
+    """
+    return _fetch("thermal_daily", start, end)
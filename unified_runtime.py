@@ -0,0 +1,111 @@
+"""
+Optional runtime running all services in one process.
+
+Normally app.py, datafetcher.py and scraping_scheduler.py run as separate
+Python interpreters, each with its own copy of SQLAlchemy, the models and
+the other dependencies. This program runs them together on one asyncio
+event loop instead:
+
+- the Dash server in a thread (werkzeug, threaded like app.run),
+- the datafetcher jobs of the `schedule` library, run one after another
+  in a worker thread every second,
+- the scraper scheduler (scraping_scheduler.main) as a task, with the
+  scraper running in a thread of this process.
+
+All of them share one database engine (data_access.engine) and the caches
+of the imported modules. SIGTERM or SIGINT stops the tasks and the server.
+
+house_energy.py supervises this program instead of the separate services
+when the UNIFIED_RUNTIME environment variable is set to 1, and runs the
+weekly database backup itself either way.
+
+Usage:
+    python unified_runtime.py [--host ::] [--port 8050]
+"""
+
+import startup_profiler
+import argparse
+import asyncio
+import signal
+import threading
+import schedule
+
+startup_profiler.mark("imports")
+
+
+def start_dashboard(host, port):
+    """
+    Starts the Dash server in a daemon thread.
+
+    Parameters:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+
+    Returns:
+        BaseWSGIServer: The server, stopped with its shutdown() method.
+    """
+    from werkzeug.serving import make_server
+    import app
+
+    server = make_server(host, port, app.app.server, threaded=True)
+    threading.Thread(
+        target=server.serve_forever, name="dashboard", daemon=True).start()
+
+    return server
+
+
+async def run_schedule(stop):
+    """
+    Runs due jobs of the `schedule` library every second. Jobs block
+    (they download data and write to the database), so they run in
+    a worker thread and the event loop stays free.
+
+    Parameters:
+        stop (asyncio.Event): Set when the runtime stops.
+
+    Returns:
+        None
+    """
+    await asyncio.to_thread(schedule.run_all)
+    while not stop.is_set():
+        await asyncio.to_thread(schedule.run_pending)
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(host, port):
+    # Importing datafetcher registers its jobs in the default scheduler
+    import datafetcher
+    import energy_counter
+    import scraping_scheduler
+
+    if not energy_counter.is_built():
+        energy_counter.rebuild()
+
+    server = start_dashboard(host, port)
+    startup_profiler.mark("init")
+    startup_profiler.report("unified_runtime.py")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    scraper = asyncio.create_task(scraping_scheduler.main(in_process=True))
+    jobs = asyncio.create_task(run_schedule(stop))
+    await stop.wait()
+
+    scraper.cancel()
+    await asyncio.gather(scraper, jobs, return_exceptions=True)
+    server.shutdown()
+    datafetcher.latest_sample_writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="::")
+    parser.add_argument("--port", type=int, default=8050)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
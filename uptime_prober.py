@@ -0,0 +1,325 @@
+"""
+HTTP uptime prober of the dashboard.
+
+The prober runs on another computer (see raspberry_check.py) and requests
+two endpoints of the Dash server through the public address:
+
+- `/health`: the health endpoint of app.py, which checks the database and
+  the age of the latest sample,
+- `/_dash-layout`: the layout JSON the browser loads first, which must
+  contain the 'ELECTRICITY PRODUCTION' heading.
+
+Requests carry the `ngrok-skip-browser-warning` header, so the ngrok
+interstitial page is skipped without a browser. One keep-alive session is
+reused for all requests.
+
+Every probe (time, endpoint, success, status code and response time) is
+stored in a small SQLite file (stdlib sqlite3, the computer running the
+prober has no project database). Availability and response time
+percentiles over any window are computed from it, and the prober alerts
+when a service level objective is breached and when it recovers:
+
+- the site is down for DOWN_AFTER checks in a row,
+- availability over SLO_WINDOW falls below AVAILABILITY_TARGET (judged
+  from MIN_CHECKS checks),
+- the 95th percentile of the layout's response time over LATENCY_WINDOW
+  exceeds LATENCY_TARGET milliseconds,
+- the health endpoint reports stale data.
+
+Usage:
+    python uptime_prober.py [--url URL] [--once]
+
+The module provides the following:
+
+- `percentile(values, fraction)`: Nearest-rank percentile.
+- `UptimeProber`: Probes the endpoints, stores results and sends alerts.
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+import requests
+from dotenv import load_dotenv
+from message_sender import notify, send_message
+
+
+load_dotenv()
+
+SITE_URL = os.getenv("UPTIME_SITE_URL", "http://www.rafalrolkiewicz.com")
+DATABASE_FILE = "logs/uptime.db"
+HEADERS = {"ngrok-skip-browser-warning": "1"}
+LAYOUT_MARKER = "ELECTRICITY PRODUCTION"
+ENDPOINTS = ("/health", "/_dash-layout")
+
+INTERVAL = 60
+TIMEOUT = 15
+DOWN_AFTER = 2
+SLO_WINDOW = timedelta(hours=24)
+AVAILABILITY_TARGET = 0.995
+LATENCY_WINDOW = timedelta(hours=1)
+LATENCY_TARGET = 2000
+RETENTION = 90
+# Availability isn't judged from fewer checks
+MIN_CHECKS = 10
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of the values.
+
+    Parameters:
+        values (list): The values, in any order.
+        fraction (float): The percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float or None: The percentile, None if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def hours(window):
+    return f"{window.total_seconds() / 3600:g} h"
+
+
+class UptimeProber:
+    """
+    Probes the dashboard, stores the results and alerts on SLO breaches.
+
+    Parameters:
+        url (str): The address of the site.
+        database_file (str): The SQLite file with the results.
+        notify: Optional function called with an alert message (str).
+        timeout (float): Time limit of one request in seconds.
+    """
+
+    def __init__(self, url=SITE_URL, database_file=DATABASE_FILE,
+                 notify=None, timeout=TIMEOUT):
+        self.url = url.rstrip("/")
+        self.notify = notify
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        os.makedirs(os.path.dirname(database_file) or ".", exist_ok=True)
+        self.database = sqlite3.connect(database_file)
+        self.database.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "endpoint TEXT NOT NULL, "
+            "time INTEGER NOT NULL, "
+            "ok INTEGER NOT NULL, "
+            "status INTEGER, "
+            "latency_ms REAL, "
+            "PRIMARY KEY (endpoint, time)) WITHOUT ROWID"
+        )
+        self.database.commit()
+        self.failures = 0
+        # Alert name: True while the alert is active
+        self.alerts = {}
+
+    def probe(self, endpoint):
+        """
+        Requests one endpoint and checks the response.
+
+        Parameters:
+            endpoint (str): The path, one of ENDPOINTS.
+
+        Returns:
+            dict: 'ok' (bool), 'status' (int or None), 'latency_ms'
+            (float or None) and 'stale' (bool, from the health endpoint).
+        """
+        start = time.perf_counter()
+        try:
+            response = self.session.get(
+                self.url + endpoint, timeout=self.timeout)
+            latency = (time.perf_counter() - start) * 1000
+        except requests.RequestException:
+            return {"ok": False, "status": None, "latency_ms": None,
+                    "stale": False}
+
+        ok = response.status_code == 200
+        stale = False
+        if ok and endpoint == "/health":
+            try:
+                stale = response.json().get("status") == "stale"
+            except ValueError:
+                ok = False
+        elif ok:
+            ok = LAYOUT_MARKER in response.text
+
+        return {"ok": ok, "status": response.status_code,
+                "latency_ms": round(latency, 1), "stale": stale}
+
+    def check(self, now=None):
+        """
+        Probes all endpoints, stores the results and sends alerts.
+
+        Parameters:
+            now (datetime): Time of the check, now if None.
+
+        Returns:
+            bool: True if all endpoints responded correctly.
+        """
+        now = now or datetime.now().replace(microsecond=0)
+        results = {endpoint: self.probe(endpoint) for endpoint in ENDPOINTS}
+        moment = int(now.timestamp())
+
+        with self.database:
+            self.database.executemany(
+                "INSERT OR REPLACE INTO probes "
+                "(endpoint, time, ok, status, latency_ms) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (endpoint, moment, result["ok"], result["status"],
+                     result["latency_ms"])
+                    for endpoint, result in results.items()
+                ],
+            )
+            self.database.execute(
+                "DELETE FROM probes WHERE time < ?",
+                (moment - RETENTION * 86400,),
+            )
+
+        up = all(result["ok"] for result in results.values())
+        self.failures = 0 if up else self.failures + 1
+        self.evaluate(now, up, results["/health"]["stale"])
+
+        return up
+
+    def evaluate(self, now, up, stale):
+        """
+        Compares the latest state with the objectives and sends an alert
+        when an objective is breached or met again.
+
+        Parameters:
+            now (datetime): Time of the check.
+            up (bool): Result of the latest check.
+            stale (bool): The health endpoint reported stale data.
+
+        Returns:
+            None
+        """
+        summary = self.summary(SLO_WINDOW, now)
+        latency = self.summary(LATENCY_WINDOW, now)["/_dash-layout"]["p95"]
+        availabilities = [values["availability"]
+                          for values in summary.values()
+                          if values["checks"] >= MIN_CHECKS]
+        availability = min(availabilities) if availabilities else None
+
+        self._alert(
+            "down", self.failures >= DOWN_AFTER, now,
+            f"Raspberry offline! {self.failures} failed checks in a row.",
+            "Raspberry online!")
+        self._alert(
+            "availability",
+            availability is not None and availability < AVAILABILITY_TARGET,
+            now,
+            f"Availability over {hours(SLO_WINDOW)} is {availability:.2%}, "
+            f"below the target of {AVAILABILITY_TARGET:.1%}."
+            if availability is not None else "",
+            f"Availability is back above {AVAILABILITY_TARGET:.1%}.")
+        self._alert(
+            "latency", latency is not None and latency > LATENCY_TARGET, now,
+            f"95th percentile of the layout's response time over "
+            f"{hours(LATENCY_WINDOW)} is {latency:.0f} ms, above the target "
+            f"of {LATENCY_TARGET} ms." if latency is not None else "",
+            f"Response time is back below {LATENCY_TARGET} ms.")
+        self._alert(
+            "stale", up and stale, now,
+            "The dashboard is up, but its latest sample is stale.",
+            "The dashboard's data is up to date again.")
+
+    def _alert(self, name, breached, now, message, recovery):
+        """
+        Sends a message when an alert changes its state, so a breach is
+        reported once and not on every check.
+
+        Parameters:
+            name (str): The name of the alert.
+            breached (bool): The objective is breached now.
+            now (datetime): Time of the check.
+            message (str): The message sent when the breach starts.
+            recovery (str): The message sent when it ends.
+
+        Returns:
+            None
+        """
+        if breached == self.alerts.get(name, False):
+            return
+        self.alerts[name] = breached
+        notify(f"{now} {message if breached else recovery}", self.notify)
+
+    def summary(self, window, now=None):
+        """
+        Returns availability and response time percentiles of every
+        endpoint over a window.
+
+        Parameters:
+            window (timedelta): The length of the window.
+            now (datetime): The end of the window, now if None.
+
+        Returns:
+            dict: Endpoint: dictionary with 'checks', 'availability'
+            (fraction, None without checks) and 'p50', 'p95' and 'p99'
+            response times in milliseconds of successful checks.
+        """
+        end = int((now or datetime.now()).timestamp())
+        start = end - int(window.total_seconds())
+        summary = {}
+        for endpoint in ENDPOINTS:
+            rows = self.database.execute(
+                "SELECT ok, latency_ms FROM probes "
+                "WHERE endpoint = ? AND time > ? AND time <= ?",
+                (endpoint, start, end),
+            ).fetchall()
+            latencies = [latency for ok, latency in rows if ok]
+            summary[endpoint] = {
+                "checks": len(rows),
+                "availability": len(latencies) / len(rows) if rows else None,
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+            }
+
+        return summary
+
+    def close(self):
+        self.session.close()
+        self.database.close()
+
+
+def print_summary(prober):
+    for label, window in (("1 hour", timedelta(hours=1)),
+                          ("24 hours", timedelta(hours=24)),
+                          ("30 days", timedelta(days=30))):
+        for endpoint, values in prober.summary(window).items():
+            availability = values["availability"]
+            print(
+                f"{label:<9} {endpoint:<14} {values['checks']:>6} checks, "
+                + (f"availability {availability:.2%}, " if availability
+                   is not None else "")
+                + ", ".join(f"{name} {values[name]:.0f} ms"
+                            for name in ("p50", "p95", "p99")
+                            if values[name] is not None))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default=SITE_URL)
+    parser.add_argument("--once", action="store_true",
+                        help="check once and print the summary")
+    args = parser.parse_args()
+
+    if args.once:
+        prober = UptimeProber(args.url)
+        prober.check()
+        print_summary(prober)
+    else:
+        prober = UptimeProber(args.url, notify=send_message)
+        while True:
+            prober.check()
+            time.sleep(INTERVAL)